@@ -0,0 +1,424 @@
+import argparse
+import os
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+try:
+    import numpy as np
+except ImportError:  # In requirements.txt; without it summarize_answers_columnar falls back to summarize_answers
+    np = None
+
+COLUMNAR_MIN_ANSWERS = 1000  # Below this, NumPy's per-call overhead outweighs the gain
+AUDITED_FIELDS = ('response_count', 'last_submitted_at')
+
+
+def histogram_key(value):
+    """Encode an answer value as a histogram key that is safe to use in a Mongo field path."""
+    if isinstance(value, bool):
+        value = int(value)
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value)).replace('.', '_')
+
+
+def histogram_value(key):
+    """Decode a histogram key produced by histogram_key back into a number."""
+    return float(key.replace('_', '.')) if '_' in key else int(key)
+
+
+def submission_increments(survey, answers):
+    """
+    Build the $inc document that folds one submission into a survey aggregate.
+
+    Args:
+        survey (dict): The survey definition the answers belong to.
+        answers (dict): The stored answers map, keyed by question ID string.
+
+    Returns:
+        dict: Dotted field paths mapped to increments.
+    """
+    response_types = {str(q['id']): q['response_type'] for q in survey['questions']}
+    increments = {'response_count': 1}
+    for question_id, value in answers.items():
+        prefix = f"questions.{question_id}"
+        increments[f"{prefix}.count"] = 1
+        if response_types.get(question_id) == 'scale':
+            score = int(value) if isinstance(value, bool) else value
+            increments[f"{prefix}.sum"] = score
+            increments[f"{prefix}.sum_sq"] = score * score
+            increments[f"{prefix}.histogram.{histogram_key(score)}"] = 1
+        elif response_types.get(question_id) == 'boolean':
+            increments[f"{prefix}.true_count"] = 1 if value else 0
+    return increments
+
+
+def batch_increments(survey, submissions):
+    """Sum the $inc documents of many submissions into one. Returns it and the latest submitted_at."""
+    increments = {}
+    for submission in submissions:
+        for path, amount in submission_increments(survey, submission['answers']).items():
+            increments[path] = increments.get(path, 0) + amount
+    return increments, max(submission['submitted_at'] for submission in submissions)
+
+
+def apply_increments(aggregate, increments):
+    """Apply a $inc document to an in-memory aggregate, the same way Mongo would."""
+    for path, amount in increments.items():
+        *parents, field = path.split('.')
+        node = aggregate
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[field] = node.get(field, 0) + amount
+    return aggregate
+
+
+def empty_aggregate(survey_id):
+    return {
+        '_id': survey_id,
+        'response_count': 0,
+        'version': 0,
+        'questions': {}
+    }
+
+
+def summarize_answers(survey, answers):
+    """Fold a list of answer documents into an aggregate in a single pass."""
+    aggregate = empty_aggregate(survey['survey_id'])
+    for answer in answers:
+        apply_increments(aggregate, submission_increments(survey, answer['answers']))
+        submitted_at = answer.get('submitted_at')
+        if submitted_at and submitted_at >= aggregate.get('last_submitted_at', submitted_at):
+            aggregate['last_submitted_at'] = submitted_at
+    return aggregate
+
+
+def summarize_answers_columnar(survey, answers):
+    """
+    summarize_answers for large answer lists, vectorized with NumPy when it is installed.
+
+    Each question's answers are gathered into one column, then counts, sums, sums of
+    squares and histograms come from array operations (np.bincount for the histogram).
+    A scale column holding any non-integral score is summed in Python, in submission
+    order, so the result always equals summarize_answers exactly.
+    """
+    if np is None or len(answers) < COLUMNAR_MIN_ANSWERS:
+        return summarize_answers(survey, answers)
+
+    response_types = {str(q['id']): q['response_type'] for q in survey['questions']}
+    aggregate = empty_aggregate(survey['survey_id'])
+    aggregate['response_count'] = len(answers)
+    columns = {}
+    for answer in answers:
+        for question_id, value in answer['answers'].items():
+            column = columns.get(question_id)
+            if column is None:
+                column = columns[question_id] = []
+            column.append(value)
+        submitted_at = answer.get('submitted_at')
+        if submitted_at and submitted_at >= aggregate.get('last_submitted_at', submitted_at):
+            aggregate['last_submitted_at'] = submitted_at
+
+    for question_id, values in columns.items():
+        summary = aggregate['questions'][question_id] = {'count': len(values)}
+        if response_types.get(question_id) == 'scale':
+            summary.update(scale_column_summary(values))
+        elif response_types.get(question_id) == 'boolean':
+            summary['true_count'] = int(np.count_nonzero(np.fromiter(map(bool, values), dtype=bool, count=len(values))))
+    return aggregate
+
+
+def scale_column_summary(values):
+    """Sum, sum of squares and histogram of one scale question's scores."""
+    if not all(isinstance(value, int) for value in values):
+        # Float sums depend on the order of addition, so add up in submission order
+        total = total_sq = 0
+        histogram = {}
+        for value in values:
+            key = histogram_key(value)
+            total += value
+            total_sq += value * value
+            histogram[key] = histogram.get(key, 0) + 1
+        return {'sum': total, 'sum_sq': total_sq, 'histogram': histogram}
+
+    scores = np.fromiter(values, dtype=np.int64, count=len(values))
+    low = int(scores.min())
+    counts = np.bincount(scores - low)
+    return {
+        'sum': int(scores.sum()),
+        'sum_sq': int(np.dot(scores, scores)),
+        'histogram': {histogram_key(low + offset): int(counts[offset]) for offset in np.flatnonzero(counts)}
+    }
+
+
+def aggregate_differences(stored, computed):
+    """The fields, and questions as 'questions.<id>', where a stored aggregate differs from a recomputed one."""
+    differences = [field for field in AUDITED_FIELDS if stored.get(field) != computed.get(field)]
+    stored_questions, computed_questions = stored.get('questions', {}), computed.get('questions', {})
+    for question_id in sorted(set(stored_questions) | set(computed_questions)):
+        if stored_questions.get(question_id) != computed_questions.get(question_id):
+            differences.append(f'questions.{question_id}')
+    return differences
+
+
+def summary_pipeline(survey_id):
+    """
+    Aggregation pipeline that summarizes a survey's answers on the server.
+
+    The answers map is unwound with $objectToArray and grouped by (question, value),
+    so only one row per distinct answer value per question comes back over the wire.
+    """
+    return [
+        {'$match': {'survey_id': survey_id}},
+        {'$project': {'_id': 0, 'submitted_at': 1, 'answers': {'$objectToArray': '$answers'}}},
+        {'$facet': {
+            'totals': [
+                {'$group': {
+                    '_id': None,
+                    'response_count': {'$sum': 1},
+                    'last_submitted_at': {'$max': '$submitted_at'}
+                }}
+            ],
+            'values': [
+                {'$unwind': '$answers'},
+                {'$group': {
+                    '_id': {'question_id': '$answers.k', 'value': '$answers.v'},
+                    'count': {'$sum': 1}
+                }}
+            ]
+        }}
+    ]
+
+
+def fold_value_counts(survey, totals, values):
+    """Turn the output of summary_pipeline into an aggregate document."""
+    aggregate = empty_aggregate(survey['survey_id'])
+    if totals:
+        aggregate['response_count'] = totals[0]['response_count']
+        if totals[0].get('last_submitted_at'):
+            aggregate['last_submitted_at'] = totals[0]['last_submitted_at']
+
+    response_types = {str(q['id']): q['response_type'] for q in survey['questions']}
+    for row in values:
+        question_id = row['_id']['question_id']
+        value = row['_id']['value']
+        count = row['count']
+        summary = aggregate['questions'].setdefault(question_id, {})
+        summary['count'] = summary.get('count', 0) + count
+        if response_types.get(question_id) == 'scale':
+            score = int(value) if isinstance(value, bool) else value
+            histogram = summary.setdefault('histogram', {})
+            key = histogram_key(score)
+            summary['sum'] = summary.get('sum', 0) + score * count
+            summary['sum_sq'] = summary.get('sum_sq', 0) + score * score * count
+            histogram[key] = histogram.get(key, 0) + count
+        elif response_types.get(question_id) == 'boolean':
+            summary['true_count'] = summary.get('true_count', 0) + (count if value else 0)
+    return aggregate
+
+
+class SurveyAggregates:
+    """
+    Per-survey aggregate documents, maintained incrementally on every submission.
+
+    Each document holds the response count, the time of the latest submission and,
+    per question, the answer count plus either the sum, sum of squares and score
+    histogram (scale questions) or the number of true answers (boolean questions).
+    That is everything the survey and results endpoints need, so reading them costs
+    one lookup regardless of how many answers a survey has collected.
+
+    A version counter is bumped by every write, so it identifies the state of the
+    document for conditional requests.
+    """
+
+    def __init__(self, db, collection_name='survey_aggregates'):
+        self.db = db
+        self.aggregates = self.db[collection_name]
+
+    def create(self, survey_id):
+        """Create the empty aggregate for a newly created survey."""
+        try:
+            self.aggregates.insert_one(empty_aggregate(survey_id))
+        except DuplicateKeyError:
+            pass
+
+    def record_submission(self, survey, answers, submitted_at):
+        """Atomically fold a stored submission into the survey aggregate."""
+        result = self.aggregates.update_one(
+            {'_id': survey['survey_id']},
+            {
+                '$inc': {**submission_increments(survey, answers), 'version': 1},
+                '$max': {'last_submitted_at': submitted_at}
+            }
+        )
+        if result.matched_count == 0:
+            # Surveys created before aggregates existed have no document yet. The
+            # submission is already stored, so a rebuild picks it up.
+            self.rebuild(survey)
+
+    def record_submissions(self, survey, submissions):
+        """Fold a batch of stored submissions into the survey aggregate with a single update."""
+        increments, submitted_at = batch_increments(survey, submissions)
+        result = self.aggregates.update_one(
+            {'_id': survey['survey_id']},
+            {'$inc': {**increments, 'version': 1}, '$max': {'last_submitted_at': submitted_at}}
+        )
+        if result.matched_count == 0:
+            self.rebuild(survey)
+
+    def get(self, survey):
+        """Get the aggregate for a survey, rebuilding it from the answers if it is missing."""
+        aggregate = self.aggregates.find_one({'_id': survey['survey_id']})
+        if aggregate is None:
+            aggregate = self.rebuild(survey)
+        return aggregate
+
+    def summarize(self, survey):
+        """Compute a survey's aggregate from its stored answers with a single aggregation."""
+        result = next(self.db.answers.aggregate(summary_pipeline(survey['survey_id'])), {})
+        return fold_value_counts(survey, result.get('totals', []), result.get('values', []))
+
+    def rebuild(self, survey):
+        """Recompute and store the aggregate for a survey from its stored answers."""
+        aggregate = self.summarize(survey)
+        # Versions never exceed the response count, so starting from it cannot
+        # repeat a version an earlier document had with different contents
+        aggregate['version'] = aggregate['response_count']
+        try:
+            self.aggregates.insert_one(aggregate)
+        except DuplicateKeyError:
+            # Another worker rebuilt it first.
+            aggregate = self.aggregates.find_one({'_id': survey['survey_id']})
+        return aggregate
+
+    def recompute(self, survey):
+        """
+        Compute a survey's aggregate from its answer documents in this process.
+
+        Unlike summarize, this does not go through summary_pipeline, so an audit
+        compares the stored aggregate with an independent computation. Large surveys
+        are summarized column by column with NumPy.
+        """
+        answers = list(self.db.answers.find({'survey_id': survey['survey_id']}, {'_id': 0, 'answers': 1, 'submitted_at': 1}))
+        return summarize_answers_columnar(survey, answers)
+
+    def audit(self, survey, fix=False):
+        """
+        Compare a survey's stored aggregate with one recomputed from its answers.
+
+        Args:
+            survey (dict): The survey to audit.
+            fix (bool): Replace a stored aggregate that differs with the recomputed one.
+
+        Returns:
+            tuple: The outcome, 'ok', 'drifted', 'fixed' or 'busy' (answers arrived
+            while recomputing, so the comparison proves nothing; audit again later),
+            and the list of differences from aggregate_differences.
+        """
+        stored = self.aggregates.find_one({'_id': survey['survey_id']})
+        computed = self.recompute(survey)
+        current = self.aggregates.find_one({'_id': survey['survey_id']})
+        if (stored or {}).get('version') != (current or {}).get('version'):
+            return 'busy', []
+        differences = aggregate_differences(stored or empty_aggregate(survey['survey_id']), computed)
+        if not differences:
+            return 'ok', []
+        if not fix:
+            return 'drifted', differences
+        if stored is None:
+            computed['version'] = computed['response_count']
+            try:
+                self.aggregates.insert_one(computed)
+            except DuplicateKeyError:
+                return 'busy', differences
+        else:
+            # Only if no submission has been recorded since it was read
+            computed['version'] = stored['version'] + 1
+            result = self.aggregates.replace_one({'_id': survey['survey_id'], 'version': stored['version']}, computed)
+            if result.matched_count == 0:
+                return 'busy', differences
+        return 'fixed', differences
+
+
+class AsyncSurveyAggregates:
+    """SurveyAggregates for a database from pymongo's AsyncMongoClient, used by async_app.py."""
+
+    def __init__(self, db, collection_name='survey_aggregates'):
+        self.db = db
+        self.aggregates = self.db[collection_name]
+
+    async def create(self, survey_id):
+        try:
+            await self.aggregates.insert_one(empty_aggregate(survey_id))
+        except DuplicateKeyError:
+            pass
+
+    async def record_submission(self, survey, answers, submitted_at):
+        result = await self.aggregates.update_one(
+            {'_id': survey['survey_id']},
+            {
+                '$inc': {**submission_increments(survey, answers), 'version': 1},
+                '$max': {'last_submitted_at': submitted_at}
+            }
+        )
+        if result.matched_count == 0:
+            await self.rebuild(survey)
+
+    async def record_submissions(self, survey, submissions):
+        increments, submitted_at = batch_increments(survey, submissions)
+        result = await self.aggregates.update_one(
+            {'_id': survey['survey_id']},
+            {'$inc': {**increments, 'version': 1}, '$max': {'last_submitted_at': submitted_at}}
+        )
+        if result.matched_count == 0:
+            await self.rebuild(survey)
+
+    async def find(self, survey_id):
+        """The stored aggregate, or None. Unlike get, this does not need the survey first."""
+        return await self.aggregates.find_one({'_id': survey_id})
+
+    async def get(self, survey):
+        aggregate = await self.find(survey['survey_id'])
+        if aggregate is None:
+            aggregate = await self.rebuild(survey)
+        return aggregate
+
+    async def summarize(self, survey):
+        cursor = await self.db.answers.aggregate(summary_pipeline(survey['survey_id']))
+        result = next(iter(await cursor.to_list(1)), {})
+        return fold_value_counts(survey, result.get('totals', []), result.get('values', []))
+
+    async def rebuild(self, survey):
+        aggregate = await self.summarize(survey)
+        aggregate['version'] = aggregate['response_count']
+        try:
+            await self.aggregates.insert_one(aggregate)
+        except DuplicateKeyError:
+            aggregate = await self.find(survey['survey_id'])
+        return aggregate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit survey aggregates against the stored answers.")
+    commands = parser.add_subparsers(dest='action', required=True)
+    audit = commands.add_parser('audit', help="Recompute aggregates from the answers and report the ones that differ")
+    audit.add_argument('survey_ids', nargs='*', help="Surveys to audit, all of them by default")
+    audit.add_argument('--fix', action='store_true', help="Replace the aggregates that differ")
+    args = parser.parse_args(argv)
+
+    client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/percept"))
+    db = client.get_default_database()
+    survey_aggregates = SurveyAggregates(db)
+    query = {'survey_id': {'$in': args.survey_ids}} if args.survey_ids else {}
+    outcomes = {}
+    for survey in db.surveys.find(query, {'_id': 0}):
+        outcome, differences = survey_aggregates.audit(survey, fix=args.fix)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome != 'ok':
+            print(f"{survey['survey_id']}: {outcome} {', '.join(differences)}".rstrip())
+    client.close()
+    print(', '.join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items())) or "No surveys")
+    return 1 if outcomes.get('drifted') else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
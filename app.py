@@ -1,17 +1,35 @@
 # app.py
 
-import datetime
-from statistics import StatisticsError, mean, stdev
 import time
+# Worker boot is timed from here, so keep this first
+BOOT_STARTED = time.perf_counter()
+
+import datetime
 from flask import Flask, request, jsonify
 from flask_pymongo import PyMongo
 from flask_cors import CORS
 import os
 import logging
-from id_manager import IDManager
+import logs
+from id_manager import (
+    ID_RESERVE_HIGH_WATERMARK, ID_RESERVE_LOW_WATERMARK, ID_SUGGESTIONS, MAX_ID_CHECK_BATCH, IDManager
+)
+from aggregates import SurveyAggregates
+from counters import GlobalCounters
+from metrics import PROMETHEUS_CONTENT_TYPE, Metrics
+from profiling import PROFILE_HEADER, RequestProfiler
+from survey_cache import SurveyCache
+from surveys import (
+    EXPIRED_CACHE_CONTROL, RESULTS_CACHE_CONTROL, SURVEY_CACHE_CONTROL, PopulationCache, aggregate_is_trending,
+    MAX_SUBMISSION_BATCH, created_survey_response, new_submission, new_submission_batch, new_survey, response_etag, results_response,
+    submission_batch_response, submission_response, survey_expiry, survey_response, user_codes_needed,
+    validate_submission_batch
+)
 from pymongo.errors import ConnectionFailure
-from snowflake import Snowflake53
+from worker_lease import WorkerLease
+from write_buffer import WRITE_BUFFER_ENABLED, WriteBuffer, WriteBufferFull
 
+IMPORTS_DONE = time.perf_counter()
 
 app = Flask(__name__)
 
@@ -29,89 +47,92 @@ CORS(app, resources={
 
 api_prefix = os.getenv('API_PREFIX', '')  # Default to empty string if not set
 
-# Initialize the generator with a random number 
-snowflake = Snowflake53(1,1)
-
-# Constants
-MINIMUM_RESPONSES = 5
-ID_SUGGESTIONS = 5
-INITIAL_ID_RESERVE = 300  # Number of IDs to generate initially
-DEFAULT_EXPIRY = datetime.timedelta(days=5)  # New constant for default expiry
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging: JSON lines written off the request thread, levels per category (see logs.py)
+logs.configure_logging()
+log = logging.getLogger('percept.app')
 
 # MongoDB configuration
 if app.testing:
     app.config["MONGO_URI"] = "mongodb://localhost:27017/backfeed_test"
 else:
     app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/percept")
-mongo = PyMongo(app)
+# Request latencies and the Mongo commands each request issues, for GET /metrics
+metrics = Metrics()
+# Opt-in cProfile captures of signed or sampled requests (PROFILE_SECRET, PROFILE_SAMPLE_RATE)
+profiler = RequestProfiler()
+mongo = PyMongo(app, event_listeners=[metrics.command_listener, profiler.command_listener])
 
 # Initialize IDManager
 id_manager = IDManager(mongo.db)
-
-def make_tz_aware(dt):
-    if isinstance(dt, str):
-        dt = datetime.datetime.fromisoformat(dt)
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=datetime.UTC)
-    return dt
-
+survey_aggregates = SurveyAggregates(mongo.db)
+# Population statistics are the same for every user of a survey version
+population_cache = PopulationCache()
+# Survey definitions never change, so workers keep the ones they have read
+survey_cache = SurveyCache()
+# Totals for /v1/stats, maintained on write instead of counted per request
+global_counters = GlobalCounters(mongo.db)
+# Each worker process leases its own Snowflake datacenter/worker ID pair on first use
+worker_lease = WorkerLease(mongo.db)
+# Opt-in group commit of answer submissions (WRITE_BUFFER=1)
+write_buffer = WriteBuffer(mongo.db, survey_aggregates, id_manager, global_counters) if WRITE_BUFFER_ENABLED else None
 
 def initialize_db(max_retries=5, delay=5):
     for attempt in range(max_retries):
         try:
             # The ismaster command is cheap and does not require auth.
             mongo.db.command('ismaster')
-            logging.info("Successfully connected to MongoDB")
+            log.info("Successfully connected to MongoDB")
             return True
         except ConnectionFailure:
             if attempt < max_retries - 1:
-                logging.error(f"Failed to connect to MongoDB. Retrying in {delay} seconds...")
+                log.error("Failed to connect to MongoDB. Retrying in %s seconds...", delay)
                 time.sleep(delay)
             else:
-                logging.error("Failed to connect to MongoDB after maximum retries")
+                log.error("Failed to connect to MongoDB after maximum retries")
                 return False
 
 
 def generate_unique_id():
-    return snowflake.generate()
+    return worker_lease.generator().generate()
 
 # Initialize the ID reserve
 with app.app_context():
     if initialize_db():
         try:
-            id_manager.initialize_reserve(INITIAL_ID_RESERVE)
-            app.logger.info(f"Initialized ID reserve with {INITIAL_ID_RESERVE} IDs")
+            id_manager.start_replenisher(ID_RESERVE_LOW_WATERMARK, ID_RESERVE_HIGH_WATERMARK)
+            log.info("Started ID reserve replenisher (%s-%s IDs)", ID_RESERVE_LOW_WATERMARK, ID_RESERVE_HIGH_WATERMARK)
         except Exception as e:
-            app.logger.error(f"Failed to initialize ID reserve: {str(e)}")
+            log.error("Failed to start ID reserve replenisher: %s", e)
+        global_counters.start_reconciler()
     else:
-        app.logger.error("Failed to initialize database connection")
+        log.error("Failed to initialize database connection")
+
+log.info("Worker booted in %.0f ms (imports %.0f ms)",
+         (time.perf_counter() - BOOT_STARTED) * 1000, (IMPORTS_DONE - BOOT_STARTED) * 1000)
 
 @app.before_first_request
 def startup_logger():
-    app.logger.info("Application started. Testing MongoDB connection...")
+    log.info("Application started. Testing MongoDB connection...")
     try:
         # Perform a simple operation to test the connection
         mongo.db.command('ping')
-        app.logger.info("MongoDB connection successful")
+        log.info("MongoDB connection successful")
     except Exception as e:
-        app.logger.error(f"MongoDB connection failed: {str(e)}")
+        log.error("MongoDB connection failed: %s", e)
+
+def cache_headers(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def not_modified(etag, cache_control):
+    """Empty 304 for a conditional GET whose If-None-Match still matches the current ETag."""
+    return cache_headers(app.response_class(status=304), etag, cache_control)
 
 @app.route(f'{api_prefix}/')
 def home():
     return "Welcome to the Percept API", 200
 
-def get_participant_bucket(count):
-    if count < 10:
-        return "< 10"
-    elif 10 <= count < 100:
-        return "10-100"
-    elif 100 <= count < 1000:
-        return "100-1000"
-    else:
-        return "1000+"
-
 @app.route(f'{api_prefix}/v1/ids/check', methods=['GET'])
 def check_id():
     id_to_check = request.args.get('id')
@@ -125,11 +146,28 @@ def check_id():
             'error': 'Invalid ID format. ID must be at least 5 characters long and contain only letters, numbers, and hyphens.'
         }), 400
 
-    available = id_manager.is_id_available(id_to_check)
+    available = id_manager.is_id_available(id_to_check, use_filter=True)
     return jsonify({
         'id': id_to_check,
         'available': available
     })
+
+@app.route(f'{api_prefix}/v1/ids/check', methods=['POST'])
+def check_ids():
+    data = request.json
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'No IDs provided'}), 400
+    if len(ids) > MAX_ID_CHECK_BATCH:
+        return jsonify({'error': f"At most {MAX_ID_CHECK_BATCH} IDs can be checked at once"}), 400
+
+    results = []
+    for id_to_check, available in zip(ids, id_manager.check_ids(ids)):
+        result = {'id': id_to_check, 'available': available}
+        if not id_manager.is_valid_id_format(id_to_check):
+            result['error'] = 'Invalid ID format'
+        results.append(result)
+    return jsonify({'ids': results})
     
 @app.route(f'{api_prefix}/v1/ids', methods=['GET'])
 def get_ids():
@@ -142,21 +180,27 @@ def get_ids():
         'ids': ids
     })
        
+@app.route(f'{api_prefix}/v1/ids/stats', methods=['GET'])
+def get_id_reserve_stats():
+    if not id_manager.replenisher:
+        return jsonify({'error': 'ID reserve replenisher is not running'}), 503
+    return jsonify(id_manager.replenisher.stats())
+
 @app.route(f'{api_prefix}/v1/surveys', methods=['POST'])
 def create_survey():
-    app.logger.debug("Received POST request to /api/v1/surveys")
+    log.debug("Received POST request to /api/v1/surveys")
     data = request.json
-    app.logger.debug(f"Request data: {data}")
+    log.debug("Request data: %s", data)
     if 'survey_id' not in data :
         data['survey_id'] = id_manager.get_ids()[0]
-        app.logger.debug("Creating surveyID: "+data['survey_id'])
+        log.debug("Creating surveyID: %s", data['survey_id'])
     
     if 'user_code' not in data :
         data['user_code'] = id_manager.get_ids()[0]
-        app.logger.debug("Creating userCode: "+data['user_code'])
+        log.debug("Creating userCode: %s", data['user_code'])
 
     if not data or 'title' not in data or 'questions' not in data or 'user_code' not in data:
-        app.logger.warning("Invalid request data")
+        log.warning("Invalid request data")
         return jsonify({'error': 'Invalid request data'}), 400
     
     try:
@@ -165,209 +209,166 @@ def create_survey():
     
         # Check if the IDs are available, including reserved IDs
         if not id_manager.is_id_available(survey_id, include_reserved=True):
-            app.logger.warning(f"Requested survey ID is not available: survey_id={survey_id}")
+            log.warning("Requested survey ID is not available: survey_id=%s", survey_id)
             return jsonify({'error': 'Requested survey ID is not available'}), 400
         
         if not id_manager.is_id_available(user_code, include_reserved=True):
-            app.logger.warning(f"Requested user code is not available: user_code={user_code}")
+            log.warning("Requested user code is not available: user_code=%s", user_code)
             return jsonify({'error': 'Requested user code is not available'}), 400
 
 
-        # Handle expiry date
-        expiry_date = data.get('expiry')
-        if expiry_date:
-            expiry_date = make_tz_aware(datetime.datetime.fromisoformat(expiry_date))
-        else:
-            expiry_date = make_tz_aware(datetime.datetime.now(datetime.UTC) + DEFAULT_EXPIRY)
-
-        survey = {
-            'survey_id': survey_id,
-            'title': data['title'],
-            'description': data.get('description', ''),
-            'questions': [
-                {
-                    'id': i + 1,
-                    'text': q['text'],
-                    'response_type': q['response_type'],
-                    'response_scale_max': q.get('response_scale_max', MINIMUM_RESPONSES),
-                    'creator_answer': q['creator_answer']
-                } for i, q in enumerate(data['questions'])
-            ],
-            'user_code': user_code,
-            'expiry_date': expiry_date
-        }
+        survey = new_survey(data, survey_id, user_code)
         
         # Insert the survey into the database
         result = mongo.db.surveys.insert_one(survey)
         
         if result.inserted_id:
-            app.logger.debug(f"Survey created with ID: {survey_id}")
+            log.debug("Survey created with ID: %s", survey_id)
             
             # Mark the IDs as used only after successful insertion
             id_manager.mark_id_as_used(survey_id)
             id_manager.mark_id_as_used(user_code)
+            survey_aggregates.create(survey_id)
+            global_counters.record_survey()
             
-            response = jsonify({
-                'survey_id': survey_id,
-                'share_link': f"/participate/{survey_id}",
-                'user_code': user_code,
-                'questions': [{'id': q['id'], 'text': q['text']} for q in survey['questions']],
-                'expiry_date': expiry_date.isoformat()
-            })
-            app.logger.debug(f"Sending response: {response.get_data(as_text=True)}")
+            response = jsonify(created_survey_response(survey))
             return response, 201
         else:
-            app.logger.error("Failed to insert survey into database")
+            log.error("Failed to insert survey into database")
             return jsonify({'error': 'Failed to create survey'}), 500
     
     except Exception as e:
-        app.logger.error(f"Error creating survey: {str(e)}")
+        log.error("Error creating survey: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
+def find_survey(survey_id):
+    """The survey with this ID, from the survey cache when possible, or None. Do not modify it."""
+    survey = survey_cache.get(survey_id)
+    if survey is None:
+        survey = mongo.db.surveys.find_one({'survey_id': survey_id})
+        if survey:
+            survey = survey_cache.put(survey)
+    return survey
+
+def find_survey_by_creator(user_code):
+    """The survey created with this user code, from the survey cache when possible, or None."""
+    survey = survey_cache.get_by_user_code(user_code)
+    if survey is None:
+        survey = mongo.db.surveys.find_one({'user_code': user_code})
+        if survey:
+            survey = survey_cache.put(survey)
+    return survey
+
 @app.route(f'{api_prefix}/v1/surveys/<string:survey_id>', methods=['GET'])
 def get_survey(survey_id):
-    app.logger.debug(f"Received GET request for survey ID: {survey_id}")
-    survey = mongo.db.surveys.find_one({'survey_id': survey_id})
+    log.debug("Received GET request for survey ID: %s", survey_id)
+    # Cached surveys have no _id field
+    survey = find_survey(survey_id)
     if not survey:
-        app.logger.warning(f"Survey not found: {survey_id}")
+        log.warning("Survey not found: %s", survey_id)
         return jsonify({'error': 'Survey not found'}), 404
     
-    # Remove the _id field from the survey dict
-    survey.pop('_id', None)
-    
     # Check if the survey has expired
-    expiry_date = make_tz_aware(survey.get('expiry_date', datetime.datetime.now(datetime.UTC) + DEFAULT_EXPIRY))
-    is_expired = expiry_date < datetime.datetime.now(datetime.UTC)
+    now_time = datetime.datetime.now(datetime.UTC)
+    expiry_date, is_expired = survey_expiry(survey, now_time)
     
     if is_expired:
-        return jsonify({'error': 'Survey has expired', 'expired': True}), 410
+        response = jsonify({'error': 'Survey has expired', 'expired': True})
+        response.headers['Cache-Control'] = EXPIRED_CACHE_CONTROL
+        return response, 410
     
-    # Calculate trending status
-    twenty_four_hours_ago = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=24)
-    recent_answers = mongo.db.answers.find_one({
-        'survey_id': survey_id,
-        'submitted_at': {'$gte': twenty_four_hours_ago}
-    })
-    is_trending = bool(recent_answers)
-    
-    # Calculate participant bucket
-    total_answers = mongo.db.answers.count_documents({'survey_id': survey_id})
-    participant_bucket = get_participant_bucket(total_answers)
-    
-    # Prepare the response data
-    response_data = {
-        'survey_id': survey['survey_id'],
-        'title': survey['title'],
-        'description': survey.get('description', ''),
-        'questions': [
-            {
-                'id': q['id'],
-                'text': q['text'],
-                'response_type': q['response_type'],
-                'response_scale_max': q.get('response_scale_max'),
-                'answer_distribution': {}
-            } for q in survey['questions']
-        ],
-        'is_trending': is_trending,
-        'participant_bucket': participant_bucket,
-        'expiry_date': expiry_date.isoformat(),
-        'expired': is_expired,
-        'total_responses': total_answers,
-        'current_responses': total_answers,
-        'minimum_responses': MINIMUM_RESPONSES,
-        'remaining_responses': max(0, MINIMUM_RESPONSES - total_answers),
-        'status': 'incomplete' if total_answers < MINIMUM_RESPONSES else 'complete'
-    }
-    app.logger.debug(f"Base json for survey {response_data}")
-    # Calculate answer distribution for each question if we have enough responses
-    if total_answers >= MINIMUM_RESPONSES:
-        for question in response_data['questions']:
-            answers = [a['answers'].get(str(question['id'])) for a in mongo.db.answers.find({'survey_id': survey_id}, {'answers': 1})]
-            if question['response_type'] == 'scale':
-                total_answers = len(answers)
-                distribution = {score: answers.count(score) for score in range(1, question['response_scale_max'] + 1)}
-                question['answer_distribution'] = {score: (count / total_answers * 100) if total_answers > 0 else 0 
-                                                   for score, count in distribution.items()}
-            elif question['response_type'] == 'boolean':
-                true_count = sum(answers)
-                total_count = len(answers)
-                question['answer_distribution'] = {
-                    'true_percentage': round(true_count / total_count * 100, 2) if total_count > 0 else 0,
-                    'false_percentage': round((total_count - true_count) / total_count * 100, 2) if total_count > 0 else 0
-                }
-
-    app.logger.debug(f"Returning survey data: {response_data}")
-    return jsonify(response_data)
+    # Trending status and the participant bucket come from the aggregate, so neither
+    # this nor a 304 for a client that already has the current version reads answers
+    aggregate = survey_aggregates.get(survey)
+    is_trending = aggregate_is_trending(aggregate, now_time)
+    etag = response_etag(survey_id, aggregate, is_trending, is_expired)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, SURVEY_CACHE_CONTROL)
+
+    response_data = survey_response(survey, aggregate, is_trending, expiry_date, is_expired)
+
+    log.debug("Returning survey data: %s", response_data)
+    return cache_headers(jsonify(response_data), etag, SURVEY_CACHE_CONTROL)
 
 @app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/answers', methods=['POST'])
 def submit_answers(survey_id):
-    app.logger.debug(f"Received POST request to submit answers for survey ID: {survey_id}")
+    log.debug("Received POST request to submit answers for survey ID: %s", survey_id)
     data = request.json
-    app.logger.debug(f"Request data: {data}")
+    log.debug("Request data: %s", data)
     
     if not data or 'answers' not in data:
-        app.logger.warning("Invalid request data: 'answers' not found in request")
+        log.warning("Invalid request data: 'answers' not found in request")
         return jsonify({'error': 'Invalid request data: answers not provided'}), 400
     
     try:
         # Fetch the survey
-        survey = mongo.db.surveys.find_one({'survey_id': survey_id})
+        survey = find_survey(survey_id)
         if not survey:
-            app.logger.warning(f"Survey not found: {survey_id}")
+            log.warning("Survey not found: %s", survey_id)
             return jsonify({'error': 'Survey not found'}), 404
         
         # Validate answers
-        valid_questions = {str(q['id']): q for q in survey['questions']}  # Convert to string
-        for answer in data['answers']:
-            if 'question_id' not in answer or 'answer' not in answer:
-                app.logger.warning(f"Invalid answer format: {answer}")
-                return jsonify({'error': f"Invalid answer format: {answer}"}), 400
-            
-            question_id = str(answer['question_id'])  # Convert to string
-            if question_id not in valid_questions:
-                app.logger.warning(f"Invalid question ID: {question_id}")
-                return jsonify({'error': f"Invalid question ID: {question_id}"}), 400
-            
-            question = valid_questions[question_id]
-            if question['response_type'] == 'scale':
-                if not isinstance(answer['answer'], (int, float)) or not (1 <= answer['answer'] <= question['response_scale_max']):
-                    app.logger.warning(f"Invalid answer for scale question {question_id}: {answer['answer']}")
-                    return jsonify({'error': f"Invalid answer for question {question_id}: must be between 1 and {question['response_scale_max']}"}), 400
-            elif question['response_type'] == 'boolean':
-                if not isinstance(answer['answer'], bool):
-                    app.logger.warning(f"Invalid answer for boolean question {question_id}: {answer['answer']}")
-                    return jsonify({'error': f"Invalid answer for question {question_id}: must be a boolean"}), 400
+        error = survey_cache.validator(survey)(data['answers'])
+        if error:
+            log.warning(error)
+            return jsonify({'error': error}), 400
         
         # Use provided user_code, if not, generate a new one
         user_code = data.get('user_code', id_manager.get_id())
-        answer_submission = {
-            'survey_id': survey_id,
-            'user_code': user_code,
-            'answers': {str(answer['question_id']): answer['answer'] for answer in data['answers']},
-            'submitted_at': datetime.datetime.now(datetime.UTC)
-        }
-        result = mongo.db.answers.insert_one(answer_submission)
-        
-        # Mark the user_code as used
-        id_manager.mark_id_as_used(user_code)
-        
-        # Calculate deviations (placeholder logic - you'll need to implement the actual calculation)
-        deviation_from_creator = 0.5  # placeholder
-        deviation_from_others = 0.3  # placeholder
-        overall_deviation = 0.4  # placeholder
+        answer_submission = new_submission(survey_id, user_code, data['answers'])
+        if write_buffer:
+            # Stored, folded into the aggregate and marked used together with other submissions
+            write_buffer.submit(survey, answer_submission)
+        else:
+            result = mongo.db.answers.insert_one(answer_submission)
+            survey_aggregates.record_submission(survey, answer_submission['answers'], answer_submission['submitted_at'])
+
+            # Mark the user_code as used
+            id_manager.mark_id_as_used(user_code)
+            global_counters.record_answers()
         
-        response = jsonify({
-            'user_code': user_code,
-            'deviation_from_creator': deviation_from_creator,
-            'deviation_from_others': deviation_from_others,
-            'overall_deviation': overall_deviation
-        })
-        app.logger.debug(f"Sending response: {response.get_data(as_text=True)}")
+        response = jsonify(submission_response(user_code))
         return response, 201
+    except WriteBufferFull as e:
+        log.warning(str(e))
+        return jsonify({'error': 'Too many submissions, try again shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
-        app.logger.error(f"Error submitting answers: {str(e)}")
+        log.error("Error submitting answers: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
     
+@app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/answers/batch', methods=['POST'])
+def submit_answers_batch(survey_id):
+    """Store many submissions for one survey, validating each against a single fetch of the survey."""
+    data = request.json
+    submissions = data.get('submissions') if isinstance(data, dict) else None
+    if not isinstance(submissions, list) or not submissions:
+        log.warning("Invalid request data: 'submissions' not found in request")
+        return jsonify({'error': 'Invalid request data: submissions not provided'}), 400
+    if len(submissions) > MAX_SUBMISSION_BATCH:
+        return jsonify({'error': f'Too many submissions: at most {MAX_SUBMISSION_BATCH} per request'}), 400
+
+    try:
+        survey = find_survey(survey_id)
+        if not survey:
+            log.warning("Survey not found: %s", survey_id)
+            return jsonify({'error': 'Survey not found'}), 404
+
+        errors = validate_submission_batch(survey, submissions, survey_cache.validator(survey))
+        generated_codes = id_manager.use_ids(user_codes_needed(submissions, errors))
+        documents = new_submission_batch(survey_id, submissions, errors, generated_codes)
+        if documents:
+            mongo.db.answers.insert_many(list(documents.values()))
+            survey_aggregates.record_submissions(survey, list(documents.values()))
+            id_manager.mark_ids_as_used([submissions[index]['user_code'] for index in documents if 'user_code' in submissions[index]])
+            global_counters.record_answers(len(documents))
+
+        body, status = submission_batch_response(errors, documents)
+        log.info("Batch for survey %s: %s accepted, %s rejected", survey_id, body['accepted'], body['rejected'])
+        return jsonify(body), status
+    except Exception as e:
+        log.error("Error submitting answers batch: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/results', methods=['GET'])
 def get_survey_results(survey_id):
     user_code = request.args.get('user_code')
@@ -380,7 +381,7 @@ def get_results_by_user_code():
         return jsonify({'error': 'User code is required'}), 400
     
     # Try to find the survey based on the user_code (for creators)
-    survey = mongo.db.surveys.find_one({'user_code': user_code})
+    survey = find_survey_by_creator(user_code)
     if survey:
         return process_results(survey['survey_id'], user_code)
     
@@ -392,222 +393,119 @@ def get_results_by_user_code():
     return jsonify({'error': 'No survey found for this user code'}), 404
     
 def process_results(survey_id, user_code):
-    logging.info(f"Getting results for survey {survey_id}, user_code {user_code}")
+    log.debug("Getting results for survey %s, user_code %s", survey_id, user_code)
     
     if not user_code:
-        logging.warning("User code is missing")
+        log.warning("User code is missing")
         return jsonify({'error': 'User code is required'}), 400
 
-    survey = mongo.db.surveys.find_one({'survey_id': survey_id})
+    survey = find_survey(survey_id)
     if not survey:
-        logging.warning(f"Survey {survey_id} not found")
+        log.warning("Survey %s not found", survey_id)
         return jsonify({'error': 'Survey not found'}), 404
 
     # Check if user is creator
     is_creator = (user_code == survey['user_code'])
-    logging.info(f"User is creator: {is_creator}")
-
-    # Get all answers for this survey
-    answers = list(mongo.db.answers.find({'survey_id': survey_id}))
-    logging.info(f"Found {len(answers)} answers for survey {survey_id}")
+    log.debug("User is creator: %s", is_creator)
 
-    # Check if the user_code exists in the answers
-    user_answer = next((a for a in answers if a['user_code'] == user_code), None)
-    if not user_answer and not is_creator:
-        logging.warning(f"Invalid user code: {user_code}")
-        return jsonify({'error': 'Invalid user code'}), 404
+    aggregate = survey_aggregates.get(survey)
+    log.debug("Found %s answers for survey %s", aggregate['response_count'], survey_id)
+    log.debug("Creator ID is: %s", survey['user_code'])
 
-    logging.info(f"Creator ID is: {survey['user_code']}")
-    
-    current_responses = len(answers)
+    # Results only change with the aggregate, so a client holding the current ETag
+    # gets a 304 before any answers are read or statistics computed
     now_time = datetime.datetime.now(datetime.UTC)
-    # Calculate trending status
-    twenty_four_hours_ago = now_time - datetime.timedelta(hours=24)
-    recent_answers = mongo.db.answers.find_one({
-        'survey_id': survey_id,
-        'submitted_at': {'$gte': twenty_four_hours_ago}
-    })
-    
-    # Calculate participant bucket
-    total_answers = len(answers)
-    is_trending = bool(recent_answers)
-    participant_bucket = get_participant_bucket(total_answers)
-
-    # Check expiry
-    expiry_date = make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY))
-    is_expired = expiry_date < now_time
-
-    # Check for minimum responses for creator
-    if current_responses < MINIMUM_RESPONSES:
-        if is_creator:
-            response = {
-                'status': 'incomplete',
-                'current_responses': current_responses,
-                'total_responses': current_responses,
-                'minimum_responses': MINIMUM_RESPONSES,
-                'remaining_responses': MINIMUM_RESPONSES - current_responses,
-                'is_creator': True,
-                'user_code': user_code,
-                'survey_id': survey_id,
-                'is_trending': is_trending,
-                'participant_bucket': participant_bucket,
-                'expiry_date': expiry_date.isoformat(),
-                'expired': is_expired
-            }
-            return jsonify(response), 200
-        else:
-            response = {
-                'status': 'incomplete',
-                'is_creator': False,
-                'is_trending': is_trending,
-                'participant_bucket': participant_bucket,
-                'expiry_date': expiry_date.isoformat(),
-                'expired': is_expired
-            }
-            return jsonify(response), 202
-
-    # Calculate statistics
-    results = calculate_survey_statistics(survey, answers, user_code, is_creator)
-    results['is_trending'] = is_trending
-    results['participant_bucket'] = participant_bucket
-    results['expiry_date'] = expiry_date.isoformat()
-    results['expired'] = is_expired
-    
-    return jsonify(results), 200
-
-def calculate_survey_statistics(survey, answers, user_code, is_creator):
-    logging.info(f"Calculating statistics for survey {survey['survey_id']}, user_code {user_code}, is_creator: {is_creator}")
-    
-    questions = {q['id']: q for q in survey['questions']}
-    now_time = datetime.datetime.now(datetime.UTC)
-    results = {
-        'survey_id': survey['survey_id'],
-        'title': survey['title'],
-        'description': survey.get('description', ''),
-        'created_at': survey['survey_id'],
-        'is_creator': is_creator,
-        'questions': [],
-        'overall_statistics': {},
-        'expiry_date': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)).isoformat(),
-        'expired': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)) < now_time,
-        'total_responses': len(answers)
-    }
-
-    creator_answers = {str(q['id']): q['creator_answer'] for q in survey['questions']}
-    user_answers = creator_answers if is_creator else next((a['answers'] for a in answers if str(a.get('user_code')) == str(user_code)), None)
-
-    logging.info(f"User answers: {user_answers}")
-    logging.info(f"Creator answers: {creator_answers}")
-
-    all_deviations = []
-    user_deviations = []
-
-    for q_id, question in questions.items():
-        q_answers = [a['answers'][str(q_id)] for a in answers if str(q_id) in a['answers']]
-        creator_answer = creator_answers.get(q_id)
-        avg_score = mean(q_answers) if q_answers else None
-        
-        logging.info(f"Processing question ID: {q_id}")
-        logging.info(f"Question type: {question['response_type']}")
-        
-        if question['response_type'] == 'scale':
-            try:
-                std_dev = stdev(q_answers) if len(q_answers) > 1 else 0
-            except StatisticsError:
-                std_dev = 0
-            
-            q_stat = {
-                'id': q_id,
-                'text': question['text'],
-                'type': 'scale',
-                'scale_max': question['response_scale_max'],
-                'average_score': round(avg_score, 2) if avg_score is not None else None,
-                'standard_deviation': round(std_dev, 2),
-                'distribution': {score: q_answers.count(score) for score in range(1, question['response_scale_max'] + 1)}
-            }
-            
-            
-            if user_answers and str(q_id) in user_answers:
-                user_score = user_answers[str(q_id)]
-                q_stat['user_score'] = user_score
-                if avg_score is not None:
-                    user_deviation = abs(user_score - avg_score)
-                    q_stat['user_deviation'] = round(user_deviation, 2)
-                    user_deviations.append(user_deviation)
-
-                # Calculate deviation from creator for all users, including creator
-                if creator_answer is not None:
-                    creator_deviation = abs(user_score - creator_answer)
-                    q_stat['deviation_from_creator'] = round(creator_deviation, 2)
-
-                # Calculate deviation from others
-                other_answers = q_answers if is_creator else [a for a in q_answers if a != user_score]
-                if other_answers:
-                    other_avg = mean(other_answers)
-                    other_deviation = abs(user_score - other_avg)
-                    q_stat['deviation_from_others'] = round(other_deviation, 2)
-
-            # Calculate overall deviation for this question
-            if creator_answer is not None:
-                question_deviations = [abs(ans - creator_answer) for ans in q_answers]
-                all_deviations.extend(question_deviations)
-            
-        elif question['response_type'] == 'boolean':
-            true_count = sum(q_answers)
-            total_count = len(q_answers)
-            
-            q_stat = {
-                'id': q_id,
-                'text': question['text'],
-                'type': 'boolean',
-                'true_percentage': round(true_count / total_count * 100, 2) if total_count > 0 else 0,
-                'false_percentage': round((total_count - true_count) / total_count * 100, 2) if total_count > 0 else 0
-            }
-            
-            if user_answers and str(q_id) in user_answers:
-                q_stat['user_answer'] = user_answers[str(q_id)]
-
-        results['questions'].append(q_stat)
-
-    # Calculate overall statistics
-    results['overall_statistics'] = {
-        'average_deviation_from_aggregate': round(mean(user_deviations), 2) if user_deviations else None,
-        'overall_deviation': round(mean(all_deviations), 2) if all_deviations else None,
-    }
-
-    # Remove None values from overall_statistics
-    results['overall_statistics'] = {k: v for k, v in results['overall_statistics'].items() if v is not None}
-    results['total_participants'] = len(answers) 
-    
-    logging.info(f"Final results: {results}")
-    return results
+    _, is_expired = survey_expiry(survey, now_time)
+    is_trending = aggregate_is_trending(aggregate, now_time)
+    etag = response_etag(survey_id, aggregate, is_trending, is_expired, user_code)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, RESULTS_CACHE_CONTROL)
+
+    # Only the requesting participant's own answers are needed; everything else
+    # comes from the survey aggregate
+    user_answer = None
+    if not is_creator:
+        user_answer = mongo.db.answers.find_one({'survey_id': survey_id, 'user_code': user_code}, {'answers': 1})
+        if not user_answer:
+            log.warning("Invalid user code: %s", user_code)
+            return jsonify({'error': 'Invalid user code'}), 404
+
+    user_answers = user_answer['answers'] if user_answer else None
+    results, status = results_response(survey, aggregate, user_answers, user_code, is_creator, is_trending,
+                                       population_cache)
+    return cache_headers(jsonify(results), etag, RESULTS_CACHE_CONTROL), status
 
 
 @app.errorhandler(404)
 def not_found(error):
-    app.logger.warning(f"404 error: {request.url}")
+    log.warning("404 error: %s", request.url)
     return jsonify({'error': 'Not found'}), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    app.logger.error(f"500 error: {str(error)}")
+    log.error("500 error: %s", error)
     return jsonify({'error': 'Internal server error'}), 500
 
+# Registered first, so every other hook, the profiler's included, logs with the request's ID
+@app.before_request
+def start_request_log():
+    logs.start_request()
+
+@app.after_request
+def finish_request_log(response):
+    logs.finish_request()
+    return response
+
+# Registered before the metrics hooks, so writing a profile is not counted as request latency
+@app.before_request
+def start_profiling():
+    profiler.start(request.path, request.headers.get(PROFILE_HEADER))
+
+@app.after_request
+def finish_profiling(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    profiler.finish(request.method, request.path, route, response.status_code)
+    return response
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route template, so every survey ID shares one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_request(request.method, route, response.status_code)
+    return response
+
+@app.route(f'{api_prefix}/metrics', methods=['GET'])
+def get_metrics():
+    gauges = {
+        'percept_id_reserve_pool_depth': id_manager.replenisher.pool_depth if id_manager.replenisher else None,
+        'percept_write_buffer_pending': write_buffer.stats()['pending'] if write_buffer else None,
+        'percept_log_records_dropped': logs.dropped_records(),
+    }
+    return app.response_class(metrics.render(gauges), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route(f'{api_prefix}/v1/stats/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify({'population_statistics': population_cache.stats(), 'surveys': survey_cache.stats()})
+
+@app.route(f'{api_prefix}/v1/stats/write_buffer', methods=['GET'])
+def get_write_buffer_stats():
+    if write_buffer is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **write_buffer.stats()})
+
 @app.route(f'{api_prefix}/v1/stats', methods=['GET'])
 def get_stats():
     try:
-        total_surveys = mongo.db.surveys.count_documents({})
-        total_participants = mongo.db.answers.count_documents({})
-        
-        return jsonify({
-            'total_surveys': total_surveys,
-            'total_participants': total_participants
-        }), 200
+        return jsonify(global_counters.totals()), 200
     except Exception as e:
-        app.logger.error(f"Error fetching stats: {str(e)}")
+        log.error("Error fetching stats: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
-    app.logger.info("Starting the Flask application")
-    app.logger.info(f"Registered routes: {app.url_map}")
+    log.info("Starting the Flask application")
+    log.info("Registered routes: %s", app.url_map)
     app.run(debug=False, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,448 @@
+# async_app.py
+#
+# The API from app.py on asyncio: the same routes and the same JSON, served by
+# Quart with pymongo's AsyncMongoClient. A worker keeps serving other requests
+# while one waits on Mongo, and queries that do not depend on each other run
+# concurrently within a request. Run it under an ASGI server, e.g.
+#
+#     hypercorn -b 0.0.0.0:5001 -w 4 async_app:app
+#
+# IDManager and GlobalCounters stay synchronous (they run their own background
+# threads), so they share a blocking client and their calls are moved off the
+# event loop with asyncio.to_thread.
+
+import time
+# Worker boot is timed from here, so keep this first
+BOOT_STARTED = time.perf_counter()
+
+import asyncio
+import datetime
+import logging
+import os
+from pymongo import AsyncMongoClient, MongoClient
+from quart import Quart, jsonify, request
+from quart_cors import cors
+from aggregates import AsyncSurveyAggregates
+from counters import GlobalCounters
+import logs
+from metrics import PROMETHEUS_CONTENT_TYPE, Metrics
+from id_manager import (
+    ID_RESERVE_HIGH_WATERMARK, ID_RESERVE_LOW_WATERMARK, ID_SUGGESTIONS, MAX_ID_CHECK_BATCH, IDManager
+)
+from survey_cache import SurveyCache
+from surveys import (
+    EXPIRED_CACHE_CONTROL, RESULTS_CACHE_CONTROL, SURVEY_CACHE_CONTROL, PopulationCache, aggregate_is_trending,
+    MAX_SUBMISSION_BATCH, created_survey_response, new_submission, new_submission_batch, new_survey, response_etag, results_response,
+    submission_batch_response, submission_response, survey_expiry, survey_response, user_codes_needed,
+    validate_submission_batch
+)
+
+app = Quart(__name__)
+
+allowed_origins = [
+    "http://localhost",
+    "http://localhost:8080",
+    os.environ.get("APP_URL", "https://i.nyn.me")
+]
+app = cors(app, allow_origin=allowed_origins)
+
+api_prefix = os.getenv('API_PREFIX', '')  # Default to empty string if not set
+
+logs.configure_logging()
+log = logging.getLogger('percept.async_app')
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/percept")
+metrics = Metrics()
+client = AsyncMongoClient(MONGO_URI, event_listeners=[metrics.command_listener])
+db = client.get_default_database()
+survey_aggregates = AsyncSurveyAggregates(db)
+population_cache = PopulationCache()
+survey_cache = SurveyCache()
+sync_db = MongoClient(MONGO_URI, event_listeners=[metrics.command_listener]).get_default_database()
+id_manager = IDManager(sync_db)
+global_counters = GlobalCounters(sync_db)
+
+
+@app.before_serving
+async def startup():
+    try:
+        await db.command('ping')
+        await asyncio.to_thread(id_manager.start_replenisher, ID_RESERVE_LOW_WATERMARK, ID_RESERVE_HIGH_WATERMARK)
+        global_counters.start_reconciler()
+        log.info("Started ID reserve replenisher (%s-%s IDs)", ID_RESERVE_LOW_WATERMARK, ID_RESERVE_HIGH_WATERMARK)
+    except Exception as e:
+        log.error("Failed to initialize database connection: %s", e)
+    log.info("Worker booted in %.0f ms", (time.perf_counter() - BOOT_STARTED) * 1000)
+
+
+async def find_survey(survey_id):
+    """The survey with this ID, from the survey cache when possible, or None. Do not modify it."""
+    survey = survey_cache.get(survey_id)
+    if survey is None:
+        survey = await db.surveys.find_one({'survey_id': survey_id})
+        if survey:
+            survey = survey_cache.put(survey)
+    return survey
+
+
+def cache_headers(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified(etag, cache_control):
+    """Empty 304 for a conditional GET whose If-None-Match still matches the current ETag."""
+    return cache_headers(app.response_class(None, status=304), etag, cache_control)
+
+
+@app.route(f'{api_prefix}/')
+async def home():
+    return "Welcome to the Percept API", 200
+
+
+@app.route(f'{api_prefix}/v1/ids/check', methods=['GET'])
+async def check_id():
+    id_to_check = request.args.get('id')
+    if not id_to_check:
+        return jsonify({'error': 'No ID provided'}), 400
+
+    if not id_manager.is_valid_id_format(id_to_check):
+        return jsonify({
+            'id': id_to_check,
+            'available': False,
+            'error': 'Invalid ID format. ID must be at least 5 characters long and contain only letters, numbers, and hyphens.'
+        }), 400
+
+    available = await asyncio.to_thread(id_manager.is_id_available, id_to_check, use_filter=True)
+    return jsonify({
+        'id': id_to_check,
+        'available': available
+    })
+
+
+@app.route(f'{api_prefix}/v1/ids/check', methods=['POST'])
+async def check_ids():
+    data = await request.get_json()
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return jsonify({'error': 'No IDs provided'}), 400
+    if len(ids) > MAX_ID_CHECK_BATCH:
+        return jsonify({'error': f"At most {MAX_ID_CHECK_BATCH} IDs can be checked at once"}), 400
+
+    results = []
+    for id_to_check, available in zip(ids, await asyncio.to_thread(id_manager.check_ids, ids)):
+        result = {'id': id_to_check, 'available': available}
+        if not id_manager.is_valid_id_format(id_to_check):
+            result['error'] = 'Invalid ID format'
+        results.append(result)
+    return jsonify({'ids': results})
+
+
+@app.route(f'{api_prefix}/v1/ids', methods=['GET'])
+async def get_ids():
+    preferred = request.args.get('id')
+    count = int(request.args.get('count', ID_SUGGESTIONS))
+
+    ids = await asyncio.to_thread(id_manager.get_ids, count, preferred)
+
+    return jsonify({
+        'ids': ids
+    })
+
+
+@app.route(f'{api_prefix}/v1/ids/stats', methods=['GET'])
+async def get_id_reserve_stats():
+    if not id_manager.replenisher:
+        return jsonify({'error': 'ID reserve replenisher is not running'}), 503
+    return jsonify(id_manager.replenisher.stats())
+
+
+@app.route(f'{api_prefix}/v1/surveys', methods=['POST'])
+async def create_survey():
+    data = await request.get_json()
+    if 'survey_id' not in data:
+        data['survey_id'] = (await asyncio.to_thread(id_manager.get_ids))[0]
+
+    if 'user_code' not in data:
+        data['user_code'] = (await asyncio.to_thread(id_manager.get_ids))[0]
+
+    if not data or 'title' not in data or 'questions' not in data or 'user_code' not in data:
+        log.warning("Invalid request data")
+        return jsonify({'error': 'Invalid request data'}), 400
+
+    try:
+        survey_id = data['survey_id']
+        user_code = data['user_code']
+
+        # Check if the IDs are available, including reserved IDs
+        survey_id_available, user_code_available = await asyncio.gather(
+            asyncio.to_thread(id_manager.is_id_available, survey_id, include_reserved=True),
+            asyncio.to_thread(id_manager.is_id_available, user_code, include_reserved=True)
+        )
+        if not survey_id_available:
+            log.warning("Requested survey ID is not available: survey_id=%s", survey_id)
+            return jsonify({'error': 'Requested survey ID is not available'}), 400
+
+        if not user_code_available:
+            log.warning("Requested user code is not available: user_code=%s", user_code)
+            return jsonify({'error': 'Requested user code is not available'}), 400
+
+        survey = new_survey(data, survey_id, user_code)
+        result = await db.surveys.insert_one(survey)
+
+        if result.inserted_id:
+            # Mark the IDs as used only after successful insertion
+            await asyncio.gather(
+                asyncio.to_thread(id_manager.mark_id_as_used, survey_id),
+                asyncio.to_thread(id_manager.mark_id_as_used, user_code),
+                survey_aggregates.create(survey_id),
+                asyncio.to_thread(global_counters.record_survey)
+            )
+            return jsonify(created_survey_response(survey)), 201
+        else:
+            log.error("Failed to insert survey into database")
+            return jsonify({'error': 'Failed to create survey'}), 500
+
+    except Exception as e:
+        log.error("Error creating survey: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route(f'{api_prefix}/v1/surveys/<string:survey_id>', methods=['GET'])
+async def get_survey(survey_id):
+    now_time = datetime.datetime.now(datetime.UTC)
+    # The aggregate lookup only needs the survey ID, so it runs alongside the survey
+    # lookup. Trending status and the participant bucket come from the aggregate.
+    survey, aggregate = await asyncio.gather(find_survey(survey_id), survey_aggregates.find(survey_id))
+    if not survey:
+        log.warning("Survey not found: %s", survey_id)
+        return jsonify({'error': 'Survey not found'}), 404
+
+    expiry_date, is_expired = survey_expiry(survey, now_time)
+    if is_expired:
+        response = jsonify({'error': 'Survey has expired', 'expired': True})
+        response.headers['Cache-Control'] = EXPIRED_CACHE_CONTROL
+        return response, 410
+
+    if aggregate is None:
+        aggregate = await survey_aggregates.rebuild(survey)
+
+    is_trending = aggregate_is_trending(aggregate, now_time)
+    etag = response_etag(survey_id, aggregate, is_trending, is_expired)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag, SURVEY_CACHE_CONTROL)
+
+    response_data = survey_response(survey, aggregate, is_trending, expiry_date, is_expired)
+    return cache_headers(jsonify(response_data), etag, SURVEY_CACHE_CONTROL)
+
+
+@app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/answers', methods=['POST'])
+async def submit_answers(survey_id):
+    data = await request.get_json()
+
+    if not data or 'answers' not in data:
+        log.warning("Invalid request data: 'answers' not found in request")
+        return jsonify({'error': 'Invalid request data: answers not provided'}), 400
+
+    try:
+        survey = await find_survey(survey_id)
+        if not survey:
+            log.warning("Survey not found: %s", survey_id)
+            return jsonify({'error': 'Survey not found'}), 404
+
+        error = survey_cache.validator(survey)(data['answers'])
+        if error:
+            log.warning(error)
+            return jsonify({'error': error}), 400
+
+        # Use provided user_code, if not, generate a new one
+        if 'user_code' in data:
+            user_code = data['user_code']
+        else:
+            user_code = await asyncio.to_thread(id_manager.get_id)
+        answer_submission = new_submission(survey_id, user_code, data['answers'])
+        await db.answers.insert_one(answer_submission)
+        await asyncio.gather(
+            survey_aggregates.record_submission(survey, answer_submission['answers'], answer_submission['submitted_at']),
+            asyncio.to_thread(id_manager.mark_id_as_used, user_code),
+            asyncio.to_thread(global_counters.record_answers)
+        )
+
+        return jsonify(submission_response(user_code)), 201
+    except Exception as e:
+        log.error("Error submitting answers: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/answers/batch', methods=['POST'])
+async def submit_answers_batch(survey_id):
+    data = await request.get_json()
+    submissions = data.get('submissions') if isinstance(data, dict) else None
+    if not isinstance(submissions, list) or not submissions:
+        log.warning("Invalid request data: 'submissions' not found in request")
+        return jsonify({'error': 'Invalid request data: submissions not provided'}), 400
+    if len(submissions) > MAX_SUBMISSION_BATCH:
+        return jsonify({'error': f'Too many submissions: at most {MAX_SUBMISSION_BATCH} per request'}), 400
+
+    try:
+        survey = await find_survey(survey_id)
+        if not survey:
+            log.warning("Survey not found: %s", survey_id)
+            return jsonify({'error': 'Survey not found'}), 404
+
+        errors = validate_submission_batch(survey, submissions, survey_cache.validator(survey))
+        generated_codes = await asyncio.to_thread(id_manager.use_ids, user_codes_needed(submissions, errors))
+        documents = new_submission_batch(survey_id, submissions, errors, generated_codes)
+        if documents:
+            await db.answers.insert_many(list(documents.values()))
+            supplied_codes = [submissions[index]['user_code'] for index in documents if 'user_code' in submissions[index]]
+            await asyncio.gather(
+                survey_aggregates.record_submissions(survey, list(documents.values())),
+                asyncio.to_thread(id_manager.mark_ids_as_used, supplied_codes),
+                asyncio.to_thread(global_counters.record_answers, len(documents))
+            )
+
+        body, status = submission_batch_response(errors, documents)
+        return jsonify(body), status
+    except Exception as e:
+        log.error("Error submitting answers batch: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route(f'{api_prefix}/v1/surveys/<string:survey_id>/results', methods=['GET'])
+async def get_survey_results(survey_id):
+    user_code = request.args.get('user_code')
+    return await process_results(survey_id, user_code)
+
+
+@app.route(f'{api_prefix}/v1/surveys/results', methods=['GET'])
+async def get_results_by_user_code():
+    user_code = request.args.get('user_code')
+    if not user_code:
+        return jsonify({'error': 'User code is required'}), 400
+
+    survey = survey_cache.get_by_user_code(user_code)
+    if survey:
+        return await process_results(survey['survey_id'], user_code)
+
+    # Look the code up as a creator's and a participant's at the same time
+    survey, answer = await asyncio.gather(
+        db.surveys.find_one({'user_code': user_code}),
+        db.answers.find_one({'user_code': user_code})
+    )
+    if survey:
+        return await process_results(survey['survey_id'], user_code)
+    if answer:
+        return await process_results(answer['survey_id'], user_code)
+
+    return jsonify({'error': 'No survey found for this user code'}), 404
+
+
+async def process_results(survey_id, user_code):
+    if not user_code:
+        log.warning("User code is missing")
+        return jsonify({'error': 'User code is required'}), 400
+
+    now_time = datetime.datetime.now(datetime.UTC)
+
+    def participant_lookup():
+        # Wasted when the user turns out to be the creator, but running it alongside
+        # the others costs no extra time
+        return db.answers.find_one({'survey_id': survey_id, 'user_code': user_code}, {'answers': 1})
+
+    # None of these depend on each other. A conditional request leaves the participant
+    # lookup until it knows a 304 will not do, so that a 304 never reads answers.
+    conditional = bool(request.if_none_match)
+    lookups = [find_survey(survey_id), survey_aggregates.find(survey_id)]
+    if not conditional:
+        lookups.append(participant_lookup())
+    survey, aggregate, *user_answer = await asyncio.gather(*lookups)
+    if not survey:
+        log.warning("Survey %s not found", survey_id)
+        return jsonify({'error': 'Survey not found'}), 404
+
+    if aggregate is None:
+        aggregate = await survey_aggregates.rebuild(survey)
+
+    _, is_expired = survey_expiry(survey, now_time)
+    is_trending = aggregate_is_trending(aggregate, now_time)
+    etag = response_etag(survey_id, aggregate, is_trending, is_expired, user_code)
+    if conditional:
+        if request.if_none_match.contains(etag):
+            return not_modified(etag, RESULTS_CACHE_CONTROL)
+        user_answer = [await participant_lookup()]
+    user_answer = user_answer[0]
+
+    is_creator = (user_code == survey['user_code'])
+    if is_creator:
+        user_answer = None
+    elif not user_answer:
+        log.warning("Invalid user code: %s", user_code)
+        return jsonify({'error': 'Invalid user code'}), 404
+
+    user_answers = user_answer['answers'] if user_answer else None
+    results, status = results_response(survey, aggregate, user_answers, user_code, is_creator, is_trending,
+                                       population_cache)
+    return cache_headers(jsonify(results), etag, RESULTS_CACHE_CONTROL), status
+
+
+@app.errorhandler(404)
+async def not_found(error):
+    log.warning("404 error: %s", request.url)
+    return jsonify({'error': 'Not found'}), 404
+
+
+@app.errorhandler(500)
+async def internal_error(error):
+    log.error("500 error: %s", error)
+    return jsonify({'error': 'Internal server error'}), 500
+
+
+# Registered first, so every other hook logs with the request's ID
+@app.before_request
+async def start_request_log():
+    logs.start_request()
+
+
+@app.after_request
+async def finish_request_log(response):
+    logs.finish_request()
+    return response
+
+
+@app.before_request
+async def start_request_metrics():
+    metrics.start_request()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    # Commands run by asyncio.to_thread are charged to the request too, since the
+    # thread runs in a copy of the request's context
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_request(request.method, route, response.status_code)
+    return response
+
+
+@app.route(f'{api_prefix}/metrics', methods=['GET'])
+async def get_metrics():
+    gauges = {
+        'percept_id_reserve_pool_depth': id_manager.replenisher.pool_depth if id_manager.replenisher else None,
+        'percept_log_records_dropped': logs.dropped_records(),
+    }
+    return app.response_class(metrics.render(gauges), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route(f'{api_prefix}/v1/stats/cache', methods=['GET'])
+async def get_cache_stats():
+    return jsonify({'population_statistics': population_cache.stats(), 'surveys': survey_cache.stats()})
+
+
+@app.route(f'{api_prefix}/v1/stats', methods=['GET'])
+async def get_stats():
+    try:
+        return jsonify(await asyncio.to_thread(global_counters.totals)), 200
+    except Exception as e:
+        log.error("Error fetching stats: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,99 @@
+# bench_async.py
+#
+# Compares requests per second of the sync app (gunicorn, app:app) with the async
+# app (hypercorn, async_app:app) on the same MongoDB. Both servers are started
+# here with the same number of workers, seeded with one survey and its answers,
+# and then hit by concurrent clients reading the survey and its results, which
+# is where the async app can overlap its Mongo round trips.
+#
+#     MONGO_URI=mongodb://localhost:27017/percept_bench python benchmarks/bench_async.py [seconds] [clients]
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = int(os.environ.get('BENCH_WORKERS', 2))
+SERVERS = {
+    'sync': ['gunicorn', '-w', str(WORKERS), '-b', '127.0.0.1:5101', 'app:app'],
+    'async': ['hypercorn', '-w', str(WORKERS), '-b', '127.0.0.1:5102', 'async_app:app'],
+}
+PORTS = {'sync': 5101, 'async': 5102}
+
+
+def wait_until_up(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not come up within {timeout}s")
+
+
+def seed(base_url, answers=50):
+    """Create one survey with enough answers that results are complete."""
+    survey = requests.post(f"{base_url}/v1/surveys", json={
+        'title': 'Benchmark survey',
+        'questions': [
+            {'text': 'Scale', 'response_type': 'scale', 'response_scale_max': 5, 'creator_answer': 3},
+            {'text': 'Bool', 'response_type': 'boolean', 'creator_answer': True},
+        ]
+    }).json()
+    participants = []
+    for i in range(answers):
+        response = requests.post(f"{base_url}/v1/surveys/{survey['survey_id']}/answers", json={
+            'answers': [{'question_id': 1, 'answer': i % 5 + 1}, {'question_id': 2, 'answer': i % 2 == 0}]
+        })
+        participants.append(response.json()['user_code'])
+    return survey, participants
+
+
+def load(base_url, survey, participants, seconds, clients):
+    paths = [
+        f"/v1/surveys/{survey['survey_id']}",
+        f"/v1/surveys/{survey['survey_id']}/results?user_code={survey['user_code']}",
+        f"/v1/surveys/{survey['survey_id']}/results?user_code={participants[0]}",
+    ]
+    deadline = time.time() + seconds
+    counts = []
+    lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        done = errors = 0
+        while time.time() < deadline:
+            response = session.get(base_url + paths[(index + done) % len(paths)])
+            done += 1
+            errors += response.status_code >= 500
+        with lock:
+            counts.append((done, errors))
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    total = sum(done for done, _ in counts)
+    return total / seconds, sum(errors for _, errors in counts)
+
+
+def main(seconds, clients):
+    for name, command in SERVERS.items():
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{PORTS[name]}"
+        try:
+            wait_until_up(base_url)
+            survey, participants = seed(base_url)
+            rate, errors = load(base_url, survey, participants, seconds, clients)
+            print(f"{name}: {rate:,.0f} requests/s with {clients} clients and {WORKERS} workers ({errors} errors)")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10, int(sys.argv[2]) if len(sys.argv) > 2 else 32)
@@ -0,0 +1,60 @@
+# bench_lemmas.py
+#
+# Compares sampling lemmas straight from WordNet (the IDManager fallback) with the
+# precomputed, memory-mapped lemma tables. Needs the NLTK wordnet corpus.
+#
+#     python benchmarks/bench_lemmas.py [calls]
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from id_manager import MIN_LEMMA_LEN, MAX_LEMMA_LEN, load_nltk_resource
+load_nltk_resource('wordnet')
+load_nltk_resource('vader_lexicon')
+from nltk.corpus import wordnet as wn
+from lemma_tables import LemmaTables, build_lemma_tables
+
+
+def wordnet_lemma(pos):
+    """The sampling IDManager.get_random_lemma falls back to without lemma tables."""
+    while True:
+        words = list(wn.all_synsets(pos))
+        word = random.choice(words).lemmas()[0].name().replace('_', '-')
+        if MIN_LEMMA_LEN <= len(word) <= MAX_LEMMA_LEN:
+            return word.lower()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(calls):
+    # Load the corpus up front so it isn't billed to the first measurement
+    wn.ensure_loaded()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'lemmas.bin')
+        (adj_count, noun_count), build_time = timed(build_lemma_tables, path, MIN_LEMMA_LEN, MAX_LEMMA_LEN)
+        print(f"build: {build_time * 1000:.1f} ms ({adj_count} adjectives, {noun_count} nouns, "
+              f"{os.path.getsize(path) / 1024:.1f} KiB)")
+
+        tables, load_time = timed(LemmaTables, path)
+        print(f"load: {load_time * 1000:.3f} ms")
+
+        # One generate_noun_adjective_pairs batch draws 20 adjectives and 20 nouns
+        for name, sample in [('wordnet', wordnet_lemma), ('tables', tables.random_lemma)]:
+            n = calls if name == 'tables' else max(1, calls // 1000)
+            _, elapsed = timed(lambda: [sample(pos) for _ in range(n) for pos in (wn.ADJ, wn.NOUN)])
+            per_call = elapsed / (2 * n)
+            print(f"{name}: {per_call * 1e6:.2f} us per lemma, {per_call * 40 * 1000:.3f} ms per 40-lemma batch")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,55 @@
+# bench_snowflake.py
+#
+# Measures Snowflake53 throughput single-threaded and under contention, one ID at
+# a time and in batches. Runs twice: once with a drift allowance large enough that
+# only the generator itself is measured (burst), and once with the default, where
+# the 4 IDs per millisecond the 53-bit layout allows are the limit (sustained).
+#
+#     python benchmarks/bench_snowflake.py [ids]
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snowflake import MAX_DRIFT_MS, Snowflake53
+
+
+def run(generator, total, threads, batch_size):
+    per_thread = total // threads
+    seen = [None] * threads
+
+    def worker(index):
+        if batch_size == 1:
+            seen[index] = [generator.generate() for _ in range(per_thread)]
+        else:
+            ids = []
+            for _ in range(per_thread // batch_size):
+                ids.extend(generator.generate_batch(batch_size))
+            seen[index] = ids
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ids = [id for chunk in seen for id in chunk]
+    duplicates = len(ids) - len(set(ids))
+    return len(ids) / elapsed, duplicates
+
+
+def main(total):
+    for label, max_drift_ms, count in [('burst', 10 ** 9, total), ('sustained', MAX_DRIFT_MS, min(total, 20000))]:
+        for threads in (1, 8):
+            for batch_size in (1, 1000):
+                rate, duplicates = run(Snowflake53(1, 1, max_drift_ms=max_drift_ms), count, threads, batch_size)
+                print(f"{label}: {threads} thread(s), batch {batch_size}: {rate:,.0f} IDs/s, {duplicates} duplicates")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,67 @@
+# bench_statistics.py
+#
+# Times calculate_survey_statistics end to end at several survey sizes, with NumPy
+# (summarize_answers_columnar's vectorized path) and without it (the pure Python
+# fallback), next to the implementation it replaced. That implementation and the
+# random surveys and answers come from reference_statistics.py, as in the tests.
+# The JSON results of all three, serialized the way the API does, must be
+# byte-identical for the creator and for a participant; the benchmark exits with
+# status 1 if they are not.
+#
+#     python benchmarks/bench_statistics.py [sizes...]
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aggregates
+from reference_statistics import random_answers, random_survey, reference_survey_statistics
+from surveys import calculate_survey_statistics
+
+
+def without_numpy(survey, answers, user_code, is_creator):
+    np, aggregates.np = aggregates.np, None
+    try:
+        return calculate_survey_statistics(survey, answers, user_code, is_creator)
+    finally:
+        aggregates.np = np
+
+
+IMPLEMENTATIONS = [
+    ('original', reference_survey_statistics),
+    ('python', without_numpy),
+    ('numpy', calculate_survey_statistics),
+]
+
+
+def main(sizes):
+    if aggregates.np is None:
+        raise SystemExit("NumPy is not installed: pip install numpy")
+    rng = random.Random(1)
+    survey = random_survey(rng, question_count=6)
+    identical = True
+    print(f"{len(survey['questions'])} questions; times are for one participant's results")
+    for size in sizes:
+        answers = random_answers(rng, survey, size)
+        participant = answers[size // 2]['user_code']
+        outputs = {}
+        timings = {}
+        for name, calculate in IMPLEMENTATIONS:
+            start = time.perf_counter()
+            participant_results = calculate(survey, answers, participant, False)
+            timings[name] = time.perf_counter() - start
+            creator_results = calculate(survey, answers, 'creator', True)
+            outputs[name] = [json.dumps(results, sort_keys=True) for results in (participant_results, creator_results)]
+        same = outputs['python'] == outputs['original'] and outputs['numpy'] == outputs['original']
+        identical = identical and same
+        print(f"{size:>9,} answers: " + ', '.join(f"{name} {seconds * 1000:,.1f} ms" for name, seconds in timings.items())
+              + f"; numpy {timings['python'] / timings['numpy']:.1f}x python; identical JSON: {same}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main([int(arg) for arg in sys.argv[1:]] or [1000, 100000, 1000000]))
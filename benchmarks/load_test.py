@@ -0,0 +1,349 @@
+# load_test.py
+#
+# Drives a mix of create, get, submit and results traffic at the API from
+# concurrent clients and reports p50/p95/p99 latency and throughput per endpoint.
+# Surveys are built from the questions in sample_surveys.py, with a configurable
+# number of questions and of seeded answers, and traffic favours a few popular
+# surveys the way real sharing does.
+#
+# The app is run one of three ways:
+#
+#     python benchmarks/load_test.py --url http://localhost:5001/api   # a running server
+#     MONGO_URI=mongodb://localhost:27017/percept_bench python benchmarks/load_test.py   # app.py in process
+#     python benchmarks/load_test.py --in-memory   # app.py in process on mongomock (pip install mongomock)
+#
+# For a given --seed and --requests, every client sends the same sequence of
+# requests on every run (only which surveys they go to depends on timing). Save a run with
+# --save-baseline and compare later runs with --baseline: a run fails (exit 1) when
+# an endpoint's p95 or throughput is more than --tolerance worse than the baseline,
+# or when it has errors the baseline did not.
+#
+#     python benchmarks/load_test.py --in-memory --requests 500 --save-baseline /tmp/load.json
+#     python benchmarks/load_test.py --in-memory --requests 500 --baseline /tmp/load.json
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sample_surveys import SAMPLE_SURVEY, random_answers
+from write_buffer import percentiles
+
+ENDPOINTS = ('create', 'get', 'submit', 'results')
+DEFAULT_MIX = 'create=2,get=40,submit=18,results=40'
+SEED_BATCH = 500  # answers per POST /answers/batch while seeding
+
+
+def parse_mix(spec):
+    """'create=2,get=40,...' as {'create': 2.0, 'get': 40.0, ...}."""
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def parse_range(spec):
+    """'4' as (4, 4) and '2-12' as (2, 12)."""
+    low, _, high = spec.partition('-')
+    return int(low), int(high or low)
+
+
+class InProcessClient:
+    """Calls app.py through Flask's test client, without a server or sockets."""
+
+    def __init__(self, flask_app, prefix):
+        self.client = flask_app.test_client()
+        self.prefix = prefix
+
+    def request(self, method, path, body=None):
+        response = self.client.open(self.prefix + path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    """Calls a running server over HTTP, one keep-alive session per client."""
+
+    def __init__(self, base_url):
+        import requests
+        self.session = requests.Session()
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None):
+        response = self.session.request(method, self.base_url + path, json=body)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+def use_in_memory_mongo():
+    """Make app.py's PyMongo connect to mongomock. Call before importing app."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("--in-memory needs mongomock: pip install mongomock")
+    import flask_pymongo
+
+    command = mongomock.database.Database.command
+
+    def command_with_handshake(self, name, *args, **kwargs):
+        # app.py checks the connection with these at startup
+        if name in ('ismaster', 'ping'):
+            return {'ok': 1.0}
+        return command(self, name, *args, **kwargs)
+
+    mongomock.database.Database.command = command_with_handshake
+    flask_pymongo.MongoClient = mongomock.MongoClient
+
+
+def client_factory(args):
+    if args.url:
+        return lambda: HTTPClient(args.url)
+    if args.in_memory:
+        use_in_memory_mongo()
+    from app import api_prefix, app
+    return lambda: InProcessClient(app, api_prefix)
+
+
+def random_survey(rng, question_range):
+    """A survey with a random number of the sample survey's questions, with random creator answers."""
+    questions = []
+    for i in range(rng.randint(*question_range)):
+        template = SAMPLE_SURVEY['questions'][i % len(SAMPLE_SURVEY['questions'])]
+        question = {key: value for key, value in template.items() if key != 'creator_answer'}
+        question['text'] = f"{template['text']} ({i + 1})"
+        questions.append(question)
+    for question, answer in zip(questions, random_answers(questions, rng)):
+        question['creator_answer'] = answer['answer']
+    return {'title': SAMPLE_SURVEY['title'], 'description': SAMPLE_SURVEY['description'], 'questions': questions}
+
+
+class SurveyPool:
+    """The surveys traffic goes to, and the participants of each, shared by all clients."""
+
+    def __init__(self, skew):
+        self.skew = skew
+        self.lock = threading.Lock()
+        self.surveys = []  # (survey_id, creator code, questions, participant codes)
+        self.weights = []
+
+    def add(self, survey_id, creator_code, questions, participants=()):
+        with self.lock:
+            self.surveys.append((survey_id, creator_code, questions, list(participants)))
+            # Zipf-like popularity: the n-th survey gets 1 / n ** skew of the traffic
+            self.weights.append(1 / len(self.surveys) ** self.skew)
+
+    def pick(self, rng):
+        with self.lock:
+            return rng.choices(self.surveys, self.weights)[0]
+
+    def add_participant(self, survey, user_code):
+        with self.lock:
+            survey[3].append(user_code)
+
+
+def seed(client, pool, rng, surveys, question_range, answer_range):
+    """Create the surveys the load starts with, each with a random number of answers."""
+    for _ in range(surveys):
+        definition = random_survey(rng, question_range)
+        status, body = client.request('POST', '/v1/surveys', definition)
+        if status != 201:
+            raise SystemExit(f"Seeding failed: POST /v1/surveys returned {status}: {body}")
+        participants = []
+        remaining = rng.randint(*answer_range)
+        while remaining > 0:
+            batch = [{'answers': random_answers(definition['questions'], rng)} for _ in range(min(remaining, SEED_BATCH))]
+            status, result = client.request('POST', f"/v1/surveys/{body['survey_id']}/answers/batch", {'submissions': batch})
+            if status != 201:
+                raise SystemExit(f"Seeding failed: POST /answers/batch returned {status}: {result}")
+            participants.extend(item['user_code'] for item in result['results'])
+            remaining -= len(batch)
+        pool.add(body['survey_id'], body['user_code'], definition['questions'], participants)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.errors[endpoint] += not ok
+
+
+def run_operation(client, pool, rng, endpoint, question_range):
+    """Send one request of the given kind. Returns whether it got the expected answer."""
+    if endpoint == 'create':
+        definition = random_survey(rng, question_range)
+        status, body = client.request('POST', '/v1/surveys', definition)
+        if status == 201:
+            pool.add(body['survey_id'], body['user_code'], definition['questions'])
+        return status == 201
+    survey = pool.pick(rng)
+    survey_id, creator_code, questions, participants = survey
+    if endpoint == 'get':
+        status, _ = client.request('GET', f'/v1/surveys/{survey_id}')
+        return status == 200
+    if endpoint == 'submit':
+        status, body = client.request('POST', f'/v1/surveys/{survey_id}/answers', {'answers': random_answers(questions, rng)})
+        if status == 201:
+            pool.add_participant(survey, body['user_code'])
+        return status == 201
+    with pool.lock:
+        user_code = rng.choice(participants) if participants and rng.random() < 0.8 else creator_code
+    status, _ = client.request('GET', f'/v1/surveys/{survey_id}/results?user_code={user_code}')
+    return status in (200, 202)  # 202 while a survey has too few answers to show
+
+
+def load(make_client, pool, recorder, args, mix):
+    """Run --clients clients for --requests each, or for --seconds, after --warmup seconds."""
+    names, weights = list(mix), list(mix.values())
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.seconds
+
+    def run_client(index):
+        client = make_client()
+        rng = random.Random(args.seed * 1000 + index)
+        # Separate, so each client sends the same sequence of endpoints whatever the others do
+        mix_rng = random.Random(args.seed * 1000 + index + 500)
+        done = 0
+        while True:
+            if args.requests is not None:
+                if done >= args.requests:
+                    break
+            elif time.perf_counter() >= deadline:
+                break
+            endpoint = mix_rng.choices(names, weights)[0]
+            request_started = time.perf_counter()
+            try:
+                ok = run_operation(client, pool, rng, endpoint, args.questions)
+            except Exception:
+                ok = False
+            finished = time.perf_counter()
+            if args.requests is not None or request_started >= measure_from:
+                recorder.record(endpoint, finished - request_started, ok)
+                done += 1
+
+    with ThreadPoolExecutor(args.clients) as executor:
+        list(executor.map(run_client, range(args.clients)))
+    measured_from = started if args.requests is not None else measure_from
+    return time.perf_counter() - measured_from
+
+
+def report(recorder, elapsed, args, mix):
+    endpoints = {}
+    for name in ENDPOINTS:
+        latencies = recorder.latencies[name]
+        if not latencies:
+            continue
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[name],
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            **percentiles(latencies),
+        }
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        'config': {
+            'target': args.url or ('in-memory' if args.in_memory else 'in-process'),
+            'clients': args.clients,
+            'requests_per_client': args.requests,
+            'seconds': None if args.requests is not None else args.seconds,
+            'seed': args.seed,
+            'mix': mix,
+            'surveys': args.surveys,
+            'questions': list(args.questions),
+            'answers': list(args.answers),
+            'skew': args.skew,
+        },
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1),
+        'endpoints': endpoints,
+    }
+
+
+def print_report(result):
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in result['endpoints'].items():
+        print(f"{name:<10} {stats['requests']:>9,} {stats['errors']:>7,} {stats['throughput_rps']:>9,.1f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    print(f"{result['throughput_rps']:,.1f} requests/s in {result['elapsed_seconds']:.1f}s")
+
+
+def regressions(result, baseline, tolerance):
+    """What got worse than the baseline by more than tolerance, as readable lines."""
+    problems = []
+    if result['config'] != baseline['config']:
+        print("Warning: the baseline was recorded with different settings", file=sys.stderr)
+    for name, before in baseline['endpoints'].items():
+        after = result['endpoints'].get(name)
+        if after is None:
+            problems.append(f"{name}: no requests in this run")
+            continue
+        if after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {after['p95_ms']:.2f} ms, baseline {before['p95_ms']:.2f} ms")
+        if after['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            problems.append(f"{name}: {after['throughput_rps']:.1f} requests/s, baseline {before['throughput_rps']:.1f}")
+        if after['errors'] and not before['errors']:
+            problems.append(f"{name}: {after['errors']} errors, baseline none")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the survey API and compare against a baseline.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help="Base URL of a running server, including any API prefix")
+    target.add_argument('--in-memory', action='store_true', help="Run app.py in process on mongomock")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, help="Requests per client; overrides --seconds and --warmup")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of load before measuring")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f"Endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument('--surveys', type=int, default=20, help="Surveys created before the load")
+    parser.add_argument('--questions', type=parse_range, default='4-12', help="Questions per survey, N or MIN-MAX")
+    parser.add_argument('--answers', type=parse_range, default='0-500', help="Seeded answers per survey, N or MIN-MAX")
+    parser.add_argument('--skew', type=float, default=1.0, help="Popularity skew across surveys, 0 for uniform")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write this run's report to PATH")
+    parser.add_argument('--baseline', metavar='PATH', help="Fail if this run regressed from the report at PATH")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression, as a fraction")
+    args = parser.parse_args(argv)
+    mix = args.mix
+
+    make_client = client_factory(args)
+    rng = random.Random(args.seed)
+    pool = SurveyPool(args.skew)
+    seed(make_client(), pool, rng, args.surveys, args.questions, args.answers)
+    recorder = Recorder()
+    elapsed = load(make_client, pool, recorder, args, mix)
+    result = report(recorder, elapsed, args, mix)
+    print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
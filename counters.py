@@ -0,0 +1,131 @@
+# counters.py
+#
+# Running totals behind GET /v1/stats. Counting surveys and answers with
+# count_documents scans both collections, so instead one document,
+#
+#     {'_id': 'global', 'surveys': <int>, 'answers': <int>, 'reconcile_after': <epoch seconds>}
+#
+# is incremented whenever a survey or answers are stored. Increments can be lost
+# (a worker dying between the two writes) or missed (documents written or deleted
+# by hand), so every RECONCILE_INTERVAL one worker recounts both collections and
+# corrects the totals. The first recount runs in the background as soon as a
+# worker starts its reconciler, never on a request.
+
+import logging
+import os
+import threading
+import time
+from pymongo.errors import DuplicateKeyError
+
+log = logging.getLogger('percept.counters')
+
+GLOBAL_COUNTERS_ID = 'global'
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 5))  # seconds /v1/stats may lag behind
+RECONCILE_INTERVAL = int(os.environ.get('COUNTERS_RECONCILE_INTERVAL', 3600))  # seconds between recounts
+RECONCILE_CHECK_INTERVAL = 60  # seconds between checks whether a recount is due
+RECONCILE_ATTEMPTS = 3  # recounts tried before correcting totals that keep moving
+
+
+class GlobalCounters:
+    """
+    The global totals document, with a short-lived in-process copy for readers.
+
+    Reconciliation is claimed through reconcile_after, so across all workers only one
+    recount runs per interval.
+    """
+
+    def __init__(self, db, collection_name='counters', ttl=STATS_CACHE_TTL, reconcile_interval=RECONCILE_INTERVAL):
+        self.db = db
+        self.counters = self.db[collection_name]
+        self.ttl = ttl
+        self.reconcile_interval = reconcile_interval
+        self.lock = threading.Lock()
+        self.cached = None
+        self.cached_until = 0
+        self.thread = None
+
+    def record_survey(self):
+        self.counters.update_one({'_id': GLOBAL_COUNTERS_ID}, {'$inc': {'surveys': 1}}, upsert=True)
+
+    def record_answers(self, count=1):
+        self.counters.update_one({'_id': GLOBAL_COUNTERS_ID}, {'$inc': {'answers': count}}, upsert=True)
+
+    def totals(self):
+        """The body of GET /v1/stats, at most ttl seconds old."""
+        with self.lock:
+            if self.cached is not None and time.monotonic() < self.cached_until:
+                return self.cached
+
+        # Until the reconciler's first recount, documents stored before the counters
+        # existed are missing; it runs as soon as the reconciler starts
+        doc = self.counters.find_one({'_id': GLOBAL_COUNTERS_ID}) or {}
+        totals = {'total_surveys': doc.get('surveys', 0), 'total_participants': doc.get('answers', 0)}
+        with self.lock:
+            self.cached = totals
+            self.cached_until = time.monotonic() + self.ttl
+        return totals
+
+    def reconcile_if_due(self):
+        """Recount, unless another worker already has within the reconcile interval. Returns whether it did."""
+        try:
+            self.counters.insert_one({'_id': GLOBAL_COUNTERS_ID, 'surveys': 0, 'answers': 0})
+        except DuplicateKeyError:
+            pass
+        now = time.time()
+        claimed = self.counters.find_one_and_update(
+            {'_id': GLOBAL_COUNTERS_ID, 'reconcile_after': {'$not': {'$gt': now}}},
+            {'$set': {'reconcile_after': now + self.reconcile_interval}}
+        )
+        if claimed is None:
+            return False
+        self.reconcile()
+        return True
+
+    def count(self):
+        return {'surveys': self.db.surveys.count_documents({}), 'answers': self.db.answers.count_documents({})}
+
+    def reconcile(self, attempts=RECONCILE_ATTEMPTS):
+        """
+        Correct the totals against real counts.
+
+        The recount is $set only if the totals did not move while the collections were
+        being counted, since an increment made meanwhile may or may not be in the count.
+        After `attempts` counts that all raced with writes, the totals are corrected by
+        the last count against the totals read after it, taking every increment made
+        during that count as counted. That may be off by those increments, but unlike an
+        $inc against the totals read before counting, it does not add them again.
+
+        Returns:
+            dict: The drift that was corrected, per counter.
+        """
+        for _ in range(attempts):
+            before = self.counters.find_one({'_id': GLOBAL_COUNTERS_ID}) or {}
+            counts = self.count()
+            drift = {name: value - before.get(name, 0) for name, value in counts.items()}
+            if not any(drift.values()):
+                return drift
+            # A missing field matches None, as it does in before
+            unchanged = {name: before.get(name) for name in counts}
+            if self.counters.update_one({'_id': GLOBAL_COUNTERS_ID, **unchanged}, {'$set': counts}).modified_count:
+                log.warning("Corrected global counters by %s", drift)
+                return drift
+        after = self.counters.find_one({'_id': GLOBAL_COUNTERS_ID}) or {}
+        drift = {name: value - after.get(name, 0) for name, value in counts.items()}
+        if any(drift.values()):
+            self.counters.update_one({'_id': GLOBAL_COUNTERS_ID}, {'$inc': drift})
+            log.warning("Corrected global counters by %s while they were being written to", drift)
+        return drift
+
+    def start_reconciler(self, check_interval=RECONCILE_CHECK_INTERVAL):
+        """Check for a due reconciliation every check_interval seconds, in a background thread."""
+        self.thread = threading.Thread(target=self.run, args=(check_interval,), name='counters-reconciler', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self, check_interval):
+        while True:
+            try:
+                self.reconcile_if_due()
+            except Exception as e:
+                log.error("Global counters reconciliation failed: %s", e)
+            time.sleep(check_interval)
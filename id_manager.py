@@ -1,41 +1,197 @@
+import logging
 import random
-import nltk
-from nltk.corpus import wordnet as wn
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import threading
 from pymongo.errors import DuplicateKeyError
+from lemma_tables import LEMMA_TABLES_PATH, LemmaTables
+from bloom import BloomFilter
 import time
 import re
 import os
+import uuid
 
-nltk.download('words', quiet=False)
-nltk.download('wordnet', quiet=False)
-nltk.download('vader_lexicon', quiet=False)
+log = logging.getLogger('percept.ids')
 
 MIN_LEMMA_LEN = 3
 MAX_LEMMA_LEN = 10
 MIN_ID_LEN = 5
 ID_VALID_PATTERN = re.compile(r'^[a-zA-Z0-9-]+$')
 RESERVE_TIMEOUT = 3600  # 1 hour
+REPLENISH_INTERVAL = 30  # seconds between background reserve checks
+CLAIM_ROUNDS = 3  # attempts claim_ids makes before settling for a shortfall
+SWEEP_INTERVAL = 600  # seconds between background sweeps of expired reservations
+FILTER_REFRESH_INTERVAL = 900  # seconds between reloads of the known-ID filter
+FILTER_SYNC_INTERVAL = 2  # seconds between syncs of IDs other workers added to the reserve
+FILTER_MAX_STALENESS = 10  # seconds after its last sync that filter misses are still trusted
+FILTER_SYNC_OVERLAP = 30  # seconds each sync looks back, for clock skew between workers
+REFILL_LEASE_TTL = 60  # seconds one worker may hold the reserve refill lease
+MIN_FILTER_CAPACITY = 100000
+ADJ, NOUN = 'a', 'n'  # WordNet POS tags
+
+# API defaults, shared by app.py and async_app.py
+ID_SUGGESTIONS = 5
+MAX_ID_CHECK_BATCH = 100  # IDs accepted by one POST /v1/ids/check
+INITIAL_ID_RESERVE = 300  # Number of IDs to generate initially
+# The background replenisher refills the reserve up to the high watermark
+# whenever it drops below the low one
+ID_RESERVE_LOW_WATERMARK = int(os.environ.get('ID_RESERVE_LOW_WATERMARK', 100))
+ID_RESERVE_HIGH_WATERMARK = int(os.environ.get('ID_RESERVE_HIGH_WATERMARK', INITIAL_ID_RESERVE))
+
+NLTK_DATA = os.environ.get('NLTK_DATA', '/workspace/nltk_data')
+# With NLTK_OFFLINE set, missing NLTK data is an error instead of a download
+NLTK_OFFLINE = os.environ.get('NLTK_OFFLINE', '').lower() in ('1', 'true', 'yes')
+NLTK_RESOURCES = {
+    'wordnet': ['corpora/wordnet', 'corpora/wordnet.zip'],
+    'vader_lexicon': ['sentiment/vader_lexicon.zip', 'sentiment/vader_lexicon'],
+}
+
+
+def load_nltk_resource(name):
+    """
+    Import NLTK and make sure one of its data packages is installed.
+
+    Importing NLTK alone takes a good part of a second, so this is only called once
+    ID generation actually needs WordNet or VADER. Missing data is downloaded, unless
+    NLTK_OFFLINE is set, in which case a LookupError is raised.
+    """
+    import nltk
+
+    if NLTK_DATA not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA)
+    for resource in NLTK_RESOURCES[name]:
+        try:
+            nltk.data.find(resource)
+            return nltk
+        except LookupError:
+            pass
+    if NLTK_OFFLINE:
+        raise LookupError(f"NLTK resource '{name}' is not installed under {NLTK_DATA} and NLTK_OFFLINE is set")
+    log.info("Downloading NLTK resource '%s'", name)
+    nltk.download(name, quiet=True)
+    return nltk
+
+def reserve_document(id, status):
+    """A new reserve entry. added_at lets other workers' filters pick it up with sync_id_filter."""
+    return {'_id': id, 'status': status, 'added_at': time.time()}
 
-nltk.data.path.append(os.environ.get('NLTK_DATA', '/workspace/nltk_data'))
 
 class IDManager:
-    def __init__(self, db, collection_name='id_reserve', min_reserve=20, reservation_timeout=RESERVE_TIMEOUT):
+    def __init__(self, db, collection_name='id_reserve', min_reserve=20, reservation_timeout=RESERVE_TIMEOUT,
+                 lemma_tables_path=LEMMA_TABLES_PATH, filter_max_staleness=FILTER_MAX_STALENESS):
         self.db = db
         self.reserve = self.db[collection_name]
         self.min_reserve = min_reserve
         self.reservation_timeout = reservation_timeout
-        self.sia = SentimentIntensityAnalyzer()
+        self._sia = None
+        # Precomputed lemma pools, built by lemma_tables.py and already filtered with
+        # VADER. Without them lemmas are sampled from WordNet directly, which is much
+        # slower, and every pair is checked with VADER.
+        self.lemma_tables = LemmaTables(lemma_tables_path) if os.path.exists(lemma_tables_path) else None
+        self.replenisher = None
+        # Bloom filter of every ID in the reserve, so lookups for IDs that were never
+        # seen can be answered without Mongo. None until load_id_filter has run.
+        # sync_id_filter adds the IDs other workers write; misses are only trusted
+        # while the last sync is at most filter_max_staleness seconds old.
+        self.id_filter = None
+        self.filter_synced_at = 0
+        self.filter_max_staleness = filter_max_staleness
+        self.filter_pending = None
+        self.filter_lock = threading.Lock()
+
+    @property
+    def sia(self):
+        """The VADER analyzer, created on first use."""
+        if self._sia is None:
+            load_nltk_resource('vader_lexicon')
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            self._sia = SentimentIntensityAnalyzer()
+        return self._sia
+
+    def start_replenisher(self, low_watermark, high_watermark, interval=REPLENISH_INTERVAL, sweep_interval=SWEEP_INTERVAL):
+        """Move reserve replenishment and reservation sweeps off the request path, into a background thread."""
+        self.replenisher = ReserveReplenisher(self, low_watermark, high_watermark, interval, sweep_interval)
+        self.replenisher.start()
+        return self.replenisher
+
+    def request_replenish(self):
+        """Top up the reserve in the background if a replenisher is running, otherwise inline."""
+        if self.replenisher:
+            self.replenisher.notify()
+        else:
+            self.replenish_if_needed()
     
     def initialize_reserve(self, count=100):
         """Initialize the reserve with a given count of generated IDs."""
         new_ids = self.generate_new_ids(count)
-        print(new_ids)
-        self.reserve.insert_many([{'_id': id, 'status': 'available'} for id in new_ids], ordered=False)
+        log.debug("Generated %d IDs for the reserve", len(new_ids))
+        self.reserve.insert_many([reserve_document(id, 'available') for id in new_ids], ordered=False)
+        self._remember_ids(new_ids)
+
+    def load_id_filter(self):
+        """(Re)build the filter of known IDs from the whole reserve."""
+        with self.filter_lock:
+            self.filter_pending = []
+        started = time.time()
+        capacity = max(self.reserve.estimated_document_count() * 2, MIN_FILTER_CAPACITY)
+        id_filter = BloomFilter(capacity)
+        id_filter.update(doc['_id'] for doc in self.reserve.find({}, {'_id': 1}))
+        with self.filter_lock:
+            # IDs this worker added while the reserve was being read
+            id_filter.update(self.filter_pending)
+            self.filter_pending = None
+            self.id_filter = id_filter
+            self.filter_synced_at = started
+        return id_filter.count
+
+    def sync_id_filter(self):
+        """
+        Add the IDs written to the reserve since the last sync, by any worker, to the
+        known-ID filter. Loads the filter if it has not been loaded. Returns how many
+        IDs were new to it.
+        """
+        if self.id_filter is None:
+            return self.load_id_filter()
+        started = time.time()
+        since = self.filter_synced_at - FILTER_SYNC_OVERLAP
+        added = [doc['_id'] for doc in self.reserve.find({'added_at': {'$gte': since}}, {'_id': 1})]
+        with self.filter_lock:
+            # The overlap reads IDs again; only count the ones the filter lacks
+            new_ids = [id for id in added if id not in self.id_filter]
+            self.id_filter.update(new_ids)
+            self.filter_synced_at = max(self.filter_synced_at, started)
+        return len(new_ids)
+
+    def _remember_ids(self, ids):
+        """Record IDs this worker wrote to the reserve in the known-ID filter."""
+        with self.filter_lock:
+            if self.id_filter is not None:
+                self.id_filter.update(ids)
+            if self.filter_pending is not None:
+                self.filter_pending.extend(ids)
+
+    def might_exist(self, id):
+        """
+        Check the known-ID filter. False means the ID was definitely not in the reserve
+        when the filter was last synced, at most filter_max_staleness seconds ago, and
+        has not been written by this worker since. A stale filter rules nothing out.
+        """
+        id_filter = self.id_filter
+        if id_filter is None or time.time() - self.filter_synced_at > self.filter_max_staleness:
+            return True
+        return id in id_filter
     
+    def claimable_filter(self):
+        """
+        Query matching IDs that can be handed out: available ones, and reserved ones whose
+        reservation has expired. Expiry is applied here, at read time; the stored status is
+        only reset later by cleanup_expired_reservations.
+        """
+        return {'$or': [
+            {'status': 'available'},
+            {'status': 'reserved', 'reserved_at': {'$lt': time.time() - self.reservation_timeout}}
+        ]}
+
     def get_ids(self, count=1, preferred=None):
         """Get a list of available IDs, automatically reserving them."""
-        self.cleanup_expired_reservations()
         ids = []
         
         if preferred and self.is_id_available(preferred):
@@ -43,19 +199,59 @@ class IDManager:
             ids.append(preferred)
             count -= 1
 
-        cursor = self.reserve.find({'status': 'available'}).limit(count)
-        for doc in cursor:
-            id = doc['_id']
-            if self._reserve_id(id):
-                ids.append(id)
+        reserved = self.claim_ids(count)
+        if len(reserved) < count:
+            # The reserve ran dry before it could be topped up, so refill it inline
+            # rather than hand out fewer IDs than were asked for
+            self.replenish_reserve(max(count - len(reserved), self.min_reserve))
+            reserved += self.claim_ids(count - len(reserved))
+        ids.extend(reserved)
 
-        self.replenish_if_needed()
+        self.request_replenish()
         return ids
 
+    def claim_ids(self, count, status='reserved', max_rounds=CLAIM_ROUNDS):
+        """
+        Claim up to count available IDs in a bounded number of round trips.
+
+        Each round reads a batch of candidate IDs, tags the ones that are still available
+        with a token unique to this call in a single update_many, and reads back which of
+        them carry the token. Candidates lost to concurrent callers are replaced in the
+        next round, so the cost is at most three operations per round regardless of count.
+
+        Args:
+            count (int): The number of IDs wanted.
+            status (str): 'reserved' to reserve the IDs, or 'used' to consume them outright.
+            max_rounds (int): The number of rounds to try before giving up.
+
+        Returns:
+            list: The claimed IDs. Fewer than count means the reserve could not supply
+            them all, and the caller should treat the difference as a shortfall.
+        """
+        claimed = []
+        if count <= 0:
+            return claimed
+        token = uuid.uuid4().hex
+        if status == 'reserved':
+            update = {'$set': {'status': status, 'claim': token, 'reserved_at': time.time()}}
+        else:
+            update = {'$set': {'status': status, 'claim': token}, '$unset': {'reserved_at': ''}}
+
+        for _ in range(max_rounds):
+            claimable = self.claimable_filter()
+            candidates = [doc['_id'] for doc in self.reserve.find(claimable, {'_id': 1}).limit(count - len(claimed))]
+            if not candidates:
+                break
+            self.reserve.update_many({'_id': {'$in': candidates}, **claimable}, update)
+            claimed += [doc['_id'] for doc in self.reserve.find({'_id': {'$in': candidates}, 'claim': token}, {'_id': 1})]
+            if len(claimed) >= count:
+                break
+        return claimed
+
     def _reserve_id(self, id):
         """Internally reserve an ID."""
         result = self.reserve.update_one(
-            {'_id': id, 'status': 'available'},
+            {'_id': id, **self.claimable_filter()},
             {'$set': {
                 'status': 'reserved',
                 'reserved_at': time.time()
@@ -69,49 +265,110 @@ class IDManager:
             {'_id': id, 'status': {'$in': ['available', 'reserved']}},
             {'$set': {'status': 'used'}, '$unset': {'reserved_at': ''}}
         )
+        self._remember_ids([id])
         return result.modified_count > 0
 
+    def mark_ids_as_used(self, ids):
+        """Mark many IDs as used with a single update. Returns how many changed status."""
+        if not ids:
+            return 0
+        result = self.reserve.update_many(
+            {'_id': {'$in': list(ids)}, 'status': {'$in': ['available', 'reserved']}},
+            {'$set': {'status': 'used'}, '$unset': {'reserved_at': ''}}
+        )
+        self._remember_ids(ids)
+        return result.modified_count
+
+    def use_ids(self, count):
+        """Get count available IDs already marked as used, like get_id for many at once."""
+        if count <= 0:
+            return []
+        ids = self.claim_ids(count, status='used')
+        if len(ids) < count:
+            self.replenish_reserve(max(count - len(ids), self.min_reserve))
+            ids += self.claim_ids(count - len(ids), status='used')
+        if len(ids) < count:
+            raise Exception("No available IDs in the reserve")
+        self.request_replenish()
+        return ids
+
     def get_id(self):
         """Get a single available ID and mark it as used."""
-        id_doc = self.reserve.find_one_and_update(
-            {'status': 'available'},
-            {'$set': {'status': 'used'}},
-            return_document=True
-        )
+        id_doc = self._use_available()
+        if id_doc is None:
+            # The reserve ran dry before it could be topped up
+            self.replenish_reserve(self.min_reserve)
+            id_doc = self._use_available()
         if id_doc:
-            self.replenish_if_needed()
+            self.request_replenish()
             return id_doc['_id']
         else:
             raise Exception("No available IDs in the reserve")
 
+    def _use_available(self):
+        return self.reserve.find_one_and_update(
+            self.claimable_filter(),
+            {'$set': {'status': 'used'}, '$unset': {'reserved_at': ''}},
+            return_document=True
+        )
+
     def cleanup_expired_reservations(self):
-        """Clean up expired reservations."""
+        """Reset expired reservations to available. Run periodically by the replenisher."""
         expired_time = time.time() - self.reservation_timeout
-        self.reserve.update_many(
+        result = self.reserve.update_many(
             {'status': 'reserved', 'reserved_at': {'$lt': expired_time}},
             {'$set': {'status': 'available'}, '$unset': {'reserved_at': ''}}
         )
+        return result.modified_count
 
-    def is_id_available(self, id, include_reserved=False):
+    def is_id_available(self, id, include_reserved=False, use_filter=False):
         """
         Check if an ID is available and has a valid format.
         
         Args:
             id (str): The ID to check.
             include_reserved (bool): If True, consider reserved IDs as available.
+            use_filter (bool): If True, answer from the known-ID filter when it rules the
+                ID out, without querying Mongo. Only for advisory checks; see might_exist.
         
         Returns:
             bool: True if the ID is available (and valid), False otherwise.
         """
         if not self.is_valid_id_format(id):
             return False
-        self.cleanup_expired_reservations()
-        doc = self.reserve.find_one({'_id': id})
+        if use_filter and not self.might_exist(id):
+            return True
+        return self._is_doc_available(self.reserve.find_one({'_id': id}), include_reserved)
+
+    def check_ids(self, ids, include_reserved=False, use_filter=True):
+        """
+        Check the availability of many IDs with at most one query.
+
+        Returns:
+            list: One bool per ID, in the order given, as is_id_available would return.
+        """
+        lookups = [
+            id for id in ids
+            if self.is_valid_id_format(id) and (not use_filter or self.might_exist(id))
+        ]
+        docs = {doc['_id']: doc for doc in self.reserve.find({'_id': {'$in': lookups}})} if lookups else {}
+        lookups = set(lookups)
+        # Valid IDs that were not looked up are definite filter misses, so available
+        return [
+            self.is_valid_id_format(id) and (self._is_doc_available(docs.get(id), include_reserved) if id in lookups else True)
+            for id in ids
+        ]
+
+    def _is_doc_available(self, doc, include_reserved):
         if doc is None:
             return True
         if include_reserved:    
             return doc['status'] in ['available', 'reserved']
-        return doc['status'] == 'available'
+        return doc['status'] == 'available' or self.is_reservation_expired(doc)
+
+    def is_reservation_expired(self, doc):
+        """Check whether a reserve document is a reservation that has timed out."""
+        return doc['status'] == 'reserved' and doc.get('reserved_at', 0) < time.time() - self.reservation_timeout
         
     def is_valid_id_format(self, id):
         """Check if the ID has a valid format."""
@@ -124,22 +381,25 @@ class IDManager:
     def add_custom_id(self, id):
         """Add a custom ID to the reserve and mark it as used."""
         try:
-            self.reserve.insert_one({'_id': id, 'status': 'used'})
+            self.reserve.insert_one(reserve_document(id, 'used'))
+            self._remember_ids([id])
         except DuplicateKeyError:
             # If the ID already exists, just mark it as used
             self.mark_id_as_used(id)
 
     def replenish_if_needed(self):
         """Replenish the reserve if it's running low."""
-        available_count = self.reserve.count_documents({'status': 'available'})
+        available_count = self.reserve.count_documents(self.claimable_filter())
         if available_count < self.min_reserve:
             self.replenish_reserve(self.min_reserve - available_count)
 
     def replenish_reserve(self, count):
         """Add new IDs to the reserve."""
         new_ids = self.generate_new_ids(count)
-        print(new_ids)
-        self.reserve.insert_many([{'_id': id, 'status': 'available'} for id in new_ids], ordered=False)
+        log.debug("Generated %d IDs for the reserve", len(new_ids))
+        self.reserve.insert_many([reserve_document(id, 'available') for id in new_ids], ordered=False)
+        self._remember_ids(new_ids)
+        return len(new_ids)
 
     def generate_new_ids(self, count):
         """Generate new unique IDs using noun-adjective combinations."""
@@ -165,7 +425,7 @@ class IDManager:
             raise ValueError(f"Unable to generate any unique IDs after {max_attempts} attempts")
 
         if len(new_ids) < count:
-            print(f"Warning: Only generated {len(new_ids)} unique IDs out of {count} requested")
+            log.warning("Only generated %d unique IDs out of %d requested", len(new_ids), count)
 
         return list(new_ids)[:count]
 
@@ -174,12 +434,14 @@ class IDManager:
         adj_count = min(count, 20)  # Number of adjectives to fetch
         noun_count = min(count, 20)  # Number of nouns to fetch
         
-        adjectives = [self.get_random_lemma(wn.ADJ) for _ in range(adj_count)]
-        nouns = [self.get_random_lemma(wn.NOUN) for _ in range(noun_count)]
+        adjectives = [self.get_random_lemma(ADJ) for _ in range(adj_count)]
+        nouns = [self.get_random_lemma(NOUN) for _ in range(noun_count)]
         
+        # Lemma tables only hold words VADER already passed, so the pairs need no
+        # further check and neither WordNet nor VADER has to be loaded.
         combinations = [
             f"{adj}-{noun}" for adj in adjectives for noun in nouns
-            if self.is_safe_word(f"{adj}-{noun}")
+            if self.lemma_tables or self.is_safe_word(f"{adj}-{noun}")
         ]
         
         # Shuffle the combinations and return up to the requested count
@@ -188,6 +450,10 @@ class IDManager:
 
     def get_random_lemma(self, pos):
         """Get a random lemma from WordNet."""
+        if self.lemma_tables:
+            return self.lemma_tables.random_lemma(pos)
+        load_nltk_resource('wordnet')
+        from nltk.corpus import wordnet as wn
         while True:
             words = list(wn.all_synsets(pos))
             word = random.choice(words).lemmas()[0].name().replace('_', '-')
@@ -197,4 +463,150 @@ class IDManager:
     def is_safe_word(self, word):
         """Check if a word is safe using VADER sentiment analysis."""
         sentiment_score = self.sia.polarity_scores(word)['compound']
-        return sentiment_score >= 0
\ No newline at end of file
+        return sentiment_score >= 0
+
+
+class ReserveReplenisher:
+    """
+    Keeps the ID reserve between a low and a high watermark from a background thread.
+
+    Request handlers only nudge it after taking IDs, so they never count the reserve
+    or generate IDs themselves unless it has run completely dry. The thread also
+    checks every interval seconds on its own, and every sweep_interval seconds
+    resets expired reservations so the request path never writes reserve-wide. It
+    adds IDs other workers wrote to the known-ID filter every filter_sync_interval
+    seconds, and reloads the whole filter every filter_refresh_interval seconds.
+
+    Every worker runs one, so refills take a short lease in the locks collection:
+    only its holder tops the reserve up, and it counts the reserve again first, so
+    workers that all saw it low do not each add a refill's worth of IDs.
+    """
+
+    def __init__(self, id_manager, low_watermark, high_watermark, interval=REPLENISH_INTERVAL, sweep_interval=SWEEP_INTERVAL,
+                 filter_refresh_interval=FILTER_REFRESH_INTERVAL, filter_sync_interval=FILTER_SYNC_INTERVAL,
+                 lock_collection='locks', refill_lease_ttl=REFILL_LEASE_TTL):
+        if high_watermark < low_watermark:
+            raise ValueError("high_watermark must not be below low_watermark")
+        self.id_manager = id_manager
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.interval = interval
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0
+        self.swept = 0
+        self.filter_refresh_interval = filter_refresh_interval
+        self.filter_sync_interval = filter_sync_interval
+        self.last_filter_load = 0
+        self.last_check = 0
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.pool_depth = None
+        self.refills = 0
+        self.last_refill_count = 0
+        self.last_refill_seconds = None
+        self.locks = id_manager.db[lock_collection]
+        self.lock_id = f'{id_manager.reserve.name}_refill'
+        self.refill_lease_ttl = refill_lease_ttl
+
+    def start(self):
+        """Start the background thread, or restart it in a forked worker process."""
+        if self.thread and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='id-reserve-replenisher', daemon=True)
+        self.thread.start()
+
+    def notify(self):
+        """Ask the background thread to check the reserve now."""
+        self.start()
+        self.wakeup.set()
+
+    def run(self):
+        woken = True
+        while True:
+            try:
+                self.sweep_if_due()
+                if woken or time.time() - self.last_check >= self.interval:
+                    self.check()
+                self.sync_filter()
+            except Exception as e:
+                log.error("ID reserve replenishment failed: %s", e)
+            woken = self.wakeup.wait(min(self.interval, self.filter_sync_interval))
+            self.wakeup.clear()
+
+    def check(self):
+        """Refill the reserve up to the high watermark if it is below the low watermark."""
+        with self.lock:
+            self.last_check = time.time()
+            self.pool_depth = self.id_manager.reserve.count_documents(self.id_manager.claimable_filter())
+            if self.pool_depth >= self.low_watermark:
+                return 0
+            owner = self.claim_refill()
+            if owner is None:
+                log.debug("Another worker is refilling the ID reserve")
+                return 0
+            try:
+                # Another worker may have refilled it between the count and the claim
+                self.pool_depth = self.id_manager.reserve.count_documents(self.id_manager.claimable_filter())
+                if self.pool_depth >= self.low_watermark:
+                    return 0
+                start = time.perf_counter()
+                added = self.id_manager.replenish_reserve(self.high_watermark - self.pool_depth)
+            finally:
+                self.release_refill(owner)
+            self.last_refill_seconds = time.perf_counter() - start
+            self.last_refill_count = added
+            self.refills += 1
+            self.pool_depth += added
+            log.info("Replenished ID reserve with %s IDs in %.3fs", added, self.last_refill_seconds)
+            return added
+
+    def claim_refill(self):
+        """Take the refill lease unless another worker holds it. Returns the owner token, or None."""
+        owner = uuid.uuid4().hex
+        now = time.time()
+        try:
+            self.locks.update_one(
+                {'_id': self.lock_id, 'expires_at': {'$lt': now}},
+                {'$set': {'owner': owner, 'expires_at': now + self.refill_lease_ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return None  # Held: the upsert tried to insert a second lease
+        return owner
+
+    def release_refill(self, owner):
+        """Let the refill lease lapse now, if it is still ours."""
+        self.locks.update_one({'_id': self.lock_id, 'owner': owner}, {'$set': {'expires_at': 0}})
+
+    def sweep_if_due(self):
+        """Reset expired reservations if the last sweep was more than sweep_interval ago."""
+        if time.time() - self.last_sweep < self.sweep_interval:
+            return 0
+        self.last_sweep = time.time()
+        swept = self.id_manager.cleanup_expired_reservations()
+        self.swept += swept
+        return swept
+
+    def sync_filter(self):
+        """Reload the known-ID filter if it is older than filter_refresh_interval, otherwise sync it."""
+        if time.time() - self.last_filter_load < self.filter_refresh_interval:
+            self.id_manager.sync_id_filter()
+            return
+        self.last_filter_load = time.time()
+        self.id_manager.load_id_filter()
+
+    def stats(self):
+        """Pool depth as of the last check, and how the latest refill went."""
+        return {
+            'pool_depth': self.pool_depth,
+            'low_watermark': self.low_watermark,
+            'high_watermark': self.high_watermark,
+            'refills': self.refills,
+            'last_refill_count': self.last_refill_count,
+            'last_refill_seconds': self.last_refill_seconds,
+            'expired_reservations_swept': self.swept,
+            'known_id_filter_size': self.id_manager.id_filter.count if self.id_manager.id_filter else None
+        }
@@ -0,0 +1,55 @@
+# indexes.py
+#
+# Declares the indexes the API's queries rely on. Run it once per deploy, before
+# the new workers start:
+#
+#     python indexes.py
+#
+# create_indexes is a no-op for indexes that already exist with the same spec,
+# so running it repeatedly is safe.
+
+import logging
+import os
+from pymongo import ASCENDING, MongoClient, IndexModel
+
+log = logging.getLogger('percept.indexes')
+
+INDEXES = {
+    'surveys': [
+        # get_survey, submit_answers and process_results look surveys up by ID
+        IndexModel([('survey_id', ASCENDING)], name='survey_id_unique', unique=True),
+        # get_results_by_user_code finds a creator's survey by their user code
+        IndexModel([('user_code', ASCENDING)], name='user_code'),
+    ],
+    'answers': [
+        # Per-survey queries, above all the summary aggregation that rebuilds a survey's
+        # aggregate, and time-ranged ones such as trending_filter.
+        IndexModel([('survey_id', ASCENDING), ('submitted_at', ASCENDING)], name='survey_id_submitted_at'),
+        # Participant lookups in get_results_by_user_code and process_results
+        IndexModel([('user_code', ASCENDING)], name='user_code'),
+    ],
+    'id_reserve': [
+        # Claiming available IDs and sweeping expired reservations
+        IndexModel([('status', ASCENDING), ('reserved_at', ASCENDING)], name='status_reserved_at'),
+        # Syncing each worker's known-ID filter with the IDs others added
+        IndexModel([('added_at', ASCENDING)], name='added_at'),
+    ],
+    'worker_leases': [
+        # Taking over Snowflake worker slots whose lease has expired
+        IndexModel([('expires_at', ASCENDING)], name='expires_at'),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every declared index that does not exist yet."""
+    for collection_name, indexes in INDEXES.items():
+        created = db[collection_name].create_indexes(indexes)
+        log.info("Ensured indexes on %s: %s", collection_name, ', '.join(created))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/percept"))
+    ensure_indexes(client.get_default_database())
+    client.close()
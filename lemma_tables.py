@@ -0,0 +1,115 @@
+# lemma_tables.py
+#
+# Precomputed WordNet lemma pools for ID generation. Build them once (at image
+# build time, after the NLTK data is downloaded):
+#
+#     python lemma_tables.py [path]
+#
+# The file holds a small header followed by fixed-width, NUL-padded ASCII
+# records, adjectives first, then nouns. IDManager memory-maps it, so picking a
+# random lemma is a single slice instead of a walk over every WordNet synset.
+# Lemmas VADER scores as negative are left out, so with the tables in place a
+# worker never has to load WordNet or VADER at all.
+
+import mmap
+import os
+import random
+import re
+import struct
+
+MAGIC = b'LEMM'
+HEADER = struct.Struct('<4sHII')  # magic, record width, adjective count, noun count
+LEMMA_PATTERN = re.compile(r'^[a-z0-9-]+$')
+LEMMA_TABLES_PATH = os.environ.get('LEMMA_TABLES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lemmas.bin'))
+
+
+def extract_lemmas(synsets, min_len, max_len, is_safe=None):
+    """
+    Extract the lemmas IDManager would accept from a sequence of synsets.
+
+    One entry is kept per synset (its first lemma), duplicates included, so sampling
+    uniformly from the result has the same distribution as the rejection sampling over
+    synsets it replaces. Lemmas that could not appear in a valid ID are dropped, as are
+    those is_safe rejects when it is given.
+    """
+    lemmas = []
+    verdicts = {}
+    for synset in synsets:
+        word = synset.lemmas()[0].name().replace('_', '-').lower()
+        if not (min_len <= len(word) <= max_len and LEMMA_PATTERN.match(word)):
+            continue
+        if is_safe is not None:
+            if word not in verdicts:
+                verdicts[word] = is_safe(word)
+            if not verdicts[word]:
+                continue
+        lemmas.append(word)
+    return lemmas
+
+
+def write_lemma_tables(path, adjectives, nouns):
+    """Write adjective and noun lemma lists to path in the lemma table format."""
+    width = max(len(word) for word in adjectives + nouns)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, width, len(adjectives), len(nouns)))
+        for word in adjectives + nouns:
+            f.write(word.encode('ascii').ljust(width, b'\0'))
+    os.replace(tmp_path, path)
+
+
+def build_lemma_tables(path, min_len, max_len):
+    """Extract the adjective and noun lemma pools from WordNet and write them to path."""
+    from nltk.corpus import wordnet as wn
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+    sia = SentimentIntensityAnalyzer()
+
+    def is_safe(word):
+        # VADER sees a hyphenated lemma as one unknown token, so score its parts
+        return sia.polarity_scores(word.replace('-', ' '))['compound'] >= 0
+
+    adjectives = extract_lemmas(wn.all_synsets(wn.ADJ), min_len, max_len, is_safe)
+    nouns = extract_lemmas(wn.all_synsets(wn.NOUN), min_len, max_len, is_safe)
+    write_lemma_tables(path, adjectives, nouns)
+    return len(adjectives), len(nouns)
+
+
+class LemmaTables:
+    """Read-only, memory-mapped view of a lemma table file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, adj_count, noun_count = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lemma table file")
+        adj_start = HEADER.size
+        noun_start = adj_start + adj_count * self.width
+        # Keyed by the WordNet POS tags IDManager passes in ('a' and 'n')
+        self.tables = {'a': (adj_start, adj_count), 'n': (noun_start, noun_count)}
+
+    def random_lemma(self, pos):
+        """Pick a lemma of the given part of speech uniformly at random."""
+        start, count = self.tables[pos]
+        offset = start + random.randrange(count) * self.width
+        return self.data[offset:offset + self.width].rstrip(b'\0').decode('ascii')
+
+    def lemmas(self, pos):
+        """All lemmas of the given part of speech, in table order."""
+        start, count = self.tables[pos]
+        return [
+            self.data[start + i * self.width:start + (i + 1) * self.width].rstrip(b'\0').decode('ascii')
+            for i in range(count)
+        ]
+
+
+if __name__ == '__main__':
+    import sys
+    from id_manager import MIN_LEMMA_LEN, MAX_LEMMA_LEN, load_nltk_resource
+
+    load_nltk_resource('wordnet')
+    load_nltk_resource('vader_lexicon')
+    path = sys.argv[1] if len(sys.argv) > 1 else LEMMA_TABLES_PATH
+    adj_count, noun_count = build_lemma_tables(path, MIN_LEMMA_LEN, MAX_LEMMA_LEN)
+    print(f"Wrote {adj_count} adjectives and {noun_count} nouns to {path}")
@@ -0,0 +1,237 @@
+# logs.py
+#
+# Logging for app.py and async_app.py, set up by configure_logging():
+#
+#   - Every module logs to its own category, a logger under 'percept' (percept.app,
+#     percept.surveys, percept.ids, ...), with lazy %-style arguments, so a message
+#     below the category's level costs one level check and is never formatted.
+#   - LOG_LEVEL (default INFO) is the level of every category, and LOG_LEVELS
+#     overrides it per category, e.g. LOG_LEVELS=ids=DEBUG,app=WARNING.
+#   - LOG_SAMPLE_RATE (default 0) is the fraction of requests whose records are
+#     all kept, DEBUG included, whatever the levels. Records carry the ID of the
+#     request that logged them, so a sampled request can be followed end to end.
+#   - Records are handed to a QueueListener thread, which formats and writes them,
+#     so a request never waits on stderr. When LOG_QUEUE_SIZE records are already
+#     waiting, new ones are dropped and counted instead.
+#   - LOG_FORMAT=json (the default) writes one JSON object per line; LOG_FORMAT=text
+#     writes plain lines for local development.
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')  # category=LEVEL,...
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0))
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # records waiting to be written at most
+ROOT_CATEGORY = 'percept'
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+SAFE_ARGUMENT_TYPES = (str, int, float, bool, type(None))
+
+# (request ID, sampled) of the request being handled, if any
+current_request = contextvars.ContextVar('current_log_request', default=None)
+request_sample_rate = 0.0  # Set by configure_logging
+
+
+def parse_levels(spec):
+    """'ids=DEBUG,app=WARNING' as {'percept.ids': 10, 'percept.app': 30}."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        category, _, level = item.partition('=')
+        name = category.strip()
+        if name != ROOT_CATEGORY and not name.startswith(f'{ROOT_CATEGORY}.'):
+            name = f'{ROOT_CATEGORY}.{name}'
+        levels[name] = logging.getLevelName(level.strip().upper())
+        if not isinstance(levels[name], int):
+            raise ValueError(f"Unknown log level in LOG_LEVELS: {item}")
+    return levels
+
+
+def start_request():
+    """Give the current request an ID and decide whether it is sampled. Call from before_request."""
+    sampled = request_sample_rate > 0 and random.random() < request_sample_rate
+    current_request.set((uuid.uuid4().hex[:16], sampled))
+
+
+def finish_request():
+    current_request.set(None)
+
+
+class CategoryFilter(logging.Filter):
+    """
+    Applies the per-category levels, letting every record of a sampled request through.
+
+    Only installed when sampling is on. Loggers are then left at DEBUG, and the
+    levels are checked here instead.
+    """
+
+    def __init__(self, default_level, levels):
+        super().__init__()
+        self.default_level = default_level
+        self.levels = levels
+
+    def level_for(self, name):
+        while name:
+            if name in self.levels:
+                return self.levels[name]
+            name = name.rpartition('.')[0]
+        return self.default_level
+
+    def filter(self, record):
+        if record.levelno >= self.level_for(record.name):
+            return True
+        request = current_request.get()
+        return request is not None and request[1]
+
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener without blocking, dropping them when the queue is full.
+
+    The listener thread is started on first use in each process, so one started
+    before gunicorn forks is not lost in the workers.
+    """
+
+    def __init__(self, target, max_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(max_size))
+        self.target = target
+        self.max_size = max_size
+        self.dropped = 0
+        self.pid = None
+        self.listener = None
+        self.listener_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Other handlers may still look at the original
+        record = copy.copy(record)
+        request = current_request.get()
+        record.request_id = request[0] if request else None
+        if record.exc_info:
+            # The traceback must be rendered while it still exists
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args and not all(isinstance(arg, SAFE_ARGUMENT_TYPES) for arg in record.args):
+            # Mutable arguments may change before the listener gets to them
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.listener_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue(self.max_size)  # Anything queued before a fork belongs to the parent
+            self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        """Write what is queued and stop the listener thread."""
+        with self.listener_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, category, message, request ID and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and name != 'request_id':
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, levels=LOG_LEVELS, sample_rate=LOG_SAMPLE_RATE, log_format=LOG_FORMAT,
+                      stream=None, max_queue_size=LOG_QUEUE_SIZE):
+    """
+    Route all logging through a RequestQueueHandler on the root logger, replacing its handlers.
+
+    Args:
+        level (str): Level of every category without its own, and of other libraries.
+        levels (str): Per-category overrides, as in LOG_LEVELS.
+        sample_rate (float): Fraction of requests whose records are all kept.
+        log_format (str): 'json' or 'text'.
+        stream: Where the listener writes, stderr by default.
+
+    Returns:
+        RequestQueueHandler: The installed handler.
+    """
+    global request_sample_rate
+    default_level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    category_levels = parse_levels(levels) if isinstance(levels, str) else dict(levels)
+
+    target = logging.StreamHandler(stream or sys.stderr)
+    if log_format == 'json':
+        target.setFormatter(JSONFormatter())
+    else:
+        target.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, RequestQueueHandler):
+            handler.stop()
+        root.removeHandler(handler)
+    handler = RequestQueueHandler(target, max_queue_size)
+    root.addHandler(handler)
+    root.setLevel(default_level)
+    atexit.register(handler.stop)
+
+    # Levels may have been set by an earlier configure_logging
+    for name, logger in list(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and (name == ROOT_CATEGORY or name.startswith(f'{ROOT_CATEGORY}.')):
+            logger.setLevel(logging.NOTSET)
+    categories = logging.getLogger(ROOT_CATEGORY)
+    request_sample_rate = sample_rate
+    if sample_rate > 0:
+        # Sampled requests need every record created, so the filter applies the levels
+        categories.setLevel(logging.DEBUG)
+        handler.addFilter(CategoryFilter(default_level, category_levels))
+    else:
+        categories.setLevel(default_level)
+        for name, category_level in category_levels.items():
+            logging.getLogger(name).setLevel(category_level)
+    return handler
+
+
+def dropped_records():
+    """Records the installed RequestQueueHandler has dropped in this process, for GET /metrics."""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, RequestQueueHandler):
+            return handler.dropped
+    return 0
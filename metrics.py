@@ -0,0 +1,309 @@
+# metrics.py
+#
+# Request and Mongo metrics in the Prometheus text format, served on GET /metrics:
+#
+#   percept_http_requests_total                counter    method, route, status
+#   percept_http_request_duration_seconds      histogram  method, route
+#   percept_mongo_commands_per_request         histogram  method, route
+#   percept_mongo_request_commands_total       counter    method, route
+#   percept_mongo_request_bytes_total          counter    method, route (sent plus received)
+#   percept_mongo_commands_total               counter    command
+#   percept_mongo_command_errors_total         counter    command
+#   percept_mongo_command_seconds_total        counter    command
+#   percept_mongo_sent_bytes_total             counter    command
+#   percept_mongo_received_bytes_total         counter    command
+#
+# plus whatever gauges the app passes to render(), such as the ID reserve depth.
+# Mongo commands are seen through a pymongo CommandListener and charged to the
+# request that issued them, if any. pymongo does not report wire sizes to
+# listeners, so byte counts are from re-encoding commands and replies as BSON.
+# Batches of documents (cursor replies, inserts) are not re-encoded in full:
+# their size is estimated from BATCH_SAMPLE of their documents, which bounds the
+# cost per command at encoding the envelope plus that many documents.
+#
+# Each gunicorn worker only sees its own requests. With METRICS_DIR set to a
+# directory shared by the workers of a host (and emptied when they start, e.g. in
+# the container's entrypoint), every worker writes its totals there every
+# METRICS_WRITE_INTERVAL seconds, and a scrape of any worker sums them all. Files of
+# workers that have exited are kept, so counters never go backwards.
+
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import bson
+from pymongo import monitoring
+
+log = logging.getLogger('percept.metrics')
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 5))  # seconds
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+COMMAND_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32)  # Mongo commands per request
+BATCH_SAMPLE = 16  # documents of a batch encoded to estimate the batch's size
+
+# The tally of the request being handled, if any. Threads and asyncio tasks each
+# have their own, and tasks or threads started by asyncio inherit the request's.
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class RequestTally:
+    __slots__ = ('started', 'commands', 'bytes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.bytes = 0
+
+
+def array_overhead(length):
+    """Bytes BSON spends on the type and index key of each element of an array of this length."""
+    overhead, start, digits = 0, 0, 1
+    while start < length:
+        end = min(length, 10 ** digits)
+        overhead += (end - start) * (digits + 2)
+        start, digits = end, digits + 1
+    return overhead
+
+
+def batch_size(documents):
+    """The BSON size of a list of documents, estimated from at most BATCH_SAMPLE of them."""
+    if len(documents) <= BATCH_SAMPLE:
+        sample = documents
+    else:
+        step = len(documents) / BATCH_SAMPLE
+        sample = [documents[int(i * step)] for i in range(BATCH_SAMPLE)]
+    sampled = sum(len(bson.encode(document)) for document in sample)
+    return round(sampled * len(documents) / len(sample)) + array_overhead(len(documents)) if sample else 0
+
+
+def bson_size(document):
+    """
+    The size of a command or reply as BSON. A cursor batch or the documents of an
+    insert are estimated with batch_size; everything else is encoded.
+    """
+    cursor = document.get('cursor')
+    if isinstance(cursor, dict):
+        for key in ('firstBatch', 'nextBatch'):
+            if isinstance(cursor.get(key), list) and len(cursor[key]) > BATCH_SAMPLE:
+                envelope = {**document, 'cursor': {**cursor, key: []}}
+                return len(bson.encode(envelope)) + batch_size(cursor[key])
+    documents = document.get('documents')
+    if isinstance(documents, list) and len(documents) > BATCH_SAMPLE:
+        return len(bson.encode({**document, 'documents': []})) + batch_size(documents)
+    return len(bson.encode(document))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts commands, their durations and their sizes on the wire, for Metrics."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        size = bson_size(event.command)
+        tally = current_request.get()
+        if tally is not None:
+            tally.commands += 1
+            tally.bytes += size
+        self.metrics.inc('percept_mongo_commands_total', {'command': event.command_name})
+        self.metrics.inc('percept_mongo_sent_bytes_total', {'command': event.command_name}, size)
+
+    def succeeded(self, event):
+        size = bson_size(event.reply)
+        tally = current_request.get()
+        if tally is not None:
+            tally.bytes += size
+        self.metrics.inc('percept_mongo_received_bytes_total', {'command': event.command_name}, size)
+        self.metrics.inc('percept_mongo_command_seconds_total', {'command': event.command_name},
+                         event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.metrics.inc('percept_mongo_command_errors_total', {'command': event.command_name})
+        self.metrics.inc('percept_mongo_command_seconds_total', {'command': event.command_name},
+                         event.duration_micros / 1e6)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Counters and histograms for one process, and the Prometheus rendering of all of them.
+
+    Only numbers are kept, so recording costs a dict update under a lock.
+    """
+
+    def __init__(self, directory=METRICS_DIR, write_interval=METRICS_WRITE_INTERVAL):
+        self.directory = directory
+        self.write_interval = write_interval
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.buckets = {
+            'percept_http_request_duration_seconds': LATENCY_BUCKETS,
+            'percept_mongo_commands_per_request': COMMAND_BUCKETS,
+        }
+        self.command_listener = MongoCommandListener(self)
+        self.pid = os.getpid()  # The process the counts belong to
+        self.writer_pid = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.write)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = self.buckets[name]
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(buckets)] += 1
+            histogram[-1] += value
+
+    def start_request(self):
+        """Start timing a request and charging Mongo commands to it. Call from before_request."""
+        self._check_process()
+        current_request.set(RequestTally())
+
+    def finish_request(self, method, route, status):
+        """Record the request started by start_request. Call from after_request."""
+        tally = current_request.get()
+        if tally is None:
+            return
+        current_request.set(None)
+        labels = {'method': method, 'route': route}
+        self.inc('percept_http_requests_total', {**labels, 'status': str(status)})
+        self.observe('percept_http_request_duration_seconds', labels, time.perf_counter() - tally.started)
+        self.observe('percept_mongo_commands_per_request', labels, tally.commands)
+        self.inc('percept_mongo_request_commands_total', labels, tally.commands)
+        self.inc('percept_mongo_request_bytes_total', labels, tally.bytes)
+
+    def snapshot(self):
+        """This process's values, in the form written to METRICS_DIR."""
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def _check_process(self):
+        """Once per process: drop counts inherited through a fork and start the METRICS_DIR writer."""
+        if self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid == os.getpid():
+                return
+            if self.pid != os.getpid():
+                # Forked (gunicorn --preload): the counts so far are the parent's
+                self.pid = os.getpid()
+                self.counters.clear()
+                self.histograms.clear()
+            self.writer_pid = os.getpid()
+        if not self.directory:
+            return
+        threading.Thread(target=self.run_writer, name='metrics-writer', daemon=True).start()
+
+    def run_writer(self):
+        while True:
+            time.sleep(self.write_interval)
+            try:
+                self.write()
+            except Exception as e:
+                log.error("Failed to write metrics: %s", e)
+
+    def write(self):
+        """Write this process's snapshot to METRICS_DIR, atomically."""
+        if not self.directory or self.pid != os.getpid():
+            return
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def collect(self):
+        """Snapshots of every worker: this one's live, the others' as last written."""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    pass  # Being replaced right now; it is in the next scrape
+        return snapshots
+
+    def render(self, gauges=None):
+        """
+        All workers' metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges (dict): Gauge names mapped to their current value, reported as is.
+        """
+        counters, histograms = {}, {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), values in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets[name] + ('+Inf',), values):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(bound)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-1])}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        for name, value in sorted((gauges or {}).items()):
+            if value is not None:
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
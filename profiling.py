@@ -0,0 +1,267 @@
+# profiling.py
+#
+# Opt-in cProfile capture of single requests to app.py. A request is profiled when
+#
+#   - it carries a valid X-Profile header, signed with PROFILE_SECRET (see `sign`
+#     below), so a slow request can be reproduced under the profiler in production, or
+#   - it is picked at random, with probability PROFILE_SAMPLE_RATE (default 0).
+#
+# Each capture is written to PROFILE_DIR as a pstats file, next to a JSON file with
+# the request, its status and duration, and the Mongo commands it issued. Only the
+# newest PROFILE_KEEP captures are kept. Summarize them offline with
+#
+#     python profiling.py summarize [directory] [--route ROUTE] [--sort cumulative] [--limit 30]
+#
+# and make a header value for a path with
+#
+#     PROFILE_SECRET=... python profiling.py sign /v1/surveys/<survey_id>/results
+
+import argparse
+import contextvars
+import cProfile
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from pymongo import monitoring
+
+log = logging.getLogger('percept.profiling')
+
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/percept-profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))  # captures kept on disk
+PROFILE_HEADER = 'X-Profile'
+SIGNATURE_TTL = 300  # seconds a signed header stays valid
+
+current_capture = contextvars.ContextVar('current_capture', default=None)
+
+
+def signature(secret, timestamp, path):
+    return hmac.new(secret.encode(), f'{timestamp}:{path}'.encode(), hashlib.sha256).hexdigest()
+
+
+def sign(secret, path, now=None):
+    """An X-Profile header value that asks for the request to path to be profiled."""
+    timestamp = int(now if now is not None else time.time())
+    return f'{timestamp}:{signature(secret, timestamp, path)}'
+
+
+def verify(secret, header, path, now=None):
+    """Whether an X-Profile header value was signed with secret for path within SIGNATURE_TTL."""
+    if not secret or not header or ':' not in header:
+        return False
+    timestamp, digest = header.split(':', 1)
+    if not timestamp.isdigit() or abs((now or time.time()) - int(timestamp)) > SIGNATURE_TTL:
+        return False
+    return hmac.compare_digest(digest, signature(secret, timestamp, path))
+
+
+class Capture:
+    __slots__ = ('profile', 'started', 'reason', 'commands')
+
+    def __init__(self, reason):
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.reason = reason
+        self.commands = []
+
+
+class ProfileCommandListener(monitoring.CommandListener):
+    """Records the Mongo commands issued while a request is being profiled."""
+
+    def started(self, event):
+        capture = current_capture.get()
+        if capture is not None:
+            collection = event.command.get(event.command_name)
+            capture.commands.append({
+                'request_id': event.request_id,
+                'command': event.command_name,
+                'collection': collection if isinstance(collection, str) else None,
+            })
+
+    def succeeded(self, event):
+        self._finish(event, None)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure))
+
+    def _finish(self, event, failure):
+        capture = current_capture.get()
+        if capture is None:
+            return
+        for command in reversed(capture.commands):
+            if command['request_id'] == event.request_id:
+                command['duration_ms'] = event.duration_micros / 1000
+                if failure:
+                    command['failure'] = failure
+                break
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and writes their captures.
+
+    Call start from before_request and finish from after_request. Profiling is per
+    thread, so it is only meant for the synchronous app.
+    """
+
+    def __init__(self, secret=PROFILE_SECRET, sample_rate=PROFILE_SAMPLE_RATE, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self.command_listener = ProfileCommandListener()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.secret) or self.sample_rate > 0
+
+    def start(self, path, header):
+        """Start profiling the current request if it is signed or sampled. Returns whether it did."""
+        stale = current_capture.get()
+        if stale is not None:
+            # A previous request on this thread never reached finish
+            stale.profile.disable()
+            current_capture.set(None)
+        if not self.enabled:
+            return False
+        if header and verify(self.secret, header, path):
+            reason = 'signed'
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            return False
+        capture = Capture(reason)
+        current_capture.set(capture)
+        try:
+            capture.profile.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            current_capture.set(None)
+            return False
+        return True
+
+    def finish(self, method, path, route, status):
+        """Stop profiling the current request, if it was, and write the capture. Returns its path."""
+        capture = current_capture.get()
+        if capture is None:
+            return None
+        capture.profile.disable()
+        current_capture.set(None)
+        duration_ms = (time.perf_counter() - capture.started) * 1000
+        try:
+            return self.write(capture, {
+                'method': method,
+                'path': path,
+                'route': route,
+                'status': status,
+                'reason': capture.reason,
+                'duration_ms': round(duration_ms, 3),
+                'pid': os.getpid(),
+                'captured_at': time.time(),
+                'commands': capture.commands,
+            })
+        except OSError as e:
+            log.error("Failed to write profile: %s", e)
+            return None
+
+    def write(self, capture, info):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', info['path']).strip('_')[:80] or 'root'
+        base = os.path.join(self.directory, f"{time.time_ns()}-{os.getpid()}-{info['method']}-{slug}")
+        capture.profile.dump_stats(f'{base}.prof')
+        with open(f'{base}.json', 'w') as f:
+            json.dump(info, f, indent=1)
+        self.rotate()
+        log.info("Profiled %s %s (%s) in %.1f ms: %s.prof", info['method'], info['path'], info['reason'], info['duration_ms'], base)
+        return f'{base}.prof'
+
+    def rotate(self):
+        """Delete all but the newest keep captures."""
+        with self.lock:
+            captures = sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+            for path in captures[:max(0, len(captures) - self.keep)]:
+                for stale in (path, path[:-len('.prof')] + '.json'):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+
+
+def load_captures(directory, route=None):
+    """The (profile path, info) pairs in directory, oldest first, optionally for one route."""
+    captures = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        try:
+            with open(path[:-len('.prof')] + '.json') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            info = {}
+        if route is None or info.get('route') == route:
+            captures.append((path, info))
+    return captures
+
+
+def summarize(directory, route=None, sort='cumulative', limit=30, stream=sys.stdout):
+    """Print the functions that took the most time across captures, and the Mongo commands they issued."""
+    captures = load_captures(directory, route)
+    if not captures:
+        print(f"No profiles in {directory}" + (f" for route {route}" if route else ''), file=stream)
+        return None
+
+    durations = sorted(info.get('duration_ms', 0) for _, info in captures)
+    print(f"{len(captures)} profiles, median request {durations[len(durations) // 2]:.1f} ms, "
+          f"slowest {durations[-1]:.1f} ms", file=stream)
+
+    commands = {}
+    for _, info in captures:
+        for command in info.get('commands', []):
+            key = (command['command'], command.get('collection'))
+            count, total = commands.get(key, (0, 0))
+            commands[key] = (count + 1, total + command.get('duration_ms', 0))
+    if commands:
+        print("\nMongo commands (per request, time per request):", file=stream)
+        for (name, collection), (count, total) in sorted(commands.items(), key=lambda item: -item[1][1]):
+            print(f"  {name:<16} {collection or '-':<20} {count / len(captures):6.2f}  {total / len(captures):8.2f} ms",
+                  file=stream)
+    print(file=stream)
+
+    stats = pstats.Stats(captures[0][0], stream=stream)
+    for path, _ in captures[1:]:
+        stats.add(path)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize request profiles, or sign a path for profiling.")
+    commands = parser.add_subparsers(dest='action', required=True)
+    summary = commands.add_parser('summarize', help="Summarize captured profiles by function")
+    summary.add_argument('directory', nargs='?', default=PROFILE_DIR)
+    summary.add_argument('--route', help="Only profiles of this route, e.g. /v1/surveys/<string:survey_id>/results")
+    summary.add_argument('--sort', default='cumulative', help="pstats sort key, e.g. cumulative, tottime, calls")
+    summary.add_argument('--limit', type=int, default=30)
+    signer = commands.add_parser('sign', help="Print an X-Profile header value for a path, using PROFILE_SECRET")
+    signer.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.action == 'summarize':
+        summarize(args.directory, args.route, args.sort, args.limit)
+    else:
+        if not PROFILE_SECRET:
+            parser.error("PROFILE_SECRET is not set")
+        print(sign(PROFILE_SECRET, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# reference_statistics.py
+#
+# What the rewrites of calculate_survey_statistics are checked against: the
+# implementation app.py had before per-survey aggregates, and random surveys and
+# answers to feed it. Shared by test_survey_results.py, test_aggregates.py and
+# benchmarks/bench_statistics.py, so they all compare against the same original.
+
+import datetime
+from statistics import StatisticsError, mean, stdev
+from surveys import DEFAULT_EXPIRY, make_tz_aware
+
+EXPIRY_DATE = datetime.datetime(2030, 1, 1, tzinfo=datetime.UTC)
+
+
+def random_survey(rng, question_count=None):
+    """A survey of question_count questions (1 to 6 at random by default), mixing scale and boolean ones."""
+    questions = []
+    for i in range(question_count or rng.randint(1, 6)):
+        response_type = rng.choice(['scale', 'boolean'])
+        question = {'id': i + 1, 'text': f'q{i}', 'response_type': response_type}
+        if response_type == 'scale':
+            question['response_scale_max'] = rng.choice([3, 5, 10])
+            question['creator_answer'] = rng.randint(1, question['response_scale_max'])
+        else:
+            question['creator_answer'] = rng.choice([True, False])
+        questions.append(question)
+    return {'survey_id': 'random-survey', 'title': 'Random', 'questions': questions, 'expiry_date': EXPIRY_DATE}
+
+
+def random_answers(rng, survey, count, fractional=False):
+    """
+    Answer documents as the API stores them. About one in ten questions is skipped,
+    and with fractional set, about one in twenty scale answers is a half point.
+    """
+    start = datetime.datetime(2024, 1, 1)
+    answers = []
+    for i in range(count):
+        answer = {}
+        for question in survey['questions']:
+            if rng.random() < 0.1:
+                continue  # Not every submission answers every question
+            if question['response_type'] == 'boolean':
+                answer[str(question['id'])] = rng.random() < 0.5
+            elif fractional and rng.random() < 0.05:
+                answer[str(question['id'])] = rng.randint(2, question['response_scale_max'] * 2) / 2
+            else:
+                answer[str(question['id'])] = rng.randint(1, question['response_scale_max'])
+        answers.append({'user_code': f'user-{i}', 'answers': answer,
+                        'submitted_at': start + datetime.timedelta(seconds=rng.randint(0, 10 ** 6))})
+    return answers
+
+
+def reference_survey_statistics(survey, answers, user_code, is_creator):
+    """calculate_survey_statistics as it was before aggregates, kept as an oracle for the rewrites."""
+    questions = {q['id']: q for q in survey['questions']}
+    now_time = datetime.datetime.now(datetime.UTC)
+    results = {
+        'survey_id': survey['survey_id'],
+        'title': survey['title'],
+        'description': survey.get('description', ''),
+        'created_at': survey['survey_id'],
+        'is_creator': is_creator,
+        'questions': [],
+        'overall_statistics': {},
+        'expiry_date': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)).isoformat(),
+        'expired': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)) < now_time,
+        'total_responses': len(answers)
+    }
+
+    creator_answers = {str(q['id']): q['creator_answer'] for q in survey['questions']}
+    user_answers = creator_answers if is_creator else next((a['answers'] for a in answers if str(a.get('user_code')) == str(user_code)), None)
+
+    all_deviations = []
+    user_deviations = []
+
+    for q_id, question in questions.items():
+        q_answers = [a['answers'][str(q_id)] for a in answers if str(q_id) in a['answers']]
+        creator_answer = creator_answers.get(q_id)
+        avg_score = mean(q_answers) if q_answers else None
+
+        if question['response_type'] == 'scale':
+            try:
+                std_dev = stdev(q_answers) if len(q_answers) > 1 else 0
+            except StatisticsError:
+                std_dev = 0
+
+            q_stat = {
+                'id': q_id,
+                'text': question['text'],
+                'type': 'scale',
+                'scale_max': question['response_scale_max'],
+                'average_score': round(avg_score, 2) if avg_score is not None else None,
+                'standard_deviation': round(std_dev, 2),
+                'distribution': {score: q_answers.count(score) for score in range(1, question['response_scale_max'] + 1)}
+            }
+
+            if user_answers and str(q_id) in user_answers:
+                user_score = user_answers[str(q_id)]
+                q_stat['user_score'] = user_score
+                if avg_score is not None:
+                    user_deviation = abs(user_score - avg_score)
+                    q_stat['user_deviation'] = round(user_deviation, 2)
+                    user_deviations.append(user_deviation)
+
+                # Calculate deviation from creator for all users, including creator
+                if creator_answer is not None:
+                    creator_deviation = abs(user_score - creator_answer)
+                    q_stat['deviation_from_creator'] = round(creator_deviation, 2)
+
+                # Calculate deviation from others
+                other_answers = q_answers if is_creator else [a for a in q_answers if a != user_score]
+                if other_answers:
+                    other_avg = mean(other_answers)
+                    other_deviation = abs(user_score - other_avg)
+                    q_stat['deviation_from_others'] = round(other_deviation, 2)
+
+            # Calculate overall deviation for this question
+            if creator_answer is not None:
+                question_deviations = [abs(ans - creator_answer) for ans in q_answers]
+                all_deviations.extend(question_deviations)
+
+        elif question['response_type'] == 'boolean':
+            true_count = sum(q_answers)
+            total_count = len(q_answers)
+
+            q_stat = {
+                'id': q_id,
+                'text': question['text'],
+                'type': 'boolean',
+                'true_percentage': round(true_count / total_count * 100, 2) if total_count > 0 else 0,
+                'false_percentage': round((total_count - true_count) / total_count * 100, 2) if total_count > 0 else 0
+            }
+
+            if user_answers and str(q_id) in user_answers:
+                q_stat['user_answer'] = user_answers[str(q_id)]
+
+        results['questions'].append(q_stat)
+
+    # Calculate overall statistics
+    results['overall_statistics'] = {
+        'average_deviation_from_aggregate': round(mean(user_deviations), 2) if user_deviations else None,
+        'overall_deviation': round(mean(all_deviations), 2) if all_deviations else None,
+    }
+
+    # Remove None values from overall_statistics
+    results['overall_statistics'] = {k: v for k, v in results['overall_statistics'].items() if v is not None}
+    results['total_participants'] = len(answers)
+
+    return results
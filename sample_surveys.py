@@ -6,40 +6,51 @@ import random
 
 BASE_URL = "http://localhost:5001/api/v1"
 
+# The survey created by create_survey, also used by benchmarks/load_test.py
+SAMPLE_SURVEY = {
+    "title": "Personal assessment",
+    "description": "Help us improve my self awareness",
+    "questions": [
+        {
+            "text": "How trustworthy am I?",
+            "response_type": "scale",
+            "response_scale_max": 5,
+            "creator_answer": 4
+        },
+        {
+            "text": "Am I honest most of the times?",
+            "response_type": "boolean",
+            "creator_answer": True
+        },
+        {
+            "text": "Do I take feedback with open arms?",
+            "response_type": "scale",
+            "response_scale_max": 10,
+            "creator_answer": 8
+        },
+        {
+            "text": "Am I approachable?",
+            "response_type": "boolean",
+            "creator_answer": False
+        }
+    ]
+}
+
+def random_answers(questions, rng=random):
+    """
+    Random answers to a list of questions, numbered from 1 in order.
+    """
+    return [
+        {"question_id": i, "answer": rng.randint(1, question["response_scale_max"])
+         if question["response_type"] == "scale" else rng.choice([True, False])}
+        for i, question in enumerate(questions, start=1)
+    ]
+
 def create_survey():
     """
     Creates a new survey and returns the response.
     """
-    survey_data = {
-        "title": "Personal assessment",
-        "description": "Help us improve my self awareness",
-        "questions": [
-            {
-                "text": "How trustworthy am I?",
-                "response_type": "scale",
-                "response_scale_max": 5,
-                "creator_answer": 4
-            },
-            {
-                "text": "Am I honest most of the times?",
-                "response_type": "boolean",
-                "creator_answer": True
-            },
-            {
-                "text": "Do I take feedback with open arms?",
-                "response_type": "scale",
-                "response_scale_max": 10,
-                "creator_answer": 8
-            },
-            {
-                "text": "Am I approachable?",
-                "response_type": "boolean",
-                "creator_answer": False
-            }
-        ]
-    }
-
-    response = requests.post(f"{BASE_URL}/surveys", json=survey_data)
+    response = requests.post(f"{BASE_URL}/surveys", json=SAMPLE_SURVEY)
     print("Survey Creation Response:")
     print(json.dumps(response.json(), indent=2))
     return response.json()
@@ -48,12 +59,7 @@ def add_answers(survey_id):
     """
     Adds a set of random answers for the given survey ID and returns the response.
     """
-    answers = [
-        {"question_id": 1, "answer": random.randint(1, 5)},
-        {"question_id": 2, "answer": random.choice([True, False])},
-        {"question_id": 3, "answer": random.randint(1, 10)},
-        {"question_id": 4, "answer": random.choice([True, False])}
-    ]
+    answers = random_answers(SAMPLE_SURVEY["questions"])
 
     response = requests.post(f"{BASE_URL}/surveys/{survey_id}/answers", json={"answers": answers})
     print(f"Answer Submission Response for Survey {survey_id}:")
@@ -1,42 +1,70 @@
+import threading
 import time
 
+SEQUENCE_BITS = 2
+IDS_PER_MILLI = 1 << SEQUENCE_BITS
+MAX_DRIFT_MS = 1000
+
+
 class Snowflake53:
-    def __init__(self, datacenter_id, worker_id):
+    """
+    Snowflake-style IDs reduced to 53 bits so they survive a round trip through a
+    JavaScript number.
+
+    Layout: 41 bits of millisecond timestamp, 5 bits of datacenter ID, 5 bits of
+    worker ID and 2 bits of sequence, so a generator has 4 IDs per millisecond. IDs
+    are handed out from a single counter of (millisecond, sequence) slots under a
+    lock, so one instance can be shared between threads. When a burst uses up the
+    current millisecond the generator borrows the following ones instead of
+    spinning, up to max_drift_ms ahead of the wall clock; past that it sleeps until
+    the clock catches up.
+    """
+
+    def __init__(self, datacenter_id, worker_id, max_drift_ms=MAX_DRIFT_MS):
         self.datacenter_id = datacenter_id
         self.worker_id = worker_id
-        self.sequence = 0
+        self.max_drift_ms = max_drift_ms
+        self.node_bits = ((datacenter_id & 0x1F) << 7) | ((worker_id & 0x1F) << 2)
+        self.next_slot = 0
         self.last_timestamp = -1
+        self.lock = threading.Lock()
 
     def generate(self):
-        timestamp = int(time.time() * 1000)  # Current time in milliseconds
+        return self.compose(self.claim_slots(1))
 
-        if timestamp < self.last_timestamp:
-            raise ValueError("Clock moved backwards")
+    def generate_batch(self, n):
+        """
+        Generate n IDs with a single trip through the lock.
 
-        if timestamp == self.last_timestamp:
-            self.sequence = (self.sequence + 1) & 0xFF  # 8 bits for sequence
-            if self.sequence == 0:
-                timestamp = self.wait_next_millis(self.last_timestamp)
-        else:
-            self.sequence = 0
+        The batch is a run of consecutive slots, i.e. whole milliseconds of the
+        sequence space (n / 4 of them) at once, so IDs within a batch are increasing.
+        """
+        start = self.claim_slots(n)
+        return [self.compose(slot) for slot in range(start, start + n)]
 
-        self.last_timestamp = timestamp
+    def claim_slots(self, count):
+        """Reserve count consecutive (millisecond, sequence) slots and return the first."""
+        with self.lock:
+            timestamp = int(time.time() * 1000)  # Current time in milliseconds
+            if timestamp < self.last_timestamp:
+                raise ValueError("Clock moved backwards")
+            self.last_timestamp = timestamp
 
-        # Reduce from 64 bits to 53 bits
-        id = ((timestamp & 0x1FFFFFFFFFF) << 12) | \
-             ((self.datacenter_id & 0x1F) << 7) | \
-             ((self.worker_id & 0x1F) << 2) | \
-             (self.sequence & 0x3)
-
-        return id
+            start = max(self.next_slot, timestamp << SEQUENCE_BITS)
+            end = start + count
+            lead_ms = ((end - 1) >> SEQUENCE_BITS) - timestamp
+            if lead_ms > self.max_drift_ms:
+                # Out of borrowed milliseconds; let the clock catch up
+                time.sleep((lead_ms - self.max_drift_ms) / 1000)
+            self.next_slot = end
+            return start
 
-    def wait_next_millis(self, last_timestamp):
-        timestamp = int(time.time() * 1000)
-        while timestamp <= last_timestamp:
-            timestamp = int(time.time() * 1000)
-        return timestamp
+    def compose(self, slot):
+        timestamp = slot >> SEQUENCE_BITS
+        # Reduce from 64 bits to 53 bits
+        return ((timestamp & 0x1FFFFFFFFFF) << 12) | self.node_bits | (slot & (IDS_PER_MILLI - 1))
 
 # Usage
 #generator = Snowflake53(datacenter_id=1, worker_id=1)
 #id = generator.generate()
-#print(id)  # This will print a number that fits within JavaScript's safe integer range
\ No newline at end of file
+#print(id)  # This will print a number that fits within JavaScript's safe integer range
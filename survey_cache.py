@@ -0,0 +1,89 @@
+# survey_cache.py
+#
+# Survey definitions never change once create_survey has stored them, so each
+# worker keeps the ones it has seen in memory, along with an AnswerValidator for
+# each. Surveys that are being answered or viewed then cost no Mongo reads to look
+# up, by survey ID or by the creator's user code, nor to validate answers against.
+
+import os
+import threading
+from collections import OrderedDict
+from surveys import AnswerValidator
+
+SURVEY_CACHE_SIZE = int(os.environ.get('SURVEY_CACHE_SIZE', 4096))  # surveys
+
+
+class SurveyCache:
+    """
+    Size-bounded LRU cache of survey definitions, keyed by survey ID and by creator user code.
+
+    Cached surveys are shared by every request and must not be modified. Lookups that
+    miss are not remembered, since the survey may be created by another worker later.
+    Anything that edits a stored survey must call invalidate.
+    """
+
+    def __init__(self, maxsize=SURVEY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # survey_id -> (survey, validator)
+        self.survey_ids = {}  # creator user_code -> survey_id
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, survey_id):
+        entry = self.entries.get(survey_id) if survey_id is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(survey_id)
+        self.hits += 1
+        return entry
+
+    def get(self, survey_id):
+        """The cached survey, or None."""
+        with self.lock:
+            entry = self._lookup(survey_id)
+        return entry[0] if entry else None
+
+    def get_by_user_code(self, user_code):
+        """The cached survey created with this user code, or None."""
+        with self.lock:
+            entry = self._lookup(self.survey_ids.get(user_code))
+        return entry[0] if entry else None
+
+    def validator(self, survey):
+        """The AnswerValidator for a survey, compiled when it was cached."""
+        with self.lock:
+            entry = self.entries.get(survey['survey_id'])
+        return entry[1] if entry else AnswerValidator(survey)
+
+    def put(self, survey):
+        """Cache a survey read from or written to Mongo. Returns the cached copy, without its _id."""
+        survey = {key: value for key, value in survey.items() if key != '_id'}
+        entry = (survey, AnswerValidator(survey))
+        with self.lock:
+            self.entries[survey['survey_id']] = entry
+            self.entries.move_to_end(survey['survey_id'])
+            self.survey_ids[survey.get('user_code')] = survey['survey_id']
+            while len(self.entries) > self.maxsize:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.survey_ids.pop(evicted.get('user_code'), None)
+                self.evictions += 1
+        return survey
+
+    def invalidate(self, survey_id):
+        with self.lock:
+            entry = self.entries.pop(survey_id, None)
+            if entry:
+                self.survey_ids.pop(entry[0].get('user_code'), None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,572 @@
+# surveys.py
+#
+# Survey logic that does not depend on the web framework or the database driver:
+# validation, survey documents, response bodies and statistics. Both app.py and
+# async_app.py build their responses from here, so they return identical JSON.
+
+import datetime
+import hashlib
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from statistics import mean
+from aggregates import histogram_key, histogram_value, summarize_answers_columnar
+
+log = logging.getLogger('percept.surveys')
+
+MINIMUM_RESPONSES = 5
+DEFAULT_EXPIRY = datetime.timedelta(days=5)
+TRENDING_WINDOW = datetime.timedelta(hours=24)
+# Part of every ETag. Bump it when a response body changes shape, so clients do not
+# keep copies cached by an earlier release.
+ETAG_FORMAT = 1
+# Survey and results bodies change with every answer, so clients must revalidate
+# (cheaply, with If-None-Match). Results are per user and must not be shared.
+SURVEY_CACHE_CONTROL = 'public, no-cache'
+RESULTS_CACHE_CONTROL = 'private, no-cache'
+# Expiry dates never change, so a 410 for an expired survey is final
+EXPIRED_CACHE_CONTROL = 'public, max-age=86400'
+MAX_SUBMISSION_BATCH = int(os.environ.get('MAX_SUBMISSION_BATCH', 1000))  # submissions per request
+POPULATION_CACHE_SIZE = int(os.environ.get('POPULATION_CACHE_SIZE', 1024))  # surveys
+
+
+def make_tz_aware(dt):
+    if isinstance(dt, str):
+        dt = datetime.datetime.fromisoformat(dt)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.UTC)
+    return dt
+
+
+def get_participant_bucket(count):
+    if count < 10:
+        return "< 10"
+    elif 10 <= count < 100:
+        return "10-100"
+    elif 100 <= count < 1000:
+        return "100-1000"
+    else:
+        return "1000+"
+
+
+def calculate_answer_distribution(question, q_summary, total_answers):
+    """Percentage distribution of the answers to one question, from its aggregate summary."""
+    if question['response_type'] == 'scale':
+        histogram = q_summary.get('histogram', {})
+        distribution = {score: histogram.get(str(score), 0) for score in range(1, question['response_scale_max'] + 1)}
+        return {score: (count / total_answers * 100) if total_answers > 0 else 0
+                for score, count in distribution.items()}
+    elif question['response_type'] == 'boolean':
+        true_count = q_summary.get('true_count', 0)
+        return {
+            'true_percentage': round(true_count / total_answers * 100, 2) if total_answers > 0 else 0,
+            'false_percentage': round((total_answers - true_count) / total_answers * 100, 2) if total_answers > 0 else 0
+        }
+    return {}
+
+
+def survey_expiry(survey, now):
+    """The survey's expiry date (defaulting to DEFAULT_EXPIRY from now) and whether it has passed."""
+    expiry_date = make_tz_aware(survey.get('expiry_date', now + DEFAULT_EXPIRY))
+    return expiry_date, expiry_date < now
+
+
+def trending_filter(survey_id, now):
+    """Query for any answer submitted to the survey within TRENDING_WINDOW."""
+    return {'survey_id': survey_id, 'submitted_at': {'$gte': now - TRENDING_WINDOW}}
+
+
+def aggregate_is_trending(aggregate, now):
+    """Whether the latest submission recorded in the aggregate falls within TRENDING_WINDOW."""
+    last_submitted_at = aggregate.get('last_submitted_at')
+    return last_submitted_at is not None and make_tz_aware(last_submitted_at) >= now - TRENDING_WINDOW
+
+
+def response_etag(survey_id, aggregate, is_trending, is_expired, user_code=None):
+    """
+    Strong ETag for a survey response, or for a results response when user_code is given.
+
+    The survey definition never changes after creation, so these responses only vary
+    with the aggregate (its version and response count), the trending and expiry state
+    and, for results, the requesting user.
+    """
+    key = (f"{ETAG_FORMAT}:{survey_id}:{aggregate.get('version', 0)}:{aggregate['response_count']}:"
+           f"{int(is_trending)}:{int(is_expired)}:{user_code or ''}")
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+
+class AnswerValidator:
+    """
+    validate_answers for one survey, with its questions indexed once.
+
+    Calling it checks submitted answers and returns the error to report for the
+    first invalid answer, or None if all are valid.
+    """
+
+    def __init__(self, survey):
+        self.questions = {
+            str(q['id']): (q['response_type'], q.get('response_scale_max'))  # Convert to string
+            for q in survey['questions']
+        }
+
+    def __call__(self, answers):
+        if not isinstance(answers, list):
+            return "Invalid request data: answers not provided"
+        for answer in answers:
+            if not isinstance(answer, dict) or 'question_id' not in answer or 'answer' not in answer:
+                return f"Invalid answer format: {answer}"
+
+            question_id = str(answer['question_id'])  # Convert to string
+            if question_id not in self.questions:
+                return f"Invalid question ID: {question_id}"
+
+            response_type, scale_max = self.questions[question_id]
+            if response_type == 'scale':
+                if not isinstance(answer['answer'], (int, float)) or not (1 <= answer['answer'] <= scale_max):
+                    return f"Invalid answer for question {question_id}: must be between 1 and {scale_max}"
+            elif response_type == 'boolean':
+                if not isinstance(answer['answer'], bool):
+                    return f"Invalid answer for question {question_id}: must be a boolean"
+        return None
+
+
+def validate_answers(survey, answers):
+    """
+    Check submitted answers against the survey's questions.
+
+    Returns:
+        str: The error to report for the first invalid answer, or None if all are valid.
+    """
+    return AnswerValidator(survey)(answers)
+
+
+def new_survey(data, survey_id, user_code):
+    """Build the survey document to store for a create request."""
+    expiry_date = data.get('expiry')
+    if expiry_date:
+        expiry_date = make_tz_aware(datetime.datetime.fromisoformat(expiry_date))
+    else:
+        expiry_date = make_tz_aware(datetime.datetime.now(datetime.UTC) + DEFAULT_EXPIRY)
+
+    return {
+        'survey_id': survey_id,
+        'title': data['title'],
+        'description': data.get('description', ''),
+        'questions': [
+            {
+                'id': i + 1,
+                'text': q['text'],
+                'response_type': q['response_type'],
+                'response_scale_max': q.get('response_scale_max', MINIMUM_RESPONSES),
+                'creator_answer': q['creator_answer']
+            } for i, q in enumerate(data['questions'])
+        ],
+        'user_code': user_code,
+        'expiry_date': expiry_date
+    }
+
+
+def created_survey_response(survey):
+    return {
+        'survey_id': survey['survey_id'],
+        'share_link': f"/participate/{survey['survey_id']}",
+        'user_code': survey['user_code'],
+        'questions': [{'id': q['id'], 'text': q['text']} for q in survey['questions']],
+        'expiry_date': survey['expiry_date'].isoformat()
+    }
+
+
+def new_submission(survey_id, user_code, answers):
+    """Build the answers document to store for a submission."""
+    return {
+        'survey_id': survey_id,
+        'user_code': user_code,
+        'answers': {str(answer['question_id']): answer['answer'] for answer in answers},
+        'submitted_at': datetime.datetime.now(datetime.UTC)
+    }
+
+
+def validate_submission_batch(survey, submissions, validator=None):
+    """
+    Validate every item of a batch submission against the survey.
+
+    Returns:
+        list: The error for each item, in order, or None for the items that are valid.
+    """
+    validator = validator or AnswerValidator(survey)
+    errors = []
+    for item in submissions:
+        if not isinstance(item, dict) or not isinstance(item.get('answers'), list):
+            errors.append("Invalid request data: answers not provided")
+        else:
+            errors.append(validator(item['answers']))
+    return errors
+
+
+def user_codes_needed(submissions, errors):
+    """How many valid items of a batch came without a user_code of their own."""
+    return sum(1 for item, error in zip(submissions, errors) if error is None and 'user_code' not in item)
+
+
+def new_submission_batch(survey_id, submissions, errors, generated_codes):
+    """
+    Build the answers documents to store for the valid items of a batch.
+
+    Items without a user_code take the next of generated_codes, in order.
+
+    Returns:
+        dict: Answers documents keyed by the index of their item in the batch.
+    """
+    generated = iter(generated_codes)
+    return {
+        index: new_submission(survey_id, item['user_code'] if 'user_code' in item else next(generated), item['answers'])
+        for index, (item, error) in enumerate(zip(submissions, errors)) if error is None
+    }
+
+
+def submission_batch_response(errors, documents):
+    """Body and status of POST /v1/surveys/<survey_id>/answers/batch, with one result per item."""
+    results = []
+    for index, error in enumerate(errors):
+        if error is None:
+            results.append({'index': index, 'status': 201, **submission_response(documents[index]['user_code'])})
+        else:
+            results.append({'index': index, 'status': 400, 'error': error})
+    body = {'accepted': len(documents), 'rejected': len(errors) - len(documents), 'results': results}
+    return body, 201 if documents else 400
+
+
+def submission_response(user_code):
+    # Calculate deviations (placeholder logic - you'll need to implement the actual calculation)
+    deviation_from_creator = 0.5  # placeholder
+    deviation_from_others = 0.3  # placeholder
+    overall_deviation = 0.4  # placeholder
+
+    return {
+        'user_code': user_code,
+        'deviation_from_creator': deviation_from_creator,
+        'deviation_from_others': deviation_from_others,
+        'overall_deviation': overall_deviation
+    }
+
+
+def survey_response(survey, aggregate, is_trending, expiry_date, is_expired):
+    """Body of GET /v1/surveys/<survey_id> for a survey that has not expired."""
+    total_answers = aggregate['response_count']
+    response_data = {
+        'survey_id': survey['survey_id'],
+        'title': survey['title'],
+        'description': survey.get('description', ''),
+        'questions': [
+            {
+                'id': q['id'],
+                'text': q['text'],
+                'response_type': q['response_type'],
+                'response_scale_max': q.get('response_scale_max'),
+                'answer_distribution': {}
+            } for q in survey['questions']
+        ],
+        'is_trending': is_trending,
+        'participant_bucket': get_participant_bucket(total_answers),
+        'expiry_date': expiry_date.isoformat(),
+        'expired': is_expired,
+        'total_responses': total_answers,
+        'current_responses': total_answers,
+        'minimum_responses': MINIMUM_RESPONSES,
+        'remaining_responses': max(0, MINIMUM_RESPONSES - total_answers),
+        'status': 'incomplete' if total_answers < MINIMUM_RESPONSES else 'complete'
+    }
+    # Calculate answer distribution for each question if we have enough responses.
+    # All of them come from the one aggregate document, however many questions there are
+    if total_answers >= MINIMUM_RESPONSES:
+        for question in response_data['questions']:
+            q_summary = aggregate['questions'].get(str(question['id']), {})
+            question['answer_distribution'] = calculate_answer_distribution(question, q_summary, total_answers)
+    return response_data
+
+
+def results_response(survey, aggregate, user_answers, user_code, is_creator, is_trending, population_cache=None):
+    """
+    Body and status code of the results endpoints.
+
+    Args:
+        survey (dict): The survey document.
+        aggregate (dict): The survey's aggregate document.
+        user_answers (dict): The participant's stored answers map, or None for the creator.
+        user_code (str): The requesting user's code.
+        is_creator (bool): Whether user_code is the survey creator's.
+        is_trending (bool): Whether the survey received answers within TRENDING_WINDOW.
+        population_cache (PopulationCache): Where to get the population statistics from,
+            instead of computing them for this request.
+
+    Returns:
+        tuple: The response body and HTTP status code.
+    """
+    current_responses = aggregate['response_count']
+    participant_bucket = get_participant_bucket(current_responses)
+    expiry_date, is_expired = survey_expiry(survey, datetime.datetime.now(datetime.UTC))
+
+    # Check for minimum responses for creator
+    if current_responses < MINIMUM_RESPONSES:
+        if is_creator:
+            response = {
+                'status': 'incomplete',
+                'current_responses': current_responses,
+                'total_responses': current_responses,
+                'minimum_responses': MINIMUM_RESPONSES,
+                'remaining_responses': MINIMUM_RESPONSES - current_responses,
+                'is_creator': True,
+                'user_code': user_code,
+                'survey_id': survey['survey_id'],
+                'is_trending': is_trending,
+                'participant_bucket': participant_bucket,
+                'expiry_date': expiry_date.isoformat(),
+                'expired': is_expired
+            }
+            return response, 200
+        else:
+            response = {
+                'status': 'incomplete',
+                'is_creator': False,
+                'is_trending': is_trending,
+                'participant_bucket': participant_bucket,
+                'expiry_date': expiry_date.isoformat(),
+                'expired': is_expired
+            }
+            return response, 202
+
+    # Calculate statistics
+    population = population_cache.get(survey, aggregate) if population_cache else None
+    results = build_survey_statistics(survey, aggregate, user_answers, user_code, is_creator, population)
+    results['is_trending'] = is_trending
+    results['participant_bucket'] = participant_bucket
+    results['expiry_date'] = expiry_date.isoformat()
+    results['expired'] = is_expired
+    return results, 200
+
+
+def summary_mean(total, count):
+    """Mean from a running sum, typed the way statistics.mean types it for the same data."""
+    if isinstance(total, int) and total % count == 0:
+        return total // count
+    return total / count
+
+
+def summary_stdev(total, total_sq, count):
+    """Sample standard deviation from a running sum and sum of squares."""
+    if isinstance(total, int) and isinstance(total_sq, int):
+        variance = Fraction(count * total_sq - total * total, count * (count - 1))
+    else:
+        variance = (total_sq - total * total / count) / (count - 1)
+    return math.sqrt(max(variance, 0))
+
+
+def calculate_survey_statistics(survey, answers, user_code, is_creator):
+    """Calculate the results for a user from the full list of answer documents."""
+    user_answers = None if is_creator else next((a['answers'] for a in answers if str(a.get('user_code')) == str(user_code)), None)
+    return build_survey_statistics(survey, summarize_answers_columnar(survey, answers), user_answers, user_code, is_creator)
+
+
+def population_statistics(survey, aggregate):
+    """
+    The part of a survey's results that is the same for every user: per-question
+    averages, standard deviations, distributions and percentages, and the overall
+    deviation from the creator's answers.
+
+    Returns:
+        dict: 'questions' holds one (q_stat, context) pair per reported question, where
+        context is what user_statistics needs to add a user's own scores, and
+        'overall_deviation' is None when there is nothing to report.
+    """
+    log.debug("Calculating population statistics for survey %s", survey['survey_id'])
+
+    creator_answers = {str(q['id']): q['creator_answer'] for q in survey['questions']}
+    deviation_total = 0
+    deviation_count = 0
+    question_stats = []
+
+    for question in survey['questions']:
+        q_id = question['id']
+        q_summary = aggregate['questions'].get(str(q_id), {})
+        q_count = q_summary.get('count', 0)
+        creator_answer = creator_answers.get(q_id)
+
+        if question['response_type'] == 'scale':
+            q_sum = q_summary.get('sum', 0)
+            histogram = q_summary.get('histogram', {})
+            avg_score = summary_mean(q_sum, q_count) if q_count else None
+            std_dev = summary_stdev(q_sum, q_summary['sum_sq'], q_count) if q_count > 1 else 0
+
+            q_stat = {
+                'id': q_id,
+                'text': question['text'],
+                'type': 'scale',
+                'scale_max': question['response_scale_max'],
+                'average_score': round(avg_score, 2) if avg_score is not None else None,
+                'standard_deviation': round(std_dev, 2),
+                'distribution': {score: histogram.get(str(score), 0) for score in range(1, question['response_scale_max'] + 1)}
+            }
+            context = {'avg_score': avg_score, 'sum': q_sum, 'count': q_count, 'histogram': histogram,
+                       'creator_answer': creator_answer}
+
+            # Calculate overall deviation for this question
+            if creator_answer is not None:
+                for key, count in histogram.items():
+                    deviation_total += abs(histogram_value(key) - creator_answer) * count
+                deviation_count += q_count
+
+        elif question['response_type'] == 'boolean':
+            true_count = q_summary.get('true_count', 0)
+            total_count = q_count
+
+            q_stat = {
+                'id': q_id,
+                'text': question['text'],
+                'type': 'boolean',
+                'true_percentage': round(true_count / total_count * 100, 2) if total_count > 0 else 0,
+                'false_percentage': round((total_count - true_count) / total_count * 100, 2) if total_count > 0 else 0
+            }
+            context = None
+
+        else:
+            continue
+
+        question_stats.append((q_stat, context))
+
+    return {
+        'questions': question_stats,
+        'overall_deviation': round(summary_mean(deviation_total, deviation_count), 2) if deviation_count else None
+    }
+
+
+def user_statistics(survey, aggregate, population, user_answers, user_code, is_creator):
+    """Build one user's results by adding their own scores to the population statistics."""
+    now_time = datetime.datetime.now(datetime.UTC)
+    results = {
+        'survey_id': survey['survey_id'],
+        'title': survey['title'],
+        'description': survey.get('description', ''),
+        'created_at': survey['survey_id'],
+        'is_creator': is_creator,
+        'questions': [],
+        'overall_statistics': {},
+        'expiry_date': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)).isoformat(),
+        'expired': make_tz_aware(survey.get('expiry_date', now_time + DEFAULT_EXPIRY)) < now_time,
+        'total_responses': aggregate['response_count']
+    }
+
+    if is_creator:
+        user_answers = {str(q['id']): q['creator_answer'] for q in survey['questions']}
+    log.debug("User answers: %s", user_answers)
+
+    user_deviations = []
+    for population_stat, context in population['questions']:
+        # The population statistics are shared between users, so never modify them
+        q_stat = dict(population_stat)
+        q_id = q_stat['id']
+
+        if user_answers and str(q_id) in user_answers:
+            if q_stat['type'] == 'scale':
+                user_score = user_answers[str(q_id)]
+                avg_score = context['avg_score']
+                q_stat['user_score'] = user_score
+                if avg_score is not None:
+                    user_deviation = abs(user_score - avg_score)
+                    q_stat['user_deviation'] = round(user_deviation, 2)
+                    user_deviations.append(user_deviation)
+
+                # Calculate deviation from creator for all users, including creator
+                if context['creator_answer'] is not None:
+                    creator_deviation = abs(user_score - context['creator_answer'])
+                    q_stat['deviation_from_creator'] = round(creator_deviation, 2)
+
+                # Calculate deviation from others, leaving out every answer equal to the user's
+                same_count = 0 if is_creator else context['histogram'].get(histogram_key(user_score), 0)
+                other_count = context['count'] - same_count
+                if other_count:
+                    other_sum = context['sum'] - user_score * same_count if same_count else context['sum']
+                    other_avg = summary_mean(other_sum, other_count)
+                    other_deviation = abs(user_score - other_avg)
+                    q_stat['deviation_from_others'] = round(other_deviation, 2)
+            else:
+                q_stat['user_answer'] = user_answers[str(q_id)]
+
+        results['questions'].append(q_stat)
+
+    # Calculate overall statistics
+    results['overall_statistics'] = {
+        'average_deviation_from_aggregate': round(mean(user_deviations), 2) if user_deviations else None,
+        'overall_deviation': population['overall_deviation'],
+    }
+
+    # Remove None values from overall_statistics
+    results['overall_statistics'] = {k: v for k, v in results['overall_statistics'].items() if v is not None}
+    results['total_participants'] = aggregate['response_count']
+    return results
+
+
+def build_survey_statistics(survey, aggregate, user_answers, user_code, is_creator, population=None):
+    """
+    Build the results for a user from a survey aggregate and that user's own answers.
+
+    population, if given, must be population_statistics(survey, aggregate), e.g. from
+    a PopulationCache; otherwise it is computed here.
+    """
+    log.debug("Calculating statistics for survey %s, user_code %s, is_creator: %s", survey['survey_id'], user_code, is_creator)
+    if population is None:
+        population = population_statistics(survey, aggregate)
+    return user_statistics(survey, aggregate, population, user_answers, user_code, is_creator)
+
+
+class PopulationCache:
+    """
+    Size-bounded LRU cache of population_statistics, one entry per survey.
+
+    An entry is only reused while the survey's aggregate still has the version and
+    response count it was computed from, so results never go stale: the first request
+    after a new answer recomputes it, and every other user's request reuses it.
+    """
+
+    def __init__(self, maxsize=POPULATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, survey, aggregate):
+        survey_id = survey['survey_id']
+        version = (aggregate.get('version', 0), aggregate['response_count'])
+        with self.lock:
+            entry = self.entries.get(survey_id)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(survey_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        population = population_statistics(survey, aggregate)
+        with self.lock:
+            current = self.entries.get(survey_id)
+            # Never replace a newer entry computed concurrently by another request
+            if current is None or current[0] <= version:
+                self.entries[survey_id] = (version, population)
+                self.entries.move_to_end(survey_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return population
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
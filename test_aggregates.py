@@ -0,0 +1,75 @@
+import json
+import random
+import unittest
+import aggregates
+from aggregates import COLUMNAR_MIN_ANSWERS, summarize_answers, summarize_answers_columnar
+from app import app, survey_aggregates
+from reference_statistics import random_answers, random_survey
+from surveys import build_survey_statistics
+
+
+@unittest.skipIf(aggregates.np is None, "NumPy is not installed")
+class TestColumnarSummary(unittest.TestCase):
+    """summarize_answers_columnar must be interchangeable with summarize_answers."""
+
+    def assertSameResults(self, survey, answers):
+        expected = summarize_answers(survey, answers)
+        actual = summarize_answers_columnar(survey, answers)
+        self.assertEqual(actual, expected)
+        for user_code, user_answers, is_creator in [('creator', None, True), ('user-0', answers[0]['answers'], False)]:
+            self.assertEqual(
+                json.dumps(build_survey_statistics(survey, actual, user_answers, user_code, is_creator), sort_keys=True),
+                json.dumps(build_survey_statistics(survey, expected, user_answers, user_code, is_creator), sort_keys=True)
+            )
+
+    def test_matches_summarize_answers(self):
+        rng = random.Random(7)
+        for trial in range(20):
+            survey = random_survey(rng)
+            answers = random_answers(rng, survey, COLUMNAR_MIN_ANSWERS + rng.randint(0, 2000), fractional=trial % 2)
+            self.assertSameResults(survey, answers)
+
+    def test_small_inputs_use_summarize_answers(self):
+        rng = random.Random(8)
+        survey = random_survey(rng)
+        answers = random_answers(rng, survey, 10, fractional=False)
+        self.assertEqual(summarize_answers_columnar(survey, answers), summarize_answers(survey, answers))
+
+
+class TestAggregateAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        survey = self.client.post('/v1/surveys', json={
+            'title': 'Audited',
+            'questions': [
+                {'text': 'Scale', 'response_type': 'scale', 'response_scale_max': 5, 'creator_answer': 3},
+                {'text': 'Bool', 'response_type': 'boolean', 'creator_answer': True},
+            ]
+        }).get_json()
+        self.survey_id = survey['survey_id']
+        for score in [1, 4, 5]:
+            self.client.post(f'/v1/surveys/{self.survey_id}/answers', json={
+                'answers': [{'question_id': 1, 'answer': score}, {'question_id': 2, 'answer': score > 3}]
+            })
+        self.survey = survey_aggregates.db.surveys.find_one({'survey_id': self.survey_id}, {'_id': 0})
+
+    def test_audit_finds_and_fixes_drift(self):
+        self.assertEqual(survey_aggregates.audit(self.survey), ('ok', []))
+
+        survey_aggregates.aggregates.update_one({'_id': self.survey_id}, {'$inc': {'questions.1.sum': 2, 'version': 1}})
+        self.assertEqual(survey_aggregates.audit(self.survey), ('drifted', ['questions.1']))
+        self.assertEqual(survey_aggregates.audit(self.survey, fix=True), ('fixed', ['questions.1']))
+        self.assertEqual(survey_aggregates.audit(self.survey), ('ok', []))
+        self.assertEqual(survey_aggregates.aggregates.find_one({'_id': self.survey_id})['questions']['1']['sum'], 10)
+
+    def test_audit_recreates_missing_aggregate(self):
+        survey_aggregates.aggregates.delete_one({'_id': self.survey_id})
+        outcome, differences = survey_aggregates.audit(self.survey, fix=True)
+        self.assertEqual(outcome, 'fixed')
+        self.assertIn('response_count', differences)
+        self.assertEqual(survey_aggregates.aggregates.find_one({'_id': self.survey_id})['response_count'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from app import app, global_counters, mongo
+from async_app import app as async_app, global_counters as async_global_counters
+
+
+class TestAsyncApp(unittest.TestCase):
+    """async_app must answer every request exactly like app does for the same data."""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        async_app.config['TESTING'] = True
+        # Both apps must see each other's writes in /v1/stats straight away
+        global_counters.ttl = async_global_counters.ttl = 0
+        cls.client = app.test_client()
+        cls.async_client = async_app.test_client()
+        # AsyncMongoClient stays bound to the loop it first ran on
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.close()
+
+    def setUp(self):
+        with app.app_context():
+            mongo.db.surveys.delete_many({})
+            mongo.db.answers.delete_many({})
+            mongo.db.survey_aggregates.delete_many({})
+
+    def async_request(self, method, path, json=None):
+        async def send():
+            response = await getattr(self.async_client, method)(path, json=json)
+            return response.status_code, await response.get_json()
+        return self.loop.run_until_complete(send())
+
+    def sync_request(self, method, path, json=None):
+        response = getattr(self.client, method)(path, json=json)
+        return response.status_code, response.get_json()
+
+    def assertSameResponse(self, method, path, json=None):
+        expected = self.sync_request(method, path, json)
+        self.assertEqual(self.async_request(method, path, json), expected, f"{method.upper()} {path}")
+        return expected
+
+    def create_survey(self):
+        status, survey = self.async_request('post', '/v1/surveys', {
+            'title': 'Async Survey',
+            'description': 'Served by both apps',
+            'questions': [
+                {'text': 'Scale', 'response_type': 'scale', 'response_scale_max': 5, 'creator_answer': 4},
+                {'text': 'Bool', 'response_type': 'boolean', 'creator_answer': True}
+            ]
+        })
+        self.assertEqual(status, 201)
+        return survey
+
+    def test_survey_and_results_match(self):
+        survey = self.create_survey()
+        survey_id = survey['survey_id']
+        participants = []
+        for i in range(6):
+            # Alternate between the apps, so each reads what the other wrote
+            request = self.sync_request if i % 2 else self.async_request
+            status, submission = request('post', f'/v1/surveys/{survey_id}/answers', {
+                'user_code': f'async-user-{i}',
+                'answers': [{'question_id': 1, 'answer': i % 5 + 1}, {'question_id': 2, 'answer': i % 3 == 0}]
+            })
+            self.assertEqual(status, 201)
+            participants.append(submission['user_code'])
+            if i == 2:
+                # Below the minimum the results are still incomplete
+                self.assertSameResponse('get', f'/v1/surveys/{survey_id}')
+                self.assertSameResponse('get', f"/v1/surveys/{survey_id}/results?user_code={survey['user_code']}")
+
+        self.assertSameResponse('get', f'/v1/surveys/{survey_id}')
+        self.assertSameResponse('get', f"/v1/surveys/{survey_id}/results?user_code={survey['user_code']}")
+        self.assertSameResponse('get', f"/v1/surveys/{survey_id}/results?user_code={participants[3]}")
+        self.assertSameResponse('get', f"/v1/surveys/results?user_code={participants[0]}")
+        self.assertSameResponse('get', f"/v1/surveys/results?user_code={survey['user_code']}")
+        self.assertSameResponse('get', '/v1/stats')
+
+    def test_conditional_requests_match(self):
+        survey = self.create_survey()
+        path = f"/v1/surveys/{survey['survey_id']}/results?user_code={survey['user_code']}"
+        etag = self.client.get(path).headers['ETag']
+
+        async def conditional_get():
+            response = await self.async_client.get(path, headers={'If-None-Match': etag})
+            return response.status_code, response.headers['ETag']
+        self.assertEqual(self.loop.run_until_complete(conditional_get()), (304, etag))
+
+    def test_errors_match(self):
+        survey = self.create_survey()
+        survey_id = survey['survey_id']
+        self.assertSameResponse('get', '/v1/surveys/no-such-survey')
+        self.assertSameResponse('get', f'/v1/surveys/{survey_id}/results')
+        self.assertSameResponse('get', f'/v1/surveys/{survey_id}/results?user_code=not-a-participant')
+        self.assertSameResponse('get', '/v1/surveys/results?user_code=nobody-at-all')
+        self.assertSameResponse('post', f'/v1/surveys/{survey_id}/answers', {'answers': [{'question_id': 9, 'answer': 1}]})
+        self.assertSameResponse('post', f'/v1/surveys/{survey_id}/answers', {'answers': [{'question_id': 1, 'answer': 7}]})
+        self.assertSameResponse('post', f'/v1/surveys/{survey_id}/answers/batch', {'submissions': []})
+        self.assertSameResponse('post', f'/v1/surveys/{survey_id}/answers/batch', [1, 2])
+        self.assertSameResponse('post', f'/v1/surveys/{survey_id}/answers/batch',
+                                {'submissions': [{'answers': [{'question_id': 1, 'answer': 7}]}, {'user_code': 'x'}]})
+        self.assertSameResponse('get', '/v1/ids/check?id=bad')
+        self.assertSameResponse('post', '/v1/ids/check', {'ids': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from bloom import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        ids = [f"known-id-{i}" for i in range(1000)]
+        bloom.update(ids)
+        self.assertTrue(all(id in bloom for id in ids))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, error_rate=0.01)
+        bloom.update(f"known-id-{i}" for i in range(10000))
+        false_positives = sum(f"unknown-id-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.02)
+
+    def test_empty_filter_contains_nothing(self):
+        bloom = BloomFilter(100)
+        self.assertNotIn('brave-otter', bloom)
+
+
+if __name__ == '__main__':
+    unittest.main()
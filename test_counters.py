@@ -0,0 +1,94 @@
+import unittest
+from app import app, global_counters, mongo
+from counters import GLOBAL_COUNTERS_ID, GlobalCounters
+
+
+class TestGlobalCounters(unittest.TestCase):
+    collection_name = 'counters_test'
+
+    def setUp(self):
+        self.db = mongo.db
+        self.db[self.collection_name].delete_many({})
+        self.counters = GlobalCounters(self.db, collection_name=self.collection_name, ttl=0)
+
+    def tearDown(self):
+        self.db[self.collection_name].delete_many({})
+
+    def real_totals(self):
+        return {'total_surveys': self.db.surveys.count_documents({}),
+                'total_participants': self.db.answers.count_documents({})}
+
+    def test_first_reconciliation_counts_existing_documents(self):
+        self.counters.record_answers(3)  # Recorded before anyone counted
+        self.assertEqual(self.counters.totals(), {'total_surveys': 0, 'total_participants': 3})  # Reads never count
+        self.assertTrue(self.counters.reconcile_if_due())
+        self.assertEqual(self.counters.totals(), self.real_totals())
+        self.counters.record_survey()
+        self.counters.record_answers(2)
+        expected = self.real_totals()
+        expected['total_surveys'] += 1
+        expected['total_participants'] += 2
+        self.assertEqual(self.counters.totals(), expected)
+
+    def test_totals_are_cached_for_ttl(self):
+        self.counters.reconcile_if_due()
+        self.counters.ttl = 60
+        before = self.counters.totals()
+        self.counters.record_survey()
+        self.assertEqual(self.counters.totals(), before)
+        self.counters.ttl = 0
+        self.counters.cached_until = 0
+        self.assertEqual(self.counters.totals()['total_surveys'], before['total_surveys'] + 1)
+
+    def test_reconciliation_corrects_drift_once_per_interval(self):
+        self.assertTrue(self.counters.reconcile_if_due())
+        self.db[self.collection_name].update_one({'_id': GLOBAL_COUNTERS_ID}, {'$inc': {'answers': 7, 'surveys': -1}})
+        self.assertFalse(self.counters.reconcile_if_due())  # Just counted on first read
+
+        self.db[self.collection_name].update_one({'_id': GLOBAL_COUNTERS_ID}, {'$set': {'reconcile_after': 0}})
+        other_worker = GlobalCounters(self.db, collection_name=self.collection_name, ttl=0)
+        self.assertTrue(other_worker.reconcile_if_due())
+        self.assertFalse(self.counters.reconcile_if_due())
+        self.assertEqual(self.counters.totals(), self.real_totals())
+
+    def test_writes_during_a_recount_are_not_counted_twice(self):
+        self.counters.reconcile_if_due()
+        count = self.counters.count
+        written = 0
+
+        def count_while_writing():
+            # Another worker stores two answers during every count, and the count sees them
+            nonlocal written
+            self.counters.record_answers(2)
+            written += 2
+            counts = count()
+            counts['answers'] += written
+            return counts
+        self.db[self.collection_name].update_one({'_id': GLOBAL_COUNTERS_ID}, {'$inc': {'surveys': 4}})
+        self.counters.count = count_while_writing
+        drift = self.counters.reconcile(attempts=2)
+        real = self.real_totals()
+        expected = {'surveys': real['total_surveys'], 'answers': real['total_participants'] + written}
+        self.assertEqual(drift['surveys'], -4)
+        self.assertEqual({name: value for name, value in self.db[self.collection_name].find_one().items()
+                          if name in expected}, expected)
+
+    def test_stats_endpoint_follows_writes(self):
+        client = app.test_client()
+        global_counters.ttl = 0
+        before = client.get('/v1/stats').get_json()
+        survey = client.post('/v1/surveys', json={
+            'title': 'Counted',
+            'questions': [{'text': 'Bool', 'response_type': 'boolean', 'creator_answer': True}]
+        }).get_json()
+        client.post(f"/v1/surveys/{survey['survey_id']}/answers", json={'answers': [{'question_id': 1, 'answer': False}]})
+        client.post(f"/v1/surveys/{survey['survey_id']}/answers/batch", json={'submissions': [
+            {'answers': [{'question_id': 1, 'answer': True}]}, {'answers': [{'question_id': 1, 'answer': True}]}
+        ]})
+        after = client.get('/v1/stats').get_json()
+        self.assertEqual(after['total_surveys'], before['total_surveys'] + 1)
+        self.assertEqual(after['total_participants'], before['total_participants'] + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import json
+import logging
+import os
+import unittest
+import logs
+
+
+class Counted:
+    formatted = 0
+
+    def __str__(self):
+        Counted.formatted += 1
+        return 'counted'
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.finish_request()
+        logs.configure_logging()
+
+    def configure(self, **kwargs):
+        self.handler = logs.configure_logging(stream=self.stream, **kwargs)
+
+    def records(self):
+        self.handler.stop()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_category_levels_and_json_lines(self):
+        self.configure(level='INFO', levels='ids=DEBUG,surveys=WARNING')
+        logs.start_request()
+        logging.getLogger('percept.ids').debug("Generated %d IDs", 3, extra={'pool': 'reserve'})
+        logging.getLogger('percept.surveys').info("Dropped")
+        logging.getLogger('percept.app').info("Kept")
+        logs.finish_request()
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger('percept.app').exception("Failed")
+
+        first, second, third = self.records()
+        self.assertEqual((first['logger'], first['level'], first['message']), ('percept.ids', 'DEBUG', 'Generated 3 IDs'))
+        self.assertEqual(first['pool'], 'reserve')
+        self.assertEqual(first['request_id'], second['request_id'])
+        self.assertEqual(second['message'], 'Kept')
+        self.assertNotIn('request_id', third)
+        self.assertIn('ValueError: boom', third['exception'])
+
+    def test_sampled_requests_keep_debug_records(self):
+        self.configure(level='INFO', sample_rate=1)
+        log = logging.getLogger('percept.surveys')
+        log.debug("Outside a request")
+        logs.start_request()
+        log.debug("User answers: %s", [1, 2])
+        logs.finish_request()
+        [record] = self.records()
+        self.assertEqual(record['message'], 'User answers: [1, 2]')
+
+    def test_disabled_records_are_not_formatted(self):
+        self.configure(level='INFO')
+        Counted.formatted = 0
+        logging.getLogger('percept.app').debug("Request data: %s", Counted())
+        self.assertEqual(Counted.formatted, 0)
+        answers = [1]
+        logging.getLogger('percept.app').info("Answers: %s", answers)
+        answers.append(2)  # Formatted when logged, not when written
+        self.assertEqual(self.records()[0]['message'], 'Answers: [1]')
+
+    def test_full_queue_drops_records(self):
+        self.configure(max_queue_size=1)
+        self.handler.stop()
+        self.handler.pid = os.getpid()  # As if the listener were running but stuck
+        for _ in range(3):
+            logging.getLogger('percept.app').warning("Burst")
+        self.assertEqual(self.handler.dropped, 2)
+        self.assertEqual(logs.dropped_records(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import atexit
+import json
+import os
+import re
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import bson
+import logs
+from app import app
+from metrics import BATCH_SAMPLE, Metrics, bson_size
+
+
+def sample(text, name, **labels):
+    """The value of one sample in Prometheus text output, or None."""
+    for line in text.splitlines():
+        match = re.fullmatch(r'(\w+)(?:\{(.*)\})? (\S+)', line)
+        if match and match.group(1) == name:
+            found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2) or ''))
+            if found == labels:
+                return float(match.group(3))
+    return None
+
+
+class TestMetrics(unittest.TestCase):
+
+    def command_events(self, metrics, command_name, command, reply):
+        listener = metrics.command_listener
+        listener.started(SimpleNamespace(command_name=command_name, command=command))
+        listener.succeeded(SimpleNamespace(command_name=command_name, reply=reply, duration_micros=1500))
+
+    def test_requests_are_recorded_per_route(self):
+        client = app.test_client()
+        before = client.get('/metrics').get_data(as_text=True)
+        client.get('/v1/surveys/no-such-survey')
+        client.get('/v1/surveys/no-such-survey-either')
+        response = client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+
+        labels = {'method': 'GET', 'route': '/v1/surveys/<string:survey_id>'}
+        previous = sample(before, 'percept_http_requests_total', **labels, status='404') or 0
+        self.assertEqual(sample(text, 'percept_http_requests_total', **labels, status='404'), previous + 2)
+        count = sample(text, 'percept_http_request_duration_seconds_count', **labels)
+        self.assertEqual(sample(text, 'percept_http_request_duration_seconds_bucket', **labels, le='+Inf'), count)
+        self.assertGreaterEqual(count, 2)
+        self.assertEqual(sample(text, 'percept_log_records_dropped'), logs.dropped_records())
+
+    def test_mongo_commands_are_charged_to_the_request(self):
+        metrics = Metrics(directory=None)
+        metrics.start_request()
+        for _ in range(3):
+            self.command_events(metrics, 'find', {'find': 'surveys', 'filter': {'survey_id': 'x'}}, {'ok': 1})
+        metrics.finish_request('GET', '/v1/surveys/<string:survey_id>', 200)
+        # Outside any request, e.g. the ID reserve replenisher
+        self.command_events(metrics, 'count', {'count': 'id_reserve'}, {'ok': 1, 'n': 5})
+
+        text = metrics.render({'percept_id_reserve_pool_depth': 250})
+        labels = {'method': 'GET', 'route': '/v1/surveys/<string:survey_id>'}
+        self.assertEqual(sample(text, 'percept_mongo_request_commands_total', **labels), 3)
+        self.assertEqual(sample(text, 'percept_mongo_commands_per_request_bucket', **labels, le='2'), 0)
+        self.assertEqual(sample(text, 'percept_mongo_commands_per_request_bucket', **labels, le='3'), 1)
+        self.assertEqual(sample(text, 'percept_mongo_commands_total', command='find'), 3)
+        self.assertEqual(sample(text, 'percept_mongo_commands_total', command='count'), 1)
+        self.assertAlmostEqual(sample(text, 'percept_mongo_command_seconds_total', command='find'), 0.0045)
+        sent = sample(text, 'percept_mongo_sent_bytes_total', command='find')
+        received = sample(text, 'percept_mongo_received_bytes_total', command='find')
+        self.assertEqual(sample(text, 'percept_mongo_request_bytes_total', **labels), sent + received)
+        self.assertEqual(sample(text, 'percept_id_reserve_pool_depth'), 250)
+
+    def test_batches_are_sized_from_a_sample(self):
+        reply = {'cursor': {'firstBatch': [{'_id': i, 'user_code': f'user-{i:05d}'} for i in range(5000)],
+                            'id': 0, 'ns': 'percept.answers'}, 'ok': 1.0}
+        insert = {'insert': 'answers', 'documents': reply['cursor']['firstBatch'], 'ordered': False}
+        with mock.patch('metrics.bson.encode', side_effect=bson.encode) as encode:
+            # Documents of the same size are estimated exactly
+            self.assertEqual(bson_size(reply), len(bson.encode(reply)))
+            self.assertEqual(bson_size(insert), len(bson.encode(insert)))
+        self.assertLessEqual(encode.call_count, 2 * (BATCH_SAMPLE + 1) + 2)
+        small = {'find': 'surveys', 'filter': {'survey_id': 'x'}}
+        self.assertEqual(bson_size(small), len(bson.encode(small)))
+
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker = Metrics(directory=directory, write_interval=3600)
+            atexit.unregister(worker.write)  # The directory is gone by then
+            other_worker = Metrics(directory=None)
+            for metrics, status in [(worker, 200), (other_worker, 200), (other_worker, 500)]:
+                metrics.start_request()
+                metrics.finish_request('GET', '/v1/stats', status)
+            # What another gunicorn worker would have written
+            with open(os.path.join(directory, 'metrics-99999.json'), 'w') as f:
+                json.dump(other_worker.snapshot(), f)
+
+            worker.write()
+            self.assertTrue(os.path.exists(os.path.join(directory, f'metrics-{os.getpid()}.json')))
+            text = worker.render()
+        labels = {'method': 'GET', 'route': '/v1/stats'}
+        self.assertEqual(sample(text, 'percept_http_requests_total', **labels, status='200'), 2)
+        self.assertEqual(sample(text, 'percept_http_requests_total', **labels, status='500'), 1)
+        self.assertEqual(sample(text, 'percept_http_request_duration_seconds_count', **labels), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
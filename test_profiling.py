@@ -0,0 +1,91 @@
+import glob
+import io
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+import logs
+from app import app, profiler
+from profiling import PROFILE_HEADER, sign, summarize, verify
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.saved = (profiler.secret, profiler.sample_rate, profiler.directory, profiler.keep)
+        profiler.secret, profiler.sample_rate, profiler.directory, profiler.keep = 'test-secret', 0, self.directory.name, 3
+        self.client = app.test_client()
+
+    def tearDown(self):
+        profiler.secret, profiler.sample_rate, profiler.directory, profiler.keep = self.saved
+        self.directory.cleanup()
+
+    def captures(self):
+        return sorted(glob.glob(os.path.join(self.directory.name, '*.prof')))
+
+    def test_signatures(self):
+        header = sign('secret', '/v1/stats', now=1000)
+        self.assertTrue(verify('secret', header, '/v1/stats', now=1100))
+        self.assertFalse(verify('secret', header, '/v1/stats/cache', now=1100))
+        self.assertFalse(verify('other', header, '/v1/stats', now=1100))
+        self.assertFalse(verify('secret', header, '/v1/stats', now=2000))
+        self.assertFalse(verify('', header, '/v1/stats', now=1100))
+
+    def test_only_signed_requests_are_profiled(self):
+        path = '/v1/surveys/no-such-survey'
+        self.client.get(path)
+        self.client.get(path, headers={PROFILE_HEADER: sign('wrong-secret', path)})
+        self.assertEqual(self.captures(), [])
+
+        response = self.client.get(path, headers={PROFILE_HEADER: sign('test-secret', path)})
+        self.assertEqual(response.status_code, 404)
+        [capture] = self.captures()
+        with open(capture[:-len('.prof')] + '.json') as f:
+            info = json.load(f)
+        self.assertEqual(info['route'], '/v1/surveys/<string:survey_id>')
+        self.assertEqual((info['status'], info['reason']), (404, 'signed'))
+
+    def test_profile_record_carries_the_request_id(self):
+        stream = io.StringIO()
+        handler = logs.configure_logging(stream=stream)
+        try:
+            path = '/v1/surveys/no-such-survey'
+            self.client.get(path, headers={PROFILE_HEADER: sign('test-secret', path)})
+            handler.stop()
+        finally:
+            logs.configure_logging()
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        [profiled] = [record for record in records if record['message'].startswith('Profiled')]
+        self.assertIn('request_id', profiled)
+        # The route's own warning shares it
+        [not_found] = [record for record in records if record['message'].startswith('Survey not found')]
+        self.assertEqual(not_found.get('request_id'), profiled['request_id'])
+
+    def test_mongo_commands_are_recorded_with_the_profile(self):
+        listener = profiler.command_listener
+        listener.started(SimpleNamespace(command_name='count', command={'count': 'id_reserve'}, request_id=1))
+        self.assertTrue(profiler.start('/v1/stats', sign('test-secret', '/v1/stats')))
+        listener.started(SimpleNamespace(command_name='find', command={'find': 'surveys'}, request_id=2))
+        listener.succeeded(SimpleNamespace(command_name='find', request_id=2, duration_micros=1500))
+        capture = profiler.finish('GET', '/v1/stats', '/v1/stats', 200)
+        with open(capture[:-len('.prof')] + '.json') as f:
+            info = json.load(f)
+        self.assertEqual(info['commands'], [{'request_id': 2, 'command': 'find', 'collection': 'surveys', 'duration_ms': 1.5}])
+
+    def test_sampled_captures_rotate_and_summarize(self):
+        profiler.sample_rate = 1
+        for _ in range(5):
+            self.client.get('/v1/stats')
+        self.assertEqual(len(self.captures()), 3)
+        self.assertEqual(len(glob.glob(os.path.join(self.directory.name, '*.json'))), 3)
+
+        output = io.StringIO()
+        stats = summarize(self.directory.name, route='/v1/stats', stream=output)
+        self.assertIn('3 profiles', output.getvalue())
+        self.assertIn('get_stats', [function for _, _, function in stats.stats])
+
+
+if __name__ == '__main__':
+    unittest.main()
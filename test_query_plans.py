@@ -0,0 +1,85 @@
+import unittest
+import datetime
+import time
+from app import app, mongo, id_manager
+from aggregates import summary_pipeline
+from indexes import ensure_indexes
+
+
+def find_stages(plan, stage_name):
+    """Collect every plan stage with the given name, however deeply it is nested."""
+    found = []
+    if isinstance(plan, dict):
+        if plan.get('stage') == stage_name:
+            found.append(plan)
+        for value in plan.values():
+            found.extend(find_stages(value, stage_name))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_stages(value, stage_name))
+    return found
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Every query the API issues must be served by an index, not a collection scan."""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        with app.app_context():
+            ensure_indexes(mongo.db)
+            # The planner only considers indexes for non-empty collections
+            mongo.db.surveys.insert_one({'survey_id': 'plan-survey', 'user_code': 'plan-creator', 'questions': []})
+            mongo.db.answers.insert_one({'survey_id': 'plan-survey', 'user_code': 'plan-user',
+                                         'answers': {'1': 3}, 'submitted_at': datetime.datetime.now(datetime.UTC)})
+            mongo.db.id_reserve.insert_one({'_id': 'plan-reserved', 'status': 'reserved', 'reserved_at': time.time()})
+            mongo.db.worker_leases.insert_one({'_id': 'plan-lease', 'owner': 'plan-owner', 'expires_at': time.time()})
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            mongo.db.surveys.delete_many({'survey_id': 'plan-survey'})
+            mongo.db.answers.delete_many({'survey_id': 'plan-survey'})
+            mongo.db.id_reserve.delete_one({'_id': 'plan-reserved'})
+            mongo.db.worker_leases.delete_one({'_id': 'plan-lease'})
+
+    def assertNoCollectionScan(self, explanation, description):
+        self.assertEqual(find_stages(explanation, 'COLLSCAN'), [], f"{description} does a collection scan")
+
+    def test_find_queries_use_indexes(self):
+        day_ago = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=24)
+        queries = [
+            ('surveys', {'survey_id': 'plan-survey'}),
+            ('surveys', {'user_code': 'plan-creator'}),
+            ('answers', {'survey_id': 'plan-survey'}),
+            ('answers', {'survey_id': 'plan-survey', 'submitted_at': {'$gte': day_ago}}),
+            ('answers', {'survey_id': 'plan-survey', 'user_code': 'plan-user'}),
+            ('answers', {'user_code': 'plan-user'}),
+            ('id_reserve', {'_id': 'plan-reserved'}),
+            ('id_reserve', {'_id': {'$in': ['plan-reserved', 'plan-other']}}),
+            ('id_reserve', {'status': 'available'}),
+            ('id_reserve', {'status': 'reserved', 'reserved_at': {'$lt': time.time()}}),
+            ('id_reserve', id_manager.claimable_filter()),
+            ('id_reserve', {'added_at': {'$gte': time.time() - 60}}),
+            ('survey_aggregates', {'_id': 'plan-survey'}),
+            ('worker_leases', {'expires_at': {'$lt': time.time()}}),
+        ]
+        with app.app_context():
+            for collection_name, query in queries:
+                explanation = mongo.db[collection_name].find(query).explain()
+                self.assertNoCollectionScan(explanation, f"{collection_name}.find({query})")
+
+    def test_summary_pipeline_uses_index(self):
+        with app.app_context():
+            explanation = mongo.db.command('aggregate', 'answers', pipeline=summary_pipeline('plan-survey'), explain=True)
+        self.assertNoCollectionScan(explanation, 'answers summary pipeline')
+
+    def test_ensure_indexes_is_idempotent(self):
+        with app.app_context():
+            before = mongo.db.answers.index_information()
+            ensure_indexes(mongo.db)
+            self.assertEqual(mongo.db.answers.index_information(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
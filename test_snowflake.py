@@ -0,0 +1,53 @@
+import threading
+import time
+import unittest
+from snowflake import IDS_PER_MILLI, Snowflake53
+
+
+class TestSnowflake53(unittest.TestCase):
+    def test_ids_fit_in_53_bits_and_carry_node(self):
+        generator = Snowflake53(datacenter_id=3, worker_id=17)
+        for id in generator.generate_batch(100):
+            self.assertLess(id, 2 ** 53)
+            self.assertEqual((id >> 7) & 0x1F, 3)
+            self.assertEqual((id >> 2) & 0x1F, 17)
+
+    def test_batch_is_increasing_and_unique(self):
+        generator = Snowflake53(1, 1)
+        batch = generator.generate_batch(1000)
+        self.assertEqual(batch, sorted(set(batch)))
+        self.assertGreater(generator.generate(), batch[-1])
+
+    def test_no_duplicates_across_threads(self):
+        generator = Snowflake53(1, 1, max_drift_ms=60000)
+        results = [[] for _ in range(8)]
+
+        def worker(ids):
+            for _ in range(2000):
+                ids.append(generator.generate())
+            for _ in range(20):
+                ids.extend(generator.generate_batch(250))
+
+        threads = [threading.Thread(target=worker, args=(ids,)) for ids in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_ids = [id for ids in results for id in ids]
+        self.assertEqual(len(all_ids), 8 * 7000)
+        self.assertEqual(len(set(all_ids)), len(all_ids))
+        for ids in results:
+            self.assertEqual(ids, sorted(ids))
+
+    def test_drift_is_bounded(self):
+        generator = Snowflake53(1, 1, max_drift_ms=0)
+        start = time.time()
+        ids = generator.generate_batch(IDS_PER_MILLI * 20)
+        # 20 milliseconds' worth of IDs cannot be handed out ahead of the clock
+        self.assertGreaterEqual(time.time() - start, 0.015)
+        self.assertLessEqual((ids[-1] >> 12), int(time.time() * 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
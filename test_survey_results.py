@@ -1,7 +1,47 @@
 import unittest
 import json
 import datetime
-from app import app, mongo, id_manager,make_tz_aware, MINIMUM_RESPONSES
+import random
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+from app import app, mongo, id_manager, survey_aggregates, survey_cache
+from surveys import (make_tz_aware, MINIMUM_RESPONSES, calculate_survey_statistics, build_survey_statistics, PopulationCache,
+                     get_participant_bucket, trending_filter)
+from aggregates import summarize_answers
+from reference_statistics import reference_survey_statistics
+from id_manager import IDManager, ReserveReplenisher
+
+@contextmanager
+def record_queries(collection_name):
+    """Record the read operations issued against one collection, ignoring nested calls."""
+    collection_class = type(mongo.db[collection_name])
+    queries = []
+    state = threading.local()
+
+    def wrap(method_name):
+        original = getattr(collection_class, method_name)
+
+        def wrapper(self, *args, **kwargs):
+            if getattr(state, 'active', False) or self.name != collection_name:
+                return original(self, *args, **kwargs)
+            queries.append(method_name)
+            state.active = True
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                state.active = False
+        return mock.patch.object(collection_class, method_name, wrapper)
+
+    patches = [wrap(name) for name in ('find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count')]
+    for patch in patches:
+        patch.start()
+    try:
+        yield queries
+    finally:
+        for patch in patches:
+            patch.stop()
 
 class TestSurveyResults(unittest.TestCase):
     
@@ -16,11 +56,13 @@ class TestSurveyResults(unittest.TestCase):
         with app.app_context():
             mongo.db.surveys.delete_many({})
             mongo.db.answers.delete_many({})
+            mongo.db.survey_aggregates.delete_many({})
 
     def setUp(self):
         with app.app_context():
             mongo.db.surveys.delete_many({})
             mongo.db.answers.delete_many({})
+            mongo.db.survey_aggregates.delete_many({})
         
         self.survey_data = {
             "title": "Customer Satisfaction Survey",
@@ -187,6 +229,59 @@ class TestSurveyResults(unittest.TestCase):
                                     content_type='application/json')
         self.assertEqual(response.status_code, 400)
 
+    def test_submit_answers_batch(self):
+        with app.app_context():
+            before = mongo.db.survey_aggregates.find_one({'_id': self.survey_id})
+        submissions = [
+            {"answers": [{"question_id": "1", "answer": 3}, {"question_id": "2", "answer": True}]},
+            {"answers": [{"question_id": "1", "answer": 6}]},  # Max is 5 for this question
+            {"user_code": "batch-kiosk-code", "answers": [{"question_id": "3", "answer": 7}]},
+            {"answers": [{"question_id": "4", "answer": False}]},
+        ]
+        response = self.client.post(f'/v1/surveys/{self.survey_id}/answers/batch',
+                                    data=json.dumps({"submissions": submissions}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual((data['accepted'], data['rejected']), (3, 1))
+        self.assertEqual([result['status'] for result in data['results']], [201, 400, 201, 201])
+        self.assertIn('error', data['results'][1])
+        self.assertEqual(data['results'][2]['user_code'], 'batch-kiosk-code')
+        user_codes = [data['results'][i]['user_code'] for i in (0, 2, 3)]
+        self.assertEqual(len(set(user_codes)), 3)
+
+        with app.app_context():
+            stored = list(mongo.db.answers.find({'survey_id': self.survey_id, 'user_code': {'$in': user_codes}}))
+            aggregate = mongo.db.survey_aggregates.find_one({'_id': self.survey_id})
+            used = mongo.db.id_reserve.count_documents({'_id': {'$in': user_codes[:1] + user_codes[2:]}, 'status': 'used'})
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(used, 2)
+        # One update for the whole batch
+        self.assertEqual(aggregate['response_count'], before['response_count'] + 3)
+        self.assertEqual(aggregate['version'], before['version'] + 1)
+
+        response = self.client.post(f'/v1/surveys/{self.survey_id}/answers/batch',
+                                    data=json.dumps({"submissions": submissions[1:2]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        for body in ([1, 2], "submissions", 7):
+            response = self.client.post(f'/v1/surveys/{self.survey_id}/answers/batch',
+                                        data=json.dumps(body),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+        # Malformed items are rejected one by one; the rest of the batch is stored
+        malformed = [5, {"answers": [5]}, {"answers": ["question_id answer"]}, {"answers": {"question_id": "1"}},
+                     {"answers": [{"question_id": "1", "answer": 4}]}]
+        response = self.client.post(f'/v1/surveys/{self.survey_id}/answers/batch',
+                                    data=json.dumps({"submissions": malformed}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual((data['accepted'], data['rejected']), (1, 4))
+        self.assertEqual([result['status'] for result in data['results']], [400, 400, 400, 400, 201])
+
     def test_creator_results(self):
         response = self.client.get(f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}')
         self.assertEqual(response.status_code, 200)
@@ -305,6 +400,146 @@ class TestSurveyResults(unittest.TestCase):
         data = json.loads(response.data)
         self.assertFalse(data['available'])
 
+    def test_replenisher_watermarks(self):
+        with app.app_context():
+            mongo.db.id_reserve_test.delete_many({})
+            # min_reserve=0 turns off the inline top-up, leaving refills to the replenisher
+            manager = IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0)
+            replenisher = ReserveReplenisher(manager, low_watermark=5, high_watermark=20)
+
+            self.assertEqual(replenisher.check(), 20)
+            self.assertEqual(manager.reserve.count_documents({'status': 'available'}), 20)
+
+            # Above the low watermark nothing is generated
+            manager.get_ids(10)
+            self.assertEqual(replenisher.check(), 0)
+            self.assertEqual(replenisher.stats()['pool_depth'], 10)
+
+            # Below it, the reserve is topped back up to the high watermark
+            manager.get_ids(6)
+            self.assertEqual(replenisher.check(), 16)
+            self.assertEqual(manager.reserve.count_documents({'status': 'available'}), 20)
+            self.assertEqual(replenisher.stats()['refills'], 2)
+            mongo.db.id_reserve_test.drop()
+
+    def test_replenishers_refill_once_between_them(self):
+        with app.app_context():
+            mongo.db.id_reserve_test.delete_many({})
+            mongo.db.locks.delete_many({'_id': 'id_reserve_test_refill'})
+            workers = [ReserveReplenisher(IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0),
+                                          low_watermark=5, high_watermark=20) for _ in range(4)]
+
+            # While one worker holds the lease, the others leave the refill to it
+            owner = workers[0].claim_refill()
+            self.assertEqual([worker.check() for worker in workers[1:]], [0, 0, 0])
+            workers[0].release_refill(owner)
+
+            threads = [threading.Thread(target=worker.check) for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(mongo.db.id_reserve_test.count_documents({'status': 'available'}), 20)
+            self.assertEqual(sum(worker.refills for worker in workers), 1)
+            mongo.db.id_reserve_test.drop()
+
+    def test_claim_ids_concurrently(self):
+        with app.app_context():
+            mongo.db.id_reserve_test.delete_many({})
+            manager = IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0)
+            manager.reserve.insert_many([{'_id': f'claim-test-{i}', 'status': 'available'} for i in range(100)])
+
+            results = []
+            def claim():
+                results.append(manager.claim_ids(20))
+            threads = [threading.Thread(target=claim) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            claimed = [id for ids in results for id in ids]
+            self.assertEqual([len(ids) for ids in results], [20] * 4)
+            self.assertEqual(len(set(claimed)), len(claimed))
+            self.assertEqual(manager.reserve.count_documents({'status': 'reserved'}), 80)
+
+            # Only 20 are left, so asking for more comes up short instead of failing
+            self.assertEqual(len(manager.claim_ids(50, status='used')), 20)
+            self.assertEqual(manager.claim_ids(5), [])
+            mongo.db.id_reserve_test.drop()
+
+    def test_expired_reservations_are_claimable(self):
+        with app.app_context():
+            mongo.db.id_reserve_test.delete_many({})
+            manager = IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0, reservation_timeout=60)
+            manager.reserve.insert_many([
+                {'_id': 'expired-reservation', 'status': 'reserved', 'reserved_at': time.time() - 120},
+                {'_id': 'fresh-reservation', 'status': 'reserved', 'reserved_at': time.time()}
+            ])
+
+            # Expiry is applied at read time, without resetting anything
+            self.assertTrue(manager.is_id_available('expired-reservation'))
+            self.assertFalse(manager.is_id_available('fresh-reservation'))
+            self.assertEqual(manager.reserve.count_documents({'status': 'reserved'}), 2)
+
+            self.assertEqual(manager.claim_ids(5), ['expired-reservation'])
+            self.assertFalse(manager.is_id_available('expired-reservation'))
+
+            # The sweeper resets whatever expired without being claimed
+            manager.reserve.update_one({'_id': 'fresh-reservation'}, {'$set': {'reserved_at': time.time() - 120}})
+            replenisher = ReserveReplenisher(manager, low_watermark=0, high_watermark=0)
+            self.assertEqual(replenisher.sweep_if_due(), 1)
+            self.assertEqual(manager.reserve.find_one({'_id': 'fresh-reservation'})['status'], 'available')
+            mongo.db.id_reserve_test.drop()
+
+    def test_batch_check_ids(self):
+        with app.app_context():
+            id_manager.load_id_filter()
+        available_id = id_manager.get_ids(count=1)[0]
+        id_manager.mark_id_as_used(available_id)
+        ids = [self.survey_id, available_id, 'never-seen-before-id', 'bad id!']
+
+        response = self.client.post('/v1/ids/check',
+                                    data=json.dumps({'ids': ids}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['ids']
+        self.assertEqual([r['id'] for r in results], ids)
+        self.assertEqual([r['available'] for r in results], [False, False, True, False])
+        self.assertIn('error', results[3])
+
+        # Every answer agrees with the single-ID endpoint
+        for result in results[:3]:
+            single = json.loads(self.client.get(f"/v1/ids/check?id={result['id']}").data)
+            self.assertEqual(single['available'], result['available'])
+
+        response = self.client.post('/v1/ids/check',
+                                    data=json.dumps({'ids': []}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_follows_other_workers(self):
+        with app.app_context():
+            mongo.db.id_reserve_test.delete_many({})
+            manager = IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0)
+            other_worker = IDManager(mongo.db, collection_name='id_reserve_test', min_reserve=0)
+            manager.load_id_filter()
+            other_worker.add_custom_id('taken-elsewhere')
+
+            # Until it syncs, the filter has not seen the other worker's ID
+            self.assertEqual(manager.check_ids(['taken-elsewhere']), [True])
+            self.assertEqual(manager.sync_id_filter(), 1)
+            self.assertEqual(manager.check_ids(['taken-elsewhere']), [False])
+            self.assertEqual(manager.sync_id_filter(), 0)
+
+            # A filter that has not synced lately is not trusted with misses
+            mongo.db.id_reserve_test.insert_one({'_id': 'written-by-hand', 'status': 'used'})
+            self.assertTrue(manager.is_id_available('written-by-hand', use_filter=True))
+            manager.filter_synced_at -= manager.filter_max_staleness + 1
+            self.assertFalse(manager.is_id_available('written-by-hand', use_filter=True))
+            self.assertEqual(manager.check_ids(['written-by-hand']), [False])
+            mongo.db.id_reserve_test.drop()
+
     def test_survey_expiry(self):
         # Test creating a survey with expiry date
         survey_data = self.survey_data.copy()
@@ -326,6 +561,7 @@ class TestSurveyResults(unittest.TestCase):
                 {'survey_id': survey_id},
                 {'$set': {'expiry_date': make_tz_aware(datetime.datetime.now() - datetime.timedelta(days=1)).isoformat()}}
             )
+            survey_cache.invalidate(survey_id)
         response = self.client.get(f'/v1/surveys/{survey_id}')
         self.assertEqual(response.status_code, 410)
         self.assertTrue(json.loads(response.data)['expired'])
@@ -341,6 +577,42 @@ class TestSurveyResults(unittest.TestCase):
         data = json.loads(response.data)
         self.assertTrue(data['is_trending'])
 
+    def test_trending_and_bucket_match_answers_queries(self):
+        def assert_matches_queries():
+            with app.app_context():
+                now = datetime.datetime.now(datetime.UTC)
+                expected_trending = bool(mongo.db.answers.find_one(trending_filter(self.survey_id, now)))
+                expected_bucket = get_participant_bucket(mongo.db.answers.count_documents({'survey_id': self.survey_id}))
+            for path in [f'/v1/surveys/{self.survey_id}',
+                         f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}']:
+                data = json.loads(self.client.get(path).data)
+                self.assertEqual(data['is_trending'], expected_trending, path)
+            self.assertEqual(data['participant_bucket'], expected_bucket)
+            return expected_trending
+
+        self.assertTrue(assert_matches_queries())
+        for _ in range(2):
+            self.add_sample_responses()
+        assert_matches_queries()
+
+        # Answers from before the trending window, whether the aggregate saw them
+        # arrive or is rebuilt from them
+        with app.app_context():
+            mongo.db.answers.update_many({'survey_id': self.survey_id},
+                                         {'$set': {'submitted_at': datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=2)}})
+            mongo.db.survey_aggregates.update_one({'_id': self.survey_id},
+                                                  {'$set': {'last_submitted_at': datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=2)}})
+        self.assertFalse(assert_matches_queries())
+        with app.app_context():
+            mongo.db.survey_aggregates.delete_one({'_id': self.survey_id})
+        self.assertFalse(assert_matches_queries())
+
+        # A new answer makes it trend again
+        self.client.post(f'/v1/surveys/{self.survey_id}/answers',
+                         data=json.dumps({"answers": [{"question_id": 1, "answer": 1}]}),
+                         content_type='application/json')
+        self.assertTrue(assert_matches_queries())
+
     def test_participant_bucket(self):
         # Test with less than 10 participants
         response = self.client.get(f'/v1/surveys/{self.survey_id}')
@@ -367,6 +639,176 @@ class TestSurveyResults(unittest.TestCase):
         self.assertIn('expiry_date', data)
         self.assertIn('expired', data)
     
+    def test_aggregate_matches_stored_answers(self):
+        with app.app_context():
+            survey = mongo.db.surveys.find_one({'survey_id': self.survey_id})
+            answers = list(mongo.db.answers.find({'survey_id': self.survey_id}))
+            aggregate = mongo.db.survey_aggregates.find_one({'_id': self.survey_id})
+
+        expected = summarize_answers(survey, answers)
+        self.assertEqual(aggregate['response_count'], len(answers))
+        self.assertEqual(aggregate['questions'], expected['questions'])
+        self.assertIsNotNone(aggregate.get('last_submitted_at'))
+
+    def test_results_match_full_scan(self):
+        participant_code = self.participant_codes[0]
+        with app.app_context():
+            survey = mongo.db.surveys.find_one({'survey_id': self.survey_id})
+            answers = list(mongo.db.answers.find({'survey_id': self.survey_id}))
+
+        for user_code, is_creator in [(self.creator_code, True), (participant_code, False)]:
+            response = self.client.get(f'/v1/surveys/{self.survey_id}/results?user_code={user_code}')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            with app.app_context():
+                expected = json.loads(app.json.dumps(calculate_survey_statistics(survey, answers, user_code, is_creator)))
+            self.assertEqual(data['questions'], expected['questions'])
+            self.assertEqual(data['overall_statistics'], expected['overall_statistics'])
+            self.assertEqual(data['total_responses'], expected['total_responses'])
+
+    def test_pipeline_statistics_match_python_statistics(self):
+        rng = random.Random(42)
+        for _ in range(25):
+            answers = [
+                {"question_id": 1, "answer": rng.randint(1, 5)},
+                {"question_id": 2, "answer": rng.choice([True, False])},
+                {"question_id": 3, "answer": rng.randint(1, 10)},
+                {"question_id": 4, "answer": rng.choice([True, False])}
+            ]
+            answers = [a for a in answers if rng.random() < 0.85]
+            resp = self.client.post(f'/v1/surveys/{self.survey_id}/answers',
+                                    data=json.dumps({"answers": answers}),
+                                    content_type='application/json')
+            self.assertEqual(resp.status_code, 201)
+            self.participant_codes.append(json.loads(resp.data)['user_code'])
+
+        with app.app_context():
+            survey = mongo.db.surveys.find_one({'survey_id': self.survey_id})
+            answers = list(mongo.db.answers.find({'survey_id': self.survey_id}))
+            summary = survey_aggregates.summarize(survey)
+
+            for user_code in [self.creator_code] + self.participant_codes[::7]:
+                is_creator = user_code == self.creator_code
+                user_answers = None
+                if not is_creator:
+                    user_answers = mongo.db.answers.find_one({'survey_id': self.survey_id, 'user_code': user_code})['answers']
+                expected = reference_survey_statistics(survey, answers, user_code, is_creator)
+                actual = build_survey_statistics(survey, summary, user_answers, user_code, is_creator)
+                self.assertEqual(app.json.dumps(actual), app.json.dumps(expected))
+                self.assertEqual(app.json.dumps(calculate_survey_statistics(survey, answers, user_code, is_creator)),
+                                 app.json.dumps(expected))
+
+    def test_missing_aggregate_is_rebuilt(self):
+        response = self.client.get(f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}')
+        before = json.loads(response.data)
+
+        with app.app_context():
+            mongo.db.survey_aggregates.delete_one({'_id': self.survey_id})
+
+        response = self.client.get(f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}')
+        self.assertEqual(response.status_code, 200)
+        after = json.loads(response.data)
+        self.assertEqual(after['questions'], before['questions'])
+        self.assertEqual(after['total_responses'], len(self.participant_codes))
+
+    def test_get_survey_does_not_query_answers(self):
+        with app.app_context():
+            with record_queries('answers') as queries:
+                response = self.client.get(f'/v1/surveys/{self.survey_id}')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertTrue(all(q['answer_distribution'] for q in data['questions']))
+        # Distributions, trending status and bucket all come from the aggregate
+        self.assertEqual(queries, [])
+
+        with app.app_context():
+            mongo.db.survey_aggregates.delete_one({'_id': self.survey_id})
+            with record_queries('answers') as queries:
+                response = self.client.get(f'/v1/surveys/{self.survey_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['questions'], data['questions'])
+        # Rebuilding a missing aggregate is a single server-side aggregation for all questions
+        self.assertEqual(queries.count('aggregate'), 1)
+        self.assertEqual(queries.count('find'), 0)
+
+    def test_cached_surveys_are_not_queried(self):
+        self.client.get(f'/v1/surveys/{self.survey_id}')
+        with app.app_context():
+            with record_queries('surveys') as queries:
+                self.assertEqual(self.client.get(f'/v1/surveys/{self.survey_id}').status_code, 200)
+                response = self.client.post(f'/v1/surveys/{self.survey_id}/answers',
+                                            data=json.dumps({"answers": [{"question_id": 1, "answer": 9}]}),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post(f'/v1/surveys/{self.survey_id}/answers',
+                                            data=json.dumps({"answers": [{"question_id": 1, "answer": 2}]}),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 201)
+                for path in [f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}',
+                             f'/v1/surveys/results?user_code={self.creator_code}']:
+                    self.assertEqual(self.client.get(path).status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_conditional_get_skips_answers_queries(self):
+        paths = [
+            f'/v1/surveys/{self.survey_id}',
+            f'/v1/surveys/{self.survey_id}/results?user_code={self.creator_code}',
+            f'/v1/surveys/{self.survey_id}/results?user_code={self.participant_codes[0]}'
+        ]
+        etags = {}
+        for path in paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('no-cache', response.headers['Cache-Control'])
+            etags[path] = response.headers['ETag']
+
+            with app.app_context():
+                with record_queries('answers') as queries:
+                    response = self.client.get(path, headers={'If-None-Match': etags[path]})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etags[path])
+            self.assertEqual(queries, [])
+        # Results are per user, so every user code has its own ETag
+        self.assertEqual(len(set(etags.values())), len(paths))
+
+        self.client.post(f'/v1/surveys/{self.survey_id}/answers',
+                         data=json.dumps({"answers": [{"question_id": 1, "answer": 1}]}),
+                         content_type='application/json')
+        for path in paths:
+            response = self.client.get(path, headers={'If-None-Match': etags[path]})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etags[path])
+
+    def test_population_cache_matches_uncached_results(self):
+        with app.app_context():
+            survey = mongo.db.surveys.find_one({'survey_id': self.survey_id})
+            aggregate = survey_aggregates.get(survey)
+            answers = {a['user_code']: a['answers'] for a in mongo.db.answers.find({'survey_id': self.survey_id})}
+
+        cache = PopulationCache(maxsize=4)
+        users = [(self.creator_code, None, True)] + [(code, answers[code], False) for code in self.participant_codes]
+        for user_code, user_answers, is_creator in users:
+            cached = build_survey_statistics(survey, aggregate, user_answers, user_code, is_creator,
+                                             cache.get(survey, aggregate))
+            self.assertEqual(cached, build_survey_statistics(survey, aggregate, user_answers, user_code, is_creator))
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], len(users) - 1)
+
+        # A new answer bumps the aggregate version, so the cached entry is not reused
+        aggregate = dict(aggregate, version=aggregate['version'] + 1)
+        cache.get(survey, aggregate)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_cache_stats_endpoint(self):
+        before = json.loads(self.client.get('/v1/stats/cache').data)['population_statistics']
+        for user_code in [self.creator_code] + self.participant_codes:
+            self.client.get(f'/v1/surveys/{self.survey_id}/results?user_code={user_code}')
+        after = json.loads(self.client.get('/v1/stats/cache').data)['population_statistics']
+        self.assertEqual(after['hits'] + after['misses'] - before['hits'] - before['misses'], len(self.participant_codes) + 1)
+        self.assertGreaterEqual(after['hits'] - before['hits'], len(self.participant_codes))
+
     def test_survey_with_no_responses(self):
         # Create a new survey without adding any responses
         response = self.client.post('/v1/surveys',
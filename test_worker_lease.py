@@ -0,0 +1,73 @@
+import time
+import unittest
+from app import app, mongo
+from worker_lease import EXPIRY_MARGIN, WorkerLease
+
+
+class TestWorkerLease(unittest.TestCase):
+    collection_name = 'worker_leases_test'
+
+    def setUp(self):
+        with app.app_context():
+            self.leases = mongo.db[self.collection_name]
+            self.leases.delete_many({})
+        self.held = []
+
+    def tearDown(self):
+        for lease in self.held:
+            lease.release()
+        self.leases.delete_many({})
+
+    def lease(self, **kwargs):
+        lease = WorkerLease(mongo.db, collection_name=self.collection_name, **kwargs)
+        self.held.append(lease)
+        return lease
+
+    def test_workers_get_distinct_slots(self):
+        leases = [self.lease(slots=8) for _ in range(8)]
+        generators = [lease.generator() for lease in leases]
+        self.assertEqual(len({lease.slot for lease in leases}), 8)
+        self.assertEqual(len({(g.datacenter_id, g.worker_id) for g in generators}), 8)
+        with self.assertRaises(RuntimeError):
+            self.lease(slots=8).generator()
+
+    def test_expired_lease_is_taken_over(self):
+        first = self.lease(slots=1)
+        first.generator()
+        self.leases.update_one({'_id': first.slot}, {'$set': {'expires_at': time.time() - 1}})
+
+        second = self.lease(slots=1)
+        second.generator()
+        self.assertEqual(second.slot, first.slot)
+        # The previous holder finds out on its next heartbeat and stops using the slot
+        self.assertFalse(first.heartbeat())
+        self.assertIsNone(first.slot)
+
+    def test_release_frees_slot_after_the_margin(self):
+        first = self.lease(slots=2)
+        first.generator()
+        released = first.slot
+        first.release()
+        self.assertLessEqual(self.leases.find_one({'_id': released})['expires_at'], time.time() + EXPIRY_MARGIN)
+
+        # Within the margin the slot stays out of reach, so a fast restart takes another
+        restarted = self.lease(slots=2)
+        restarted.generator()
+        self.assertNotEqual(restarted.slot, released)
+        with self.assertRaises(RuntimeError):
+            self.lease(slots=2).generator()
+
+        self.leases.update_one({'_id': released}, {'$set': {'expires_at': time.time() - 1}})
+        later = self.lease(slots=2)
+        later.generator()
+        self.assertEqual(later.slot, released)
+
+    def test_ids_unique_across_workers(self):
+        ids = []
+        for lease in [self.lease() for _ in range(4)]:
+            ids.extend(lease.generator().generate_batch(100))
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import BulkWriteError
+from app import app, id_manager, mongo, survey_aggregates
+from surveys import new_submission
+from write_buffer import WriteBuffer, WriteBufferFull
+
+
+class BlockingAggregates:
+    """Holds the flusher in record_submissions until released."""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def record_submissions(self, survey, documents):
+        self.entered.set()
+        self.release.wait(10)
+
+
+class FailingAggregates:
+    def record_submissions(self, survey, documents):
+        raise RuntimeError("aggregate update failed")
+
+
+class TestWriteBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        with app.app_context():
+            mongo.db.answers.delete_many({})
+        response = self.client.post('/v1/surveys', json={
+            'title': 'Buffered',
+            'questions': [{'text': 'Scale', 'response_type': 'scale', 'response_scale_max': 5, 'creator_answer': 3}]
+        })
+        self.survey = mongo.db.surveys.find_one({'survey_id': response.get_json()['survey_id']})
+
+    def submission(self, i):
+        return new_submission(self.survey['survey_id'], f'buffered-{i}', [{'question_id': 1, 'answer': i % 5 + 1}])
+
+    def test_concurrent_submissions_are_batched(self):
+        buffer = WriteBuffer(mongo.db, survey_aggregates, id_manager, max_batch=20, linger_ms=20)
+        with ThreadPoolExecutor(40) as pool:
+            list(pool.map(lambda i: buffer.submit(self.survey, self.submission(i)), range(100)))
+
+        aggregate = mongo.db.survey_aggregates.find_one({'_id': self.survey['survey_id']})
+        self.assertEqual(mongo.db.answers.count_documents({'survey_id': self.survey['survey_id']}), 100)
+        self.assertEqual(aggregate['response_count'], 100)
+        self.assertEqual(aggregate['questions']['1']['sum'], sum(i % 5 + 1 for i in range(100)))
+        stats = buffer.stats()
+        self.assertEqual((stats['written'], stats['failed'], stats['pending']), (100, 0, 0))
+        self.assertLess(stats['batches'], 100)
+        self.assertEqual(aggregate['version'], stats['batches'])
+        self.assertIsNotNone(stats['ack_latency']['p99_ms'])
+
+    def test_full_buffer_rejects(self):
+        aggregates = BlockingAggregates()
+        buffer = WriteBuffer(mongo.db, aggregates, id_manager, max_batch=1, linger_ms=0, max_pending=1,
+                             full_policy='reject')
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(buffer.submit, self.survey, self.submission(0))
+            self.assertTrue(aggregates.entered.wait(10))  # The flusher holds the first one
+            second = pool.submit(buffer.submit, self.survey, self.submission(1))
+            while buffer.queue.qsize() < 1:
+                time.sleep(0.001)
+            with self.assertRaises(WriteBufferFull):
+                buffer.submit(self.survey, self.submission(2))
+            aggregates.release.set()
+            first.result(10)
+            second.result(10)
+        self.assertEqual(buffer.stats()['rejected'], 1)
+
+    def test_stored_submissions_are_acknowledged_when_aggregates_fail(self):
+        buffer = WriteBuffer(mongo.db, FailingAggregates(), id_manager)
+        buffer.submit(self.survey, self.submission(0))
+        self.assertEqual(mongo.db.answers.count_documents({'survey_id': self.survey['survey_id']}), 1)
+        stats = buffer.stats()
+        self.assertEqual((stats['written'], stats['failed'], stats['unrecorded']), (1, 0, 1))
+
+    def test_insert_errors_reach_callers(self):
+        buffer = WriteBuffer(mongo.db, survey_aggregates, id_manager, max_batch=2, linger_ms=50)
+        duplicate = self.submission(0)
+        mongo.db.answers.insert_one(duplicate)
+        with ThreadPoolExecutor(2) as pool:
+            failing = pool.submit(buffer.submit, self.survey, duplicate)
+            stored = pool.submit(buffer.submit, self.survey, self.submission(1))
+            stored.result(10)
+            with self.assertRaises(BulkWriteError):
+                failing.result(10)
+        stats = buffer.stats()
+        self.assertEqual((stats['written'], stats['failed'], stats['unrecorded']), (1, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
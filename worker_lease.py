@@ -0,0 +1,151 @@
+# worker_lease.py
+#
+# Hands every process that generates Snowflake IDs its own datacenter/worker ID
+# pair. Pairs are leased from a Mongo collection with one document per slot:
+#
+#     {'_id': <slot 0-1023>, 'owner': '<host>:<pid>:<nonce>', 'expires_at': <epoch seconds>}
+#
+# A background thread renews the lease every heartbeat_interval seconds. If a
+# process dies its lease runs out after ttl seconds and the slot can be taken over.
+# A process that exits cleanly shortens its lease to EXPIRY_MARGIN instead.
+
+import atexit
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from snowflake import MAX_DRIFT_MS, Snowflake53
+
+log = logging.getLogger('percept.worker_lease')
+
+WORKER_SLOTS = 1 << 10  # 5 bits of datacenter ID and 5 bits of worker ID
+LEASE_TTL = 60  # seconds a lease lasts without a heartbeat
+HEARTBEAT_INTERVAL = 15  # seconds between lease renewals
+# A holder stops using its slot this long before the lease expires, so its last
+# IDs, which can run up to MAX_DRIFT_MS ahead of the clock, never overlap with the
+# first IDs of whoever takes the slot over.
+EXPIRY_MARGIN = 5
+
+
+class WorkerLease:
+    """
+    A lease on one Snowflake worker slot for the current process.
+
+    Nothing is leased until generator() is first called, so a lease taken before
+    gunicorn forks is never shared by the workers: each one leases its own.
+    """
+
+    def __init__(self, db, collection_name='worker_leases', ttl=LEASE_TTL, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 slots=WORKER_SLOTS):
+        if ttl - EXPIRY_MARGIN <= heartbeat_interval:
+            raise ValueError("ttl must leave room for at least one heartbeat before the expiry margin")
+        self.leases = db[collection_name]
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.slots = slots
+        self.owner = None
+        self.slot = None
+        self.valid_until = 0
+        self.snowflake = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        atexit.register(self.release)
+
+    def generator(self):
+        """The Snowflake53 generator for this process's leased slot, leasing one first if needed."""
+        with self.lock:
+            if self.pid != os.getpid() or self.slot is None or time.time() >= self.valid_until:
+                self.acquire()
+            return self.snowflake
+
+    def acquire(self):
+        """Lease a slot, preferring one whose previous holder let its lease expire."""
+        if self.pid != os.getpid():
+            # Forked from the process that held the lease; it is not ours
+            self.pid = os.getpid()
+            self.owner = f"{socket.gethostname()}:{self.pid}:{uuid.uuid4().hex[:8]}"
+            self.slot = None
+        now = time.time()
+        lease = self.leases.find_one_and_update(
+            {'expires_at': {'$lt': now}},
+            {'$set': {'owner': self.owner, 'expires_at': now + self.ttl}},
+            return_document=ReturnDocument.AFTER
+        )
+        slot = lease['_id'] if lease else self._lease_unused_slot(now)
+
+        if slot != self.slot or self.snowflake is None:
+            self.snowflake = Snowflake53(slot >> 5, slot & 0x1F, max_drift_ms=MAX_DRIFT_MS)
+        self.slot = slot
+        self.valid_until = now + self.ttl - EXPIRY_MARGIN
+        log.info("Leased Snowflake worker slot %s for %s", slot, self.owner)
+        self._start_heartbeat()
+        return slot
+
+    def _lease_unused_slot(self, now):
+        taken = {lease['_id'] for lease in self.leases.find({}, {'_id': 1})}
+        free = [slot for slot in range(self.slots) if slot not in taken]
+        random.shuffle(free)
+        for slot in free:
+            try:
+                self.leases.insert_one({'_id': slot, 'owner': self.owner, 'expires_at': now + self.ttl})
+                return slot
+            except DuplicateKeyError:
+                continue  # Another process got there first
+        raise RuntimeError(f"All {self.slots} Snowflake worker slots are leased")
+
+    def heartbeat(self):
+        """Renew the lease. Returns False, and drops the slot, if it has been lost."""
+        with self.lock:
+            if self.slot is None or self.pid != os.getpid():
+                return False
+            now = time.time()
+            result = self.leases.update_one(
+                {'_id': self.slot, 'owner': self.owner},
+                {'$set': {'expires_at': now + self.ttl}}
+            )
+            if result.matched_count == 0:
+                log.warning("Lost the lease on Snowflake worker slot %s", self.slot)
+                self.slot = None
+                return False
+            self.valid_until = now + self.ttl - EXPIRY_MARGIN
+            return True
+
+    def _start_heartbeat(self):
+        # A thread started before a fork is not alive in the child
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='worker-lease-heartbeat', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                log.error("Worker lease heartbeat failed: %s", e)
+
+    def release(self):
+        """
+        Give the slot back. It can be leased again EXPIRY_MARGIN seconds later, once
+        the clock has caught up with the last IDs generated here.
+        """
+        self.stopped.set()
+        with self.lock:
+            if self.slot is None or self.pid != os.getpid():
+                return
+            try:
+                self.leases.update_one(
+                    {'_id': self.slot, 'owner': self.owner},
+                    {'$set': {'expires_at': time.time() + EXPIRY_MARGIN}}
+                )
+            except Exception as e:
+                log.error("Failed to release Snowflake worker slot %s: %s", self.slot, e)
+            self.slot = None
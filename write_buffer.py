@@ -0,0 +1,237 @@
+# write_buffer.py
+#
+# Group commit for answer submissions. With WRITE_BUFFER=1, submit_answers hands
+# each validated submission to a WriteBuffer instead of writing it itself. A
+# flusher thread drains the buffer in batches of up to WRITE_BUFFER_BATCH
+# submissions, or whatever arrived within WRITE_BUFFER_LINGER_MS of the first.
+# Each batch is written with one insert_many, one aggregate update per survey and
+# one id_reserve update, instead of three writes per submission. Callers block
+# until their batch is stored, so a 201 still means the answers are in Mongo.
+#
+# Batching only helps when a worker handles many requests at once, i.e. with
+# threaded or gevent gunicorn workers (e.g. `gunicorn -k gthread --threads 32`).
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pymongo.errors import BulkWriteError
+
+log = logging.getLogger('percept.write_buffer')
+
+WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER', '').lower() in ('1', 'true', 'yes')
+WRITE_BUFFER_BATCH = int(os.environ.get('WRITE_BUFFER_BATCH', 500))  # submissions per flush
+WRITE_BUFFER_LINGER_MS = float(os.environ.get('WRITE_BUFFER_LINGER_MS', 5))  # wait for a batch to fill
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', 10000))  # submissions queued at most
+# When the queue is full, 'block' waits up to WRITE_BUFFER_BLOCK_TIMEOUT seconds for
+# room and 'reject' fails at once. Either way the caller gets WriteBufferFull.
+WRITE_BUFFER_FULL_POLICY = os.environ.get('WRITE_BUFFER_FULL_POLICY', 'block')
+WRITE_BUFFER_BLOCK_TIMEOUT = float(os.environ.get('WRITE_BUFFER_BLOCK_TIMEOUT', 1.0))
+ACK_TIMEOUT = 30  # seconds a caller waits for its batch to be written
+LATENCY_SAMPLES = 4096  # recent latencies kept for the percentiles in stats()
+
+
+class WriteBufferFull(Exception):
+    """The buffer had no room for a submission. Callers should answer 503 and let the client retry."""
+
+
+class PendingWrite:
+    __slots__ = ('survey', 'document', 'enqueued_at', 'done', 'error')
+
+    def __init__(self, survey, document):
+        self.survey = survey
+        self.document = document
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.error = None
+
+
+def percentiles(samples):
+    """p50/p95/p99/max of latency samples in seconds, reported in milliseconds."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    summary = {}
+    for p in (50, 95, 99):
+        summary[f'p{p}_ms'] = round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000, 3)
+    summary['max_ms'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+class WriteBuffer:
+    """
+    A bounded queue of answer submissions, written to Mongo in batches by a flusher thread.
+
+    The queue and thread are created on first use in each process, so a buffer made
+    before gunicorn forks is never shared by the workers.
+    """
+
+    def __init__(self, db, survey_aggregates, id_manager, global_counters=None, max_batch=WRITE_BUFFER_BATCH,
+                 linger_ms=WRITE_BUFFER_LINGER_MS, max_pending=WRITE_BUFFER_MAX_PENDING,
+                 full_policy=WRITE_BUFFER_FULL_POLICY, block_timeout=WRITE_BUFFER_BLOCK_TIMEOUT, ack_timeout=ACK_TIMEOUT):
+        if full_policy not in ('block', 'reject'):
+            raise ValueError("full_policy must be 'block' or 'reject'")
+        self.answers = db.answers
+        self.survey_aggregates = survey_aggregates
+        self.id_manager = id_manager
+        self.global_counters = global_counters
+        self.max_batch = max_batch
+        self.linger = linger_ms / 1000
+        self.max_pending = max_pending
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.ack_timeout = ack_timeout
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.batches = self.written = self.failed = self.rejected = self.unrecorded = 0
+        self.ack_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.flush_durations = deque(maxlen=LATENCY_SAMPLES)
+        self.batch_sizes = deque(maxlen=LATENCY_SAMPLES)
+
+    def _pending_queue(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.queue = queue.Queue(self.max_pending)
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), name='write-buffer', daemon=True)
+                self.thread.start()
+            return self.queue
+
+    def submit(self, survey, document):
+        """
+        Queue a submission and wait until the batch it joins has been written.
+
+        Args:
+            survey (dict): The survey the submission answers.
+            document (dict): The answers document to store, from new_submission.
+
+        Raises:
+            WriteBufferFull: The queue had no room, per the full policy.
+            TimeoutError: The batch was not written within ack_timeout. It may still be.
+            Exception: Whatever the write raised.
+        """
+        pending = PendingWrite(survey, document)
+        pending_queue = self._pending_queue()
+        try:
+            if self.full_policy == 'reject':
+                pending_queue.put_nowait(pending)
+            else:
+                pending_queue.put(pending, timeout=self.block_timeout)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            raise WriteBufferFull(f"Write buffer is full ({self.max_pending} submissions pending)")
+        if not pending.done.wait(self.ack_timeout):
+            raise TimeoutError(f"Submission was not written within {self.ack_timeout}s")
+        if pending.error is not None:
+            raise pending.error
+
+    def run(self, pending_queue):
+        while True:
+            batch = [pending_queue.get()]
+            deadline = time.perf_counter() + self.linger
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending_queue.get_nowait())
+                except queue.Empty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(pending_queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Write a batch and wake its callers. Runs on the flusher thread."""
+        started = time.perf_counter()
+        stored = self.insert(batch)
+        if stored:
+            self.record(stored)
+
+        finished = time.perf_counter()
+        with self.lock:
+            self.batches += 1
+            self.batch_sizes.append(len(batch))
+            self.flush_durations.append(finished - started)
+            for pending in batch:
+                if pending.error is None:
+                    self.written += 1
+                else:
+                    self.failed += 1
+                self.ack_latencies.append(finished - pending.enqueued_at)
+        for pending in batch:
+            pending.done.set()
+
+    def insert(self, batch):
+        """Insert a batch's answers, setting the error of each submission that was not stored. Returns the stored ones."""
+        try:
+            self.answers.insert_many([pending.document for pending in batch], ordered=False)
+        except BulkWriteError as e:
+            # Only the documents that failed are lost; the rest are stored
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            if not failed:
+                failed = range(len(batch))
+            log.error("Write buffer insert of %s submissions failed for %s: %s", len(batch), len(failed), e)
+            for index in failed:
+                batch[index].error = e
+        except Exception as e:
+            log.error("Write buffer insert of %s submissions failed: %s", len(batch), e)
+            for pending in batch:
+                pending.error = e
+        return [pending for pending in batch if pending.error is None]
+
+    def record(self, stored):
+        """
+        Fold stored submissions into their aggregates and mark their user codes used.
+
+        The answers are already in Mongo, so their callers are acknowledged even if
+        this fails. A failure is logged and counted; `python aggregates.py audit --fix`
+        repairs the aggregates it leaves behind.
+        """
+        by_survey = {}
+        for pending in stored:
+            by_survey.setdefault(pending.survey['survey_id'], (pending.survey, []))[1].append(pending.document)
+        unrecorded = 0
+        for survey_id, (survey, documents) in by_survey.items():
+            try:
+                self.survey_aggregates.record_submissions(survey, documents)
+            except Exception as e:
+                unrecorded += len(documents)
+                log.error("Aggregate update for %s stored submissions to survey %s failed: %s", len(documents), survey_id, e)
+        try:
+            self.id_manager.mark_ids_as_used(list({pending.document['user_code'] for pending in stored}))
+        except Exception as e:
+            log.error("Marking %s user codes used failed: %s", len(stored), e)
+        if self.global_counters:
+            try:
+                self.global_counters.record_answers(len(stored))
+            except Exception as e:
+                log.error("Counting %s stored submissions failed: %s", len(stored), e)
+        if unrecorded:
+            with self.lock:
+                self.unrecorded += unrecorded
+
+    def stats(self):
+        """Counters and latency percentiles for this process, for /v1/stats/write_buffer."""
+        with self.lock:
+            batch_sizes = list(self.batch_sizes)
+            return {
+                'pending': self.queue.qsize() if self.queue is not None and self.pid == os.getpid() else 0,
+                'max_pending': self.max_pending,
+                'batches': self.batches,
+                'written': self.written,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                # Stored, but missing from their survey's aggregate
+                'unrecorded': self.unrecorded,
+                'mean_batch_size': round(sum(batch_sizes) / len(batch_sizes), 1) if batch_sizes else None,
+                # Enqueue to acknowledgement, as seen by callers
+                'ack_latency': percentiles(self.ack_latencies),
+                'flush_duration': percentiles(self.flush_durations),
+            }